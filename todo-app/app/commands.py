@@ -0,0 +1,190 @@
+import os
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from app import db
+from app import migrations
+from app.utils import storage
+from app.utils import transfer
+
+@click.command('db-upgrade')
+def db_upgrade_command():
+    """Apply pending schema migrations"""
+    applied = migrations.upgrade()
+    if applied:
+        click.echo(f'Applied migrations: {", ".join(str(v) for v in applied)}')
+    else:
+        click.echo('Database is already up to date.')
+
+@click.command('db-version')
+def db_version_command():
+    """Show the applied and latest schema version"""
+    with db.engine.begin() as conn:
+        version = migrations.current_version(conn)
+    click.echo(f'Schema version {version} (latest {migrations.HEAD_VERSION})')
+
+@click.command('rebuild-task-counts')
+def rebuild_task_counts_command():
+    """Recompute every user's task counters from the tasks table"""
+    users = storage.rebuild_all_task_counts()
+    click.echo(f'Rebuilt task counters for {users} users.')
+
+def _get_user(username):
+    user = storage.find_user(username)
+    if user is None:
+        raise click.ClickException(f'No user named {username!r}')
+    return user
+
+@click.command('export-tasks')
+@click.argument('username')
+@click.option('--format', 'file_format', type=click.Choice(['ndjson', 'csv']), default='ndjson')
+@click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-')
+def export_tasks_command(username, file_format, output):
+    """Write all tasks of USERNAME as NDJSON or CSV (streamed, constant memory)"""
+    user = _get_user(username)
+    chunks = transfer.export_csv(user.id) if file_format == 'csv' else transfer.export_ndjson(user.id)
+    for chunk in chunks:
+        output.write(chunk)
+
+@click.command('import-tasks')
+@click.argument('username')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'file_format', type=click.Choice(transfer.FORMATS), default=None,
+              help='Defaults to a guess from the file name (.csv, .json = legacy array, else NDJSON).')
+@click.option('--batch-size', default=1000, show_default=True)
+def import_tasks_command(username, source, file_format, batch_size):
+    """Import tasks for USERNAME from SOURCE, including the legacy data/tasks.json"""
+    user = _get_user(username)
+    file_format = file_format or transfer.guess_format(source.name)
+    imported, skipped = transfer.import_tasks(
+        user.id, source, file_format, batch_size,
+        progress=lambda count: click.echo(f'  {count} imported...', err=True)
+    )
+    click.echo(f'Imported {imported} tasks for {username} ({skipped} skipped: not an object or no title).')
+
+@click.command('delete-user')
+@click.argument('username')
+@click.option('--chunk-size', type=int, default=None, help='Defaults to ACCOUNT_DELETE_CHUNK_SIZE.')
+@click.confirmation_option(prompt='Delete this user and all of their data?')
+def delete_user_command(username, chunk_size):
+    """Delete USERNAME with all their tasks, archive, jobs and sync history"""
+    user = _get_user(username)
+    deleted = storage.delete_user_account(
+        user.id, chunk_size or current_app.config['ACCOUNT_DELETE_CHUNK_SIZE'],
+        on_chunk=lambda count: click.echo(f'  {count} tasks deleted...', err=True)
+    )
+    click.echo(f'Deleted {username} and {deleted} tasks.')
+
+@click.command('archive-tasks')
+@click.option('--days', type=int, default=None, help='Defaults to ARCHIVE_AFTER_DAYS.')
+@click.option('--batch-size', type=int, default=None, help='Defaults to ARCHIVE_BATCH_SIZE.')
+def archive_tasks_command(days, batch_size):
+    """Move tasks completed more than --days ago into the archive table
+
+    Safe to interrupt: every batch commits on its own and a re-run picks up the rest.
+    """
+    days = current_app.config['ARCHIVE_AFTER_DAYS'] if days is None else days
+    users, archived = storage.archive_all_completed_tasks(
+        datetime.utcnow() - timedelta(days=days),
+        batch_size or current_app.config['ARCHIVE_BATCH_SIZE'],
+        on_batch=lambda count: click.echo(f'  {count} archived...', err=True)
+    )
+    click.echo(f'Archived {archived} tasks of {users} users completed more than {days} days ago.')
+
+def _provision_batches(source, file_format, batch_size):
+    """Split the records of SOURCE into batches of valid users plus a count of invalid ones"""
+    batch, invalid = [], 0
+    for record in transfer.parse_records(source, file_format):
+        if not isinstance(record, dict):
+            invalid += 1
+            continue
+        username = str(record.get('username') or '').strip()
+        email = str(record.get('email') or '').strip()
+        password = str(record.get('password') or '')
+        # Same rules as the registration form
+        if not username or not email or len(password) < 6:
+            invalid += 1
+            continue
+        batch.append((username, email, password))
+        if len(batch) >= batch_size:
+            yield batch, invalid
+            batch, invalid = [], 0
+    yield batch, invalid
+
+@click.command('provision-users')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'file_format', type=click.Choice(['ndjson', 'csv']), default=None,
+              help='Defaults to csv for .csv files, else NDJSON.')
+@click.option('--batch-size', default=1000, show_default=True)
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True,
+              help='Processes hashing passwords in parallel (0 hashes in this process).')
+def provision_users_command(source, file_format, batch_size, workers):
+    """Create users in bulk from SOURCE rows of username, email and password
+
+    Passwords are hashed in parallel and every batch is one INSERT; users
+    whose username or email is already taken are skipped.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    file_format = file_format or ('csv' if source.name.endswith('.csv') else 'ndjson')
+    hasher = current_app.extensions['passwords']
+    created = existing = invalid = 0
+    pool = ProcessPoolExecutor(max_workers=workers) if workers else None
+    try:
+        for batch, batch_invalid in _provision_batches(source, file_format, batch_size):
+            invalid += batch_invalid
+            hashes = hasher.hash_many([password for _, _, password in batch], pool)
+            count = storage.insert_user_rows([
+                {'username': username, 'email': email, 'password_hash': pwhash}
+                for (username, email, _), pwhash in zip(batch, hashes)
+            ])
+            created += count
+            existing += len(batch) - count
+            click.echo(f'  {created} created...', err=True)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    click.echo(f'Created {created} users ({existing} already taken, {invalid} invalid).')
+
+@click.command('compile-templates')
+def compile_templates_command():
+    """Compile every template into the bytecode cache so workers start warm"""
+    env = current_app.jinja_env
+    if env.bytecode_cache is None:
+        raise click.ClickException('TEMPLATE_CACHE_DIR is not set.')
+    names = env.list_templates()
+    for name in names:
+        env.get_template(name)
+    click.echo(f'Compiled {len(names)} templates into {current_app.config["TEMPLATE_CACHE_DIR"]}.')
+
+@click.command('compact-task-log')
+def compact_task_log_command():
+    """Rewrite the TASK_STORE=log file with only its live lines
+
+    Needs the log to itself: while the server has it open the app cannot be
+    created here (TaskLogLocked) - stop the server first.
+    """
+    store = current_app.extensions['task_store']
+    if not hasattr(store, 'compact'):
+        raise click.ClickException('TASK_STORE is not set to log.')
+    before = os.path.getsize(store.path)
+    store.compact()
+    click.echo(f'Compacted {store.path} from {before} to {os.path.getsize(store.path)} bytes.')
+
+@click.command('startup-report')
+def startup_report_command():
+    """Show how long each create_app() phase took for this process"""
+    click.echo(current_app.extensions['startup_timer'].report())
+
+def register_commands(app):
+    """Attach the maintenance commands to the `flask` CLI"""
+    app.cli.add_command(db_upgrade_command)
+    app.cli.add_command(db_version_command)
+    app.cli.add_command(rebuild_task_counts_command)
+    app.cli.add_command(export_tasks_command)
+    app.cli.add_command(import_tasks_command)
+    app.cli.add_command(provision_users_command)
+    app.cli.add_command(archive_tasks_command)
+    app.cli.add_command(delete_user_command)
+    app.cli.add_command(compact_task_log_command)
+    app.cli.add_command(compile_templates_command)
+    app.cli.add_command(startup_report_command)
@@ -0,0 +1,261 @@
+from datetime import datetime
+from flask import current_app, has_app_context
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from app import db
+
+# Versioned schema changes for databases that already exist.
+#
+# db.create_all() only creates missing tables, so anything added to an
+# existing table (indexes, columns, constraints) needs an entry here. Every
+# migration is written to be safe to run again (IF NOT EXISTS and friends),
+# so a fresh database that create_all() already brought up to date just
+# records the version. Append new entries - never edit applied ones.
+#
+# create_app() skips create_all() once schema_version is at HEAD_VERSION,
+# so new tables need an entry here as well.
+
+def _create_task_indexes(conn):
+    """Composite indexes for the task list access paths"""
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_tasks_user_created ON tasks (user_id, created_at)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_tasks_user_status_created ON tasks (user_id, status, created_at)'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_tasks_user_title ON tasks (user_id, lower(title))'))
+
+def _has_column(conn, table, column):
+    """Whether an existing table already has a column"""
+    return column in {col['name'] for col in inspect(conn).get_columns(table)}
+
+def _add_task_stats_version(conn):
+    """Per-user data version used for ETags"""
+    if not _has_column(conn, 'task_stats', 'version'):
+        conn.execute(text('ALTER TABLE task_stats ADD COLUMN version BIGINT NOT NULL DEFAULT 0'))
+
+def _sqlite_fts5_available(conn):
+    """FTS5 is compiled into nearly every SQLite build, but not all"""
+    return bool(conn.execute(text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar())
+
+def _create_task_search(conn):
+    """Full-text search over task titles and descriptions, kept in sync by the database"""
+    if conn.dialect.name == 'postgresql':
+        if not _has_column(conn, 'tasks', 'search_vector'):
+            conn.execute(text(
+                "ALTER TABLE tasks ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+                "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+                "setweight(to_tsvector('english', coalesce(description, '')), 'B')) STORED"
+            ))
+        conn.execute(text('CREATE INDEX IF NOT EXISTS ix_tasks_search ON tasks USING GIN (search_vector)'))
+        return
+    
+    if conn.dialect.name != 'sqlite' or not _sqlite_fts5_available(conn):
+        return  # search falls back to LIKE scans
+    exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'tasks_fts'")).scalar()
+    if not exists:
+        # The owner column holds a 'u<id>' token so a user filter is answered by the FTS index
+        conn.execute(text('CREATE VIRTUAL TABLE tasks_fts USING fts5(title, description, owner)'))
+        conn.execute(text(
+            "INSERT INTO tasks_fts (rowid, title, description, owner) "
+            "SELECT id, title, description, 'u' || user_id FROM tasks"
+        ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN "
+        "INSERT INTO tasks_fts (rowid, title, description, owner) "
+        "VALUES (new.id, new.title, new.description, 'u' || new.user_id); END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN "
+        "DELETE FROM tasks_fts WHERE rowid = old.id; END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF title, description, user_id ON tasks BEGIN "
+        "UPDATE tasks_fts SET title = new.title, description = new.description, owner = 'u' || new.user_id "
+        "WHERE rowid = old.id; END"
+    ))
+
+def _add_task_change_tracking(conn):
+    """updated_at and change_seq on tasks for delta sync (tombstones are a new table)"""
+    if not _has_column(conn, 'tasks', 'updated_at'):
+        conn.execute(text('ALTER TABLE tasks ADD COLUMN updated_at TIMESTAMP'))
+        conn.execute(text('UPDATE tasks SET updated_at = created_at'))
+    if not _has_column(conn, 'tasks', 'change_seq'):
+        conn.execute(text('ALTER TABLE tasks ADD COLUMN change_seq BIGINT NOT NULL DEFAULT 0'))
+    conn.execute(text('CREATE INDEX IF NOT EXISTS ix_tasks_user_change_seq ON tasks (user_id, change_seq)'))
+    _stamp_unsynced_tasks(conn)
+
+def _stamp_unsynced_tasks(conn):
+    """Give tasks still at change_seq 0 a new version of their owner
+
+    Delta sync returns change_seq > since, so such rows (written before
+    change tracking, or straight through the ORM) were never sent, not even
+    by a full sync from 0. Bumping the owner's version keeps change_seq <=
+    version; users without a stats row get version 1 when it is rebuilt.
+    """
+    unsynced = 'SELECT DISTINCT user_id FROM tasks WHERE change_seq = 0'
+    conn.execute(text(f'UPDATE task_stats SET version = version + 1 WHERE user_id IN ({unsynced})'))
+    conn.execute(text(
+        'UPDATE tasks SET change_seq = COALESCE('
+        '(SELECT version FROM task_stats WHERE task_stats.user_id = tasks.user_id), 1) '
+        'WHERE change_seq = 0'
+    ))
+
+def _create_jobs_table(conn):
+    """Background job table (app/models/job.py)"""
+    from app.models.job import Job
+    Job.__table__.create(conn, checkfirst=True)
+
+def _add_job_worker(conn):
+    """Which process claimed a running job"""
+    if not _has_column(conn, 'jobs', 'worker'):
+        conn.execute(text('ALTER TABLE jobs ADD COLUMN worker VARCHAR(120)'))
+
+def _create_task_archive(conn):
+    """Archive table for old completed tasks - range partitioned by month on
+    Postgres when ARCHIVE_PARTITION_BY_MONTH is set"""
+    from app.models.archived_task import ArchivedTask
+    table = ArchivedTask.__table__
+    partition = (conn.dialect.name == 'postgresql' and has_app_context()
+                 and current_app.config.get('ARCHIVE_PARTITION_BY_MONTH'))
+    if partition:
+        relkind = conn.execute(text("SELECT relkind FROM pg_class WHERE relname = 'archived_tasks'")).scalar()
+        if relkind == 'p':
+            return
+        if relkind is not None and not conn.execute(text('SELECT 1 FROM archived_tasks LIMIT 1')).scalar():
+            # The plain table create_all() made moments ago - replace it with a partitioned one
+            table.drop(conn)
+            relkind = None
+        if relkind is None:
+            ddl = str(CreateTable(table).compile(dialect=conn.dialect)).rstrip()
+            conn.execute(text(ddl + ' PARTITION BY RANGE (completed_at)'))
+            for index in table.indexes:
+                index.create(conn)
+            return
+    table.create(conn, checkfirst=True)
+
+def _rebuild_sqlite_table(conn, table):
+    """Recreate a table from its model, keeping the rows - SQLite cannot alter constraints"""
+    columns = ', '.join(column['name'] for column in inspect(conn).get_columns(table.name)
+                        if column['name'] in table.c)
+    ddl = str(CreateTable(table).compile(dialect=conn.dialect))
+    conn.execute(text(ddl.replace(f'CREATE TABLE {table.name} ', f'CREATE TABLE {table.name}_new ', 1)))
+    conn.execute(text(f'INSERT INTO {table.name}_new ({columns}) SELECT {columns} FROM {table.name}'))
+    conn.execute(text(f'DROP TABLE {table.name}'))
+    conn.execute(text(f'ALTER TABLE {table.name}_new RENAME TO {table.name}'))
+    for index in table.indexes:
+        index.create(conn)
+
+def _backfill_task_created_at(conn):
+    """Date tasks without a created_at by their last update, or now"""
+    conn.execute(text('UPDATE tasks SET created_at = COALESCE(updated_at, CURRENT_TIMESTAMP) WHERE created_at IS NULL'))
+
+def _require_task_created_at(conn):
+    """Backfill tasks.created_at and make it NOT NULL
+
+    It is part of the key the task list pages by: a NULL sorts apart from
+    every date and makes a cursor that cannot be decoded, so paging past
+    such a row fell back to the first page.
+    """
+    from app.models.task import Task
+    _backfill_task_created_at(conn)
+    column = next(column for column in inspect(conn).get_columns('tasks') if column['name'] == 'created_at')
+    if not column['nullable']:
+        return
+    if conn.dialect.name == 'sqlite':
+        _rebuild_sqlite_table(conn, Task.__table__)
+        _create_task_search(conn)  # the full-text triggers went with the old table
+    elif conn.dialect.name == 'postgresql':
+        conn.execute(text('ALTER TABLE tasks ALTER COLUMN created_at SET NOT NULL'))
+
+def _cascade_user_foreign_keys(conn):
+    """ON DELETE CASCADE on every foreign key to users, so a user's rows go with the user"""
+    from app.models.archived_task import ArchivedTask
+    from app.models.job import Job
+    from app.models.task import Task
+    from app.models.task_stats import TaskStats
+    from app.models.task_tombstone import TaskTombstone
+    inspector = inspect(conn)
+    for table in (Task.__table__, TaskStats.__table__, TaskTombstone.__table__, Job.__table__, ArchivedTask.__table__):
+        if not inspector.has_table(table.name):
+            continue
+        stale = [fk for fk in inspector.get_foreign_keys(table.name) if fk['referred_table'] == 'users'
+                 and (fk['options'].get('ondelete') or '').upper() != 'CASCADE']
+        if not stale:
+            continue
+        if conn.dialect.name == 'sqlite':
+            if table.name == 'tasks':
+                _backfill_task_created_at(conn)  # the rebuilt table has the NOT NULL of migration 10
+            _rebuild_sqlite_table(conn, table)
+            if table.name == 'tasks':
+                _create_task_search(conn)  # the full-text triggers went with the old table
+        elif conn.dialect.name == 'postgresql':
+            for fk in stale:
+                columns = ', '.join(fk['constrained_columns'])
+                conn.execute(text(
+                    f'ALTER TABLE {table.name} DROP CONSTRAINT {fk["name"]}, '
+                    f'ADD CONSTRAINT {fk["name"]} FOREIGN KEY ({columns}) REFERENCES users (id) ON DELETE CASCADE'
+                ))
+
+MIGRATIONS = [
+    (1, 'Composite indexes on tasks for listing, filtering and sorting', _create_task_indexes),
+    (2, 'Data version column on task_stats', _add_task_stats_version),
+    (3, 'Full-text search index over task titles and descriptions', _create_task_search),
+    (4, 'Change sequence and updated_at on tasks', _add_task_change_tracking),
+    (5, 'Background jobs table', _create_jobs_table),
+    (6, 'Archive table for old completed tasks', _create_task_archive),
+    (7, 'ON DELETE CASCADE on foreign keys to users', _cascade_user_foreign_keys),
+    (8, 'Change sequence for tasks delta sync never returned', _stamp_unsynced_tasks),
+    (9, 'Worker column on jobs for recovery after a crash', _add_job_worker),
+    (10, 'NOT NULL created_at on tasks for keyset paging', _require_task_created_at),
+]
+
+HEAD_VERSION = MIGRATIONS[-1][0]
+
+def _ensure_version_table(conn):
+    """Create the table that records applied migrations"""
+    conn.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_version ('
+        'version INTEGER PRIMARY KEY, '
+        'description VARCHAR(200) NOT NULL, '
+        'applied_at TIMESTAMP NOT NULL)'
+    ))
+
+def current_version(conn):
+    """Highest applied migration version, 0 for a database that has none"""
+    _ensure_version_table(conn)
+    return conn.execute(text('SELECT MAX(version) FROM schema_version')).scalar() or 0
+
+def schema_is_current(engine=None):
+    """True if schema_version says every migration has been applied - one cheap query"""
+    engine = engine or db.engine
+    try:
+        with engine.connect() as conn:
+            return (conn.execute(text('SELECT MAX(version) FROM schema_version')).scalar() or 0) >= HEAD_VERSION
+    except DBAPIError:
+        return False  # no schema_version table yet
+
+def upgrade(engine=None):
+    """Apply every pending migration, each in its own transaction
+
+    Returns the list of versions that were applied by this call.
+    """
+    engine = engine or db.engine
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        with engine.begin() as conn:
+            if conn.dialect.name == 'postgresql':
+                # Serialise workers that boot at the same time
+                conn.execute(text('SELECT pg_advisory_xact_lock(7243001)'))
+            if current_version(conn) >= version:
+                continue
+            migrate(conn)
+            try:
+                with conn.begin_nested():
+                    conn.execute(
+                        text('INSERT INTO schema_version (version, description, applied_at) '
+                             'VALUES (:version, :description, :applied_at)'),
+                        {'version': version, 'description': description, 'applied_at': datetime.utcnow()}
+                    )
+            except IntegrityError:
+                # Another process recorded it first - the DDL above was a no-op
+                continue
+        applied.append(version)
+    return applied
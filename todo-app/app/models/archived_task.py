@@ -0,0 +1,26 @@
+from datetime import datetime
+from app import db
+
+class ArchivedTask(db.Model):
+    """A completed task moved out of the hot tasks table by the archive sweep"""
+    __tablename__ = 'archived_tasks'
+    
+    # The original task id; completed_at is part of the key so Postgres can
+    # partition the table by month (see migration 6)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    completed_at = db.Column(db.DateTime, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    title = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text, default='')
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_archived_tasks_user_completed', user_id, completed_at),
+    )
+    
+    # Archived tasks are always completed - lets templates treat them like tasks
+    status = 'completed'
+    
+    def __repr__(self):
+        return f'<ArchivedTask {self.title}>'
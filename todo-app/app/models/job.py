@@ -0,0 +1,43 @@
+import json
+from datetime import datetime
+from app import db
+
+class Job(db.Model):
+    """A long-running operation handed off to the background job runner"""
+    __tablename__ = 'jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    kind = db.Column(db.String(40), nullable=False)
+    # queued -> running -> succeeded / failed / cancelled
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    params = db.Column(db.Text, nullable=False, default='{}')
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer)
+    result = db.Column(db.Text)
+    error = db.Column(db.Text)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    # host:pid:token of the process that claimed it - lets a restart spot jobs orphaned by a crash
+    worker = db.Column(db.String(120))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    @property
+    def finished(self):
+        return self.status in ('succeeded', 'failed', 'cancelled')
+    
+    def to_dict(self):
+        """Status document returned by the job endpoints"""
+        return {
+            'id': self.id, 'kind': self.kind, 'status': self.status,
+            'progress': self.progress, 'total': self.total,
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error, 'cancel_requested': self.cancel_requested,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+    
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
@@ -10,8 +10,20 @@ class Task(db.Model):
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, default='')
     status = db.Column(db.String(20), default='pending')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # Part of the keyset the list pages by, so never NULL (migration 10)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    # Owner's data version at the last write to this task - drives delta sync
+    change_seq = db.Column(db.BigInteger, nullable=False, default=0)
+    
+    # Indexes for the list view - existing databases get them from app/migrations.py
+    __table_args__ = (
+        db.Index('ix_tasks_user_created', user_id, created_at),
+        db.Index('ix_tasks_user_status_created', user_id, status, created_at),
+        db.Index('ix_tasks_user_title', user_id, db.func.lower(title)),
+        db.Index('ix_tasks_user_change_seq', user_id, change_seq),
+    )
     
     def mark_completed(self):
         """Mark task as completed"""
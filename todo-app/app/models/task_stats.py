@@ -0,0 +1,19 @@
+from app import db
+
+class TaskStats(db.Model):
+    """Per-user task counters, kept up to date by every task write"""
+    __tablename__ = 'task_stats'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    total_count = db.Column(db.Integer, nullable=False, default=0)
+    completed_count = db.Column(db.Integer, nullable=False, default=0)
+    # Bumped by every write to the user's tasks - used for ETags and caches
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    
+    @property
+    def pending_count(self):
+        """Tasks are either pending or completed"""
+        return self.total_count - self.completed_count
+    
+    def __repr__(self):
+        return f'<TaskStats user={self.user_id} total={self.total_count}>'
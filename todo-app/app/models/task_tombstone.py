@@ -0,0 +1,19 @@
+from datetime import datetime
+from app import db
+
+class TaskTombstone(db.Model):
+    """Marker left behind by a deleted task so sync clients learn about the delete"""
+    __tablename__ = 'task_tombstones'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    task_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    change_seq = db.Column(db.BigInteger, nullable=False)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_task_tombstones_user_seq', user_id, change_seq),
+    )
+    
+    def __repr__(self):
+        return f'<TaskTombstone task={self.task_id} seq={self.change_seq}>'
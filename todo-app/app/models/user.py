@@ -1,7 +1,7 @@
 from datetime import datetime
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 from app import db
+from app.utils.passwords import hash_password, password_needs_rehash, verify_password
 
 class User(UserMixin, db.Model):
     """Simple User model for authentication - no design patterns"""
@@ -13,16 +13,21 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(200), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    # Relationship to tasks
-    tasks = db.relationship('Task', backref='owner', lazy=True, cascade='all, delete-orphan')
+    # Relationship to tasks - the database deletes them with the user (ON DELETE CASCADE),
+    # so deleting a User never loads its tasks
+    tasks = db.relationship('Task', backref='owner', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
     
     def set_password(self, password):
         """Hash and store password"""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
         """Check if password matches"""
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        """True if the stored hash predates the current PASSWORD_HASH_METHOD"""
+        return password_needs_rehash(self.password_hash)
     
     def __repr__(self):
         return f'<User {self.username}>'
@@ -1,10 +1,31 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
-from flask_login import login_user, logout_user, current_user
-from app import db
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, flash
+from flask_login import login_user, logout_user, current_user, login_required
 from app.models.user import User
+from app.utils.jobs import submit_job
+from app.utils.storage import DuplicateUserError, create_user, find_user, get_user
 
 auth_bp = Blueprint('auth', __name__)
 
+def _username_key():
+    return 'user:' + request.form.get('username', '').strip().lower()
+
+@auth_bp.before_request
+def throttle():
+    """Turn away login/registration bursts before any password gets hashed"""
+    limiter = current_app.extensions.get('rate_limiter')
+    if limiter is None or request.method != 'POST' or request.endpoint not in ('auth.login', 'auth.register'):
+        return None
+    
+    retry_after = limiter.hit(f'ip:{request.remote_addr}', *current_app.config['AUTH_LIMIT_PER_IP'])
+    if retry_after is None and request.endpoint == 'auth.login':
+        retry_after = limiter.hit(_username_key(), *current_app.config['AUTH_LIMIT_PER_USERNAME'])
+    if retry_after is None:
+        return None
+    
+    flash(f'Too many attempts. Please try again in {retry_after} seconds.', 'error')
+    template = 'login.html' if request.endpoint == 'auth.login' else 'register.html'
+    return render_template(template), 429, {'Retry-After': str(retry_after)}
+
 @auth_bp.route('/register', methods=['GET', 'POST'])
 def register():
     """Register a new user - simple function, no patterns"""
@@ -30,22 +51,19 @@ def register():
             flash('Password must be at least 6 characters long.', 'error')
             return redirect(url_for('auth.register'))
         
-        # Check if user already exists
-        if User.query.filter_by(username=username).first():
-            flash('Username already exists.', 'error')
-            return redirect(url_for('auth.register'))
-        
-        if User.query.filter_by(email=email).first():
-            flash('Email already registered.', 'error')
-            return redirect(url_for('auth.register'))
-        
         # Create new user - simple instantiation, no Factory pattern
         user = User(username=username, email=email)
         user.set_password(password)
         
-        # Save user
-        db.session.add(user)
-        db.session.commit()
+        # Save user - the unique constraints decide whether the name or email is taken
+        try:
+            create_user(user)
+        except DuplicateUserError as e:
+            if e.field == 'email':
+                flash('Email already registered.', 'error')
+            else:
+                flash('Username already exists.', 'error')
+            return redirect(url_for('auth.register'))
         
         flash('Registration successful! Please log in.', 'success')
         return redirect(url_for('auth.login'))
@@ -69,11 +87,20 @@ def login():
             return redirect(url_for('auth.login'))
         
         # Find user - simple query
-        user = User.query.filter_by(username=username).first()
+        user = find_user(username)
         
         # Check password - simple if statement
         if user and user.check_password(password):
+            # Hash policy changed since this password was set - upgrade it while we have it
+            # (committed with the rest of the request)
+            if user.password_needs_rehash():
+                user.set_password(password)
+            
             login_user(user, remember=remember)
+            # Typos before a successful login do not count against the account
+            limiter = current_app.extensions.get('rate_limiter')
+            if limiter is not None:
+                limiter.reset(_username_key())
             
             # Redirect to next page or home
             next_page = request.args.get('next')
@@ -89,3 +116,25 @@ def logout():
     logout_user()
     flash('You have been logged out.', 'success')
     return redirect(url_for('auth.login'))
+
+@auth_bp.route('/account/delete', methods=['GET', 'POST'])
+@login_required
+def delete_account():
+    """Delete the current user and all their data after a password check
+
+    The rows go in bounded chunks on a background job; the user is logged
+    out straight away.
+    """
+    if request.method == 'POST':
+        # current_user may be a cached snapshot without the password hash
+        user = get_user(current_user.id)
+        if user is None or not user.check_password(request.form.get('password', '')):
+            flash('Incorrect password.', 'error')
+            return render_template('delete_account.html'), 403
+        
+        submit_job(current_user.id, 'delete_account')
+        logout_user()
+        flash('Your account is being deleted.', 'success')
+        return redirect(url_for('auth.login'))
+    
+    return render_template('delete_account.html')
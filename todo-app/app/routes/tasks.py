@@ -1,40 +1,365 @@
-from flask import Blueprint, render_template, request, redirect, url_for
+import hashlib
+import json
+import os
+import queue
+import tempfile
+from datetime import datetime
+from flask import (Blueprint, abort, current_app, jsonify, render_template, request, redirect, send_file,
+                   stream_with_context, url_for)
 from flask_login import login_required, current_user
+from app import db
 from app.models.task import Task
-from app.utils.storage import load_tasks, save_task, delete_task, update_task
+from app.utils.storage import (get_task, load_task_page, get_task_counts, save_task, delete_task, delete_completed_tasks,
+                               toggle_task_status, update_task, apply_task_batch, get_task_version,
+                               search_tasks, iter_tasks, load_changes, load_archived_page)
+from app.utils.transfer import FORMATS, export_csv, export_ndjson, guess_format
+from app.utils.jobs import cancel_job, get_job, job_result_path, list_jobs, submit_job
+from app.utils.replicas import pool_stats
 
 tasks_bp = Blueprint('tasks', __name__)
 
+# Fields the JSON API can return
+TASK_FIELDS = ('id', 'title', 'description', 'status', 'created_at', 'updated_at', 'change_seq')
+
+# Longest title the tasks.title column holds
+TITLE_MAX_LENGTH = Task.title.type.length
+
+def _title_error(title):
+    """Why a stripped task title cannot be saved, or None"""
+    if not title:
+        return "Task title cannot be empty!"
+    if len(title) > TITLE_MAX_LENGTH:
+        return f"Task title cannot be longer than {TITLE_MAX_LENGTH} characters!"
+    return None
+
+def _page_size():
+    """Requested page size, clamped to the configured maximum"""
+    per_page = request.args.get('per_page', current_app.config['TASKS_PER_PAGE'], type=int)
+    return max(1, min(per_page, current_app.config['TASKS_MAX_PER_PAGE']))
+
+def _render_index(error=None):
+    """Render one page of the task list for the current user"""
+    filter_status = request.args.get('filter', 'all')
+    sort_by = request.args.get('sort', 'none')
+    per_page = _page_size()
+    
+    # Filtering, sorting and paging all happen in the database
+    try:
+        page = load_task_page(current_user.id, filter_status, sort_by,
+                              after=request.args.get('after'), before=request.args.get('before'),
+                              page_size=per_page)
+    except ValueError:
+        # Stale or tampered cursor - fall back to the first page
+        page = load_task_page(current_user.id, filter_status, sort_by, page_size=per_page)
+    
+    # Counters come from the per-user stats row, not from the task rows
+    counts = get_task_counts(current_user.id)
+    
+    return render_template('index.html', tasks=page.tasks, has_tasks=bool(page.tasks),
+                         current_filter=filter_status, current_sort=sort_by,
+                         next_cursor=page.next_cursor, prev_cursor=page.prev_cursor, per_page=per_page,
+                         error=error, total_count=counts.total_count, completed_count=counts.completed_count,
+                         pending_count=counts.pending_count)
+
+def _stream_index():
+    """Stream the whole filtered task list - header first, then rows in chunks"""
+    filter_status = request.args.get('filter', 'all')
+    sort_by = request.args.get('sort', 'none')
+    counts = get_task_counts(current_user.id)
+    has_tasks = {'pending': counts.pending_count, 'completed': counts.completed_count}.get(
+        filter_status, counts.total_count) > 0
+    
+    context = dict(tasks=iter_tasks(current_user.id, filter_status, sort_by, current_app.config['STREAM_CHUNK_ROWS']),
+                   has_tasks=has_tasks, current_filter=filter_status, current_sort=sort_by,
+                   next_cursor=None, prev_cursor=None, per_page=_page_size(),
+                   total_count=counts.total_count, completed_count=counts.completed_count,
+                   pending_count=counts.pending_count)
+    current_app.update_template_context(context)
+    stream = current_app.jinja_env.get_template('index.html').stream(context)
+    # Group template output into chunks instead of one write per fragment
+    stream.enable_buffering(current_app.config['STREAM_BUFFER_FRAGMENTS'])
+    return current_app.response_class(stream_with_context(stream), mimetype='text/html')
+
+def _query_digest(user_id):
+    """Short hash identifying this user and the exact query string being asked"""
+    query = '&'.join(f'{key}={value}' for key, value in sorted(request.args.items(multi=True)))
+    return hashlib.sha1(f'{user_id}|{query}'.encode('utf-8')).hexdigest()[:16]
+
 @tasks_bp.route('/')
 @login_required
 def index():
-    """Display all tasks for current user"""
+    """Display one page of tasks for current user
+    
+    Rendered pages are cached under the user's data version, which every
+    task write bumps - a write makes all older pages of that user unreachable.
+    """
+    if request.args.get('stream'):
+        return _stream_index()
+    
+    cache = current_app.extensions.get('page_cache')
+    if cache is None:
+        return _render_index()
+    
+    key = f'{get_task_version(current_user.id)}-{_query_digest(current_user.id)}'
+    page = cache.get(key)
+    if page is None:
+        page = _render_index()
+        cache.set(key, page)
+    return page
+
+@tasks_bp.route('/cache-stats')
+@login_required
+def cache_stats():
+    """Hit/miss counters of the rendered page cache, plus the user cache under 'user_cache'"""
+    cache = current_app.extensions.get('page_cache')
+    stats = cache.stats() if cache is not None else {'backend': None}
+    user_cache = current_app.extensions.get('user_cache')
+    stats['user_cache'] = user_cache.stats() if user_cache is not None else None
+    return jsonify(stats)
+
+@tasks_bp.route('/pool-stats')
+@login_required
+def pool_stats_route():
+    """Connection pool usage of the primary and every replica"""
+    return jsonify(pool_stats(current_app, db))
+
+def _task_json(task, fields):
+    """Serialize the selected fields of a task"""
+    data = {}
+    for field in fields:
+        value = getattr(task, field)
+        data[field] = value.isoformat() if isinstance(value, datetime) else value
+    return data
+
+def _api_etag(user_id, version):
+    """Strong ETag for this user's data version and the exact query being asked"""
+    return f'{version}-{_query_digest(user_id)}'
+
+@tasks_bp.route('/api/tasks')
+@login_required
+def api_tasks():
+    """JSON list of the current user's tasks with field selection and cursor paging
+    
+    Query args: fields=id,title,... filter, sort, per_page, after, before.
+    A client presenting the current ETag gets a 304 decided from the user's
+    data version alone - no task rows are read.
+    """
+    fields = [field for field in request.args.get('fields', ','.join(TASK_FIELDS)).split(',') if field]
+    unknown = [field for field in fields if field not in TASK_FIELDS]
+    if unknown:
+        return jsonify({'error': f"Unknown fields: {', '.join(unknown)}"}), 400
+    
+    etag = _api_etag(current_user.id, get_task_version(current_user.id))
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    
     filter_status = request.args.get('filter', 'all')
     sort_by = request.args.get('sort', 'none')
+    try:
+        page = load_task_page(current_user.id, filter_status, sort_by,
+                              after=request.args.get('after'), before=request.args.get('before'),
+                              page_size=_page_size())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    # Load only current user's tasks
-    tasks = Task.query.filter_by(user_id=current_user.id).all()
+    response = jsonify({
+        'tasks': [_task_json(task, fields) for task in page.tasks],
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+    })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _search_page():
+    """Run the search described by the query string for the current user"""
+    query = request.args.get('q', '').strip()
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = max(1, min(request.args.get('per_page', 20, type=int), current_app.config['TASKS_MAX_PER_PAGE']))
+    return query, search_tasks(current_user.id, query, page, per_page)
+
+@tasks_bp.route('/search')
+@login_required
+def search():
+    """Full-text search over the current user's task titles and descriptions"""
+    query, results = _search_page()
+    return render_template('search.html', query=query, tasks=results.tasks,
+                           page=results.page, has_more=results.has_more)
+
+@tasks_bp.route('/api/search')
+@login_required
+def api_search():
+    """JSON version of the task search, best matches first"""
+    query, results = _search_page()
+    return jsonify({
+        'tasks': [_task_json(task, TASK_FIELDS) for task in results.tasks],
+        'page': results.page,
+        'has_more': results.has_more,
+    })
+
+@tasks_bp.route('/archived')
+@login_required
+def archived():
+    """The current user's archived tasks, on demand - the main list only shows hot tasks"""
+    try:
+        page = load_archived_page(current_user.id, after=request.args.get('after'), page_size=_page_size())
+    except ValueError:
+        page = load_archived_page(current_user.id, page_size=_page_size())
+    return render_template('archived.html', tasks=page.tasks, next_cursor=page.next_cursor,
+                           archive_after_days=current_app.config['ARCHIVE_AFTER_DAYS'])
+
+@tasks_bp.route('/api/changes')
+@login_required
+def api_changes():
+    """Task inserts/updates and deletes since the client's last sync
+    
+    Query args: since=<cursor from the previous call, 0 for a full sync>, limit.
+    Keep calling with the returned cursor while has_more is true.
+    """
+    since = request.args.get('since', 0, type=int)
+    limit = max(1, min(request.args.get('limit', 500, type=int), current_app.config['TASK_BATCH_MAX_OPERATIONS']))
+    changes = load_changes(current_user.id, since, limit)
+    return jsonify({
+        'upserted': [_task_json(task, TASK_FIELDS) for task in changes.tasks],
+        'deleted': [{'id': task_id, 'change_seq': change_seq} for task_id, change_seq in changes.deleted],
+        'cursor': changes.cursor,
+        'has_more': changes.has_more,
+        'counts': get_task_counts(current_user.id)._asdict(),
+    })
+
+@tasks_bp.route('/events')
+@login_required
+def events():
+    """Server-sent events stream of the current user's task changes
+    
+    Each event carries the change sequence as its id, so after a reconnect
+    a client can catch up with /api/changes?since=<Last-Event-ID>.
+    """
+    user_id = current_user.id
+    broker = current_app.extensions['events']
+    keepalive = current_app.config['EVENTS_KEEPALIVE_SECONDS']
+    subscription = broker.subscribe(user_id)
     
-    # Apply filtering
-    if filter_status == 'pending':
-        tasks = [task for task in tasks if task.status == 'pending']
-    elif filter_status == 'completed':
-        tasks = [task for task in tasks if task.status == 'completed']
+    last_seen = request.headers.get('Last-Event-ID', type=int)
+    missed = last_seen is not None and last_seen < get_task_version(user_id)
+    # Do not hold a database connection for the lifetime of the stream
+    db.session.remove()
     
-    # Apply sorting
-    if sort_by == 'title':
-        tasks = sorted(tasks, key=lambda x: x.title.lower())
-    elif sort_by == 'status':
-        tasks = sorted(tasks, key=lambda x: (x.status, x.title.lower()))
+    def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            if missed:
+                yield f"event: resync\ndata: {json.dumps({'since': last_seen})}\n\n"
+            while True:
+                try:
+                    task_event = subscription.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                event_id = f"id: {task_event['change_seq']}\n" if 'change_seq' in task_event else ''
+                yield f"{event_id}event: {task_event['type']}\ndata: {json.dumps(task_event)}\n\n"
+        finally:
+            broker.unsubscribe(user_id, subscription)
     
-    # Calculate task counts for current user only
-    all_tasks = Task.query.filter_by(user_id=current_user.id).all()
-    total_count = len(all_tasks)
-    completed_count = len([t for t in all_tasks if t.status == 'completed'])
-    pending_count = len([t for t in all_tasks if t.status == 'pending'])
+    response = current_app.response_class(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@tasks_bp.route('/export.<any(ndjson, csv):file_format>')
+@login_required
+def export_tasks(file_format):
+    """Download all of the current user's tasks, streamed from a server-side cursor
+
+    With ?background=1 the file is written by a job and fetched from
+    /jobs/<id>/download once it has finished.
+    """
+    if request.args.get('background'):
+        return _job_accepted(submit_job(current_user.id, 'export', {'format': file_format}))
     
-    return render_template('index.html', tasks=tasks, current_filter=filter_status, current_sort=sort_by,
-                         total_count=total_count, completed_count=completed_count, pending_count=pending_count)
+    chunk_size = current_app.config['STREAM_CHUNK_ROWS']
+    if file_format == 'csv':
+        chunks, mimetype = export_csv(current_user.id, chunk_size), 'text/csv'
+    else:
+        chunks, mimetype = export_ndjson(current_user.id, chunk_size), 'application/x-ndjson'
+    response = current_app.response_class(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=tasks.{file_format}'
+    return response
+
+@tasks_bp.route('/import', methods=['POST'])
+@login_required
+def import_tasks_route():
+    """Queue an uploaded NDJSON, CSV or legacy tasks.json file for import into the current user's list"""
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({'error': 'Upload a file in the "file" field.'}), 400
+    file_format = request.form.get('format') or guess_format(upload.filename)
+    if file_format not in FORMATS:
+        return jsonify({'error': f'Unknown format: {file_format}'}), 400
+    
+    # The job reads the upload from disk after this request has finished
+    os.makedirs(current_app.config['JOBS_DIR'], exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix='import-', dir=current_app.config['JOBS_DIR'])
+    with os.fdopen(fd, 'wb') as f:
+        upload.save(f)
+    return _job_accepted(submit_job(current_user.id, 'import', {'path': path, 'format': file_format}))
+
+def _job_accepted(job):
+    """202 response pointing at the status endpoint of a submitted job"""
+    response = jsonify(job.to_dict())
+    response.status_code = 202
+    response.headers['Location'] = url_for('tasks.job_status', job_id=job.id)
+    return response
+
+@tasks_bp.route('/jobs')
+@login_required
+def jobs():
+    """The current user's recent background jobs"""
+    return jsonify({'jobs': [job.to_dict() for job in list_jobs(current_user.id)]})
+
+@tasks_bp.route('/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    """Status and progress of one background job"""
+    job = get_job(current_user.id, job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job.to_dict())
+
+@tasks_bp.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job_route(job_id):
+    """Ask a queued or running job to stop"""
+    if get_job(current_user.id, job_id) is None:
+        abort(404)
+    if not cancel_job(current_user.id, job_id):
+        return jsonify({'error': 'The job has already finished.'}), 409
+    return jsonify(get_job(current_user.id, job_id).to_dict()), 202
+
+@tasks_bp.route('/jobs/<int:job_id>/download')
+@login_required
+def job_download(job_id):
+    """The file written by a finished export job"""
+    job = get_job(current_user.id, job_id)
+    if job is None or job.kind != 'export' or job.status != 'succeeded':
+        abort(404)
+    file_format = json.loads(job.result)['format']
+    return send_file(job_result_path(job.id, file_format), as_attachment=True,
+                     download_name=f'tasks.{file_format}')
+
+@tasks_bp.route('/jobs/archive', methods=['POST'])
+@login_required
+def archive():
+    """Move the current user's old completed tasks to the archive in the background"""
+    return _job_accepted(submit_job(current_user.id, 'archive'))
+
+@tasks_bp.route('/jobs/reindex', methods=['POST'])
+@login_required
+def reindex():
+    """Rebuild the current user's counters and search index in the background"""
+    return _job_accepted(submit_job(current_user.id, 'reindex'))
 
 @tasks_bp.route('/add', methods=['POST'])
 @login_required
@@ -43,20 +368,10 @@ def add_task():
     title = request.form.get('title', '').strip()
     description = request.form.get('description', '').strip()
     
-    # Validate title is not empty
-    if not title:
-        filter_status = request.args.get('filter', 'all')
-        sort_by = request.args.get('sort', 'none')
-        tasks = Task.query.filter_by(user_id=current_user.id).all()
-        error = "Task title cannot be empty!"
-        
-        # Calculate task counts for error page
-        total_count = len(tasks)
-        completed_count = len([t for t in tasks if t.status == 'completed'])
-        pending_count = len([t for t in tasks if t.status == 'pending'])
-        
-        return render_template('index.html', tasks=tasks, current_filter=filter_status, current_sort=sort_by, 
-                             error=error, total_count=total_count, completed_count=completed_count, pending_count=pending_count)
+    # Validate title is not empty and fits the column
+    error = _title_error(title)
+    if error:
+        return _render_index(error=error)
     
     # Create task with current user's ID
     new_task = Task(title=title, description=description, user_id=current_user.id)
@@ -69,14 +384,11 @@ def add_task():
 def toggle_task(task_id):
     """Toggle task completion status"""
     # Verify task belongs to current user
-    task = Task.query.filter_by(id=task_id, user_id=current_user.id).first_or_404()
+    task = get_task(current_user.id, task_id)
+    if task is None:
+        abort(404)
     
-    if task.status == 'pending':
-        task.mark_completed()
-    else:
-        task.mark_pending()
-    
-    update_task()
+    toggle_task_status(task)
     return redirect(url_for('tasks.index'))
 
 @tasks_bp.route('/tasks/<int:task_id>/delete', methods=['POST'])
@@ -84,7 +396,9 @@ def toggle_task(task_id):
 def delete_task_route(task_id):
     """Delete a task"""
     # Verify task belongs to current user
-    task = Task.query.filter_by(id=task_id, user_id=current_user.id).first_or_404()
+    task = get_task(current_user.id, task_id)
+    if task is None:
+        abort(404)
     delete_task(task)
     return redirect(url_for('tasks.index'))
 
@@ -92,29 +406,59 @@ def delete_task_route(task_id):
 @login_required
 def clear_completed():
     """Delete all completed tasks for current user"""
-    completed_tasks = Task.query.filter_by(user_id=current_user.id, status='completed').all()
-    for task in completed_tasks:
-        delete_task(task)
+    # Huge accounts are cleared by a background job; live updates refresh the page when it is done
+    if get_task_counts(current_user.id).completed_count > current_app.config['CLEAR_COMPLETED_INLINE_MAX']:
+        submit_job(current_user.id, 'clear_completed')
+    else:
+        delete_completed_tasks(current_user.id, current_app.config['CLEAR_COMPLETED_CHUNK_SIZE'])
     return redirect(url_for('tasks.index'))
 
+@tasks_bp.route('/tasks/batch', methods=['POST'])
+@login_required
+def batch_tasks():
+    """Apply many create/toggle/edit/delete operations in one request and transaction
+    
+    Body: {"operations": [{"op": "create", "title": "..."}, {"op": "toggle", "id": 1}, ...]}
+    
+    A title too long for the column rejects the whole batch with a 400 naming
+    the operation; other invalid operations fail on their own.
+    """
+    payload = request.get_json(silent=True) or {}
+    operations = payload.get('operations')
+    
+    # Validate the envelope - individual operations are validated by storage
+    if not isinstance(operations, list) or not all(isinstance(op, dict) for op in operations):
+        return jsonify({'error': 'Expected {"operations": [...]} with one object per operation.'}), 400
+    if len(operations) > current_app.config['TASK_BATCH_MAX_OPERATIONS']:
+        return jsonify({'error': f"At most {current_app.config['TASK_BATCH_MAX_OPERATIONS']} operations per batch."}), 400
+    for index, op in enumerate(operations):
+        title = op.get('title')
+        if op.get('op') in ('create', 'edit') and isinstance(title, str) and len(title.strip()) > TITLE_MAX_LENGTH:
+            return jsonify({'error': f'Operation {index}: {_title_error(title.strip())}', 'index': index}), 400
+    
+    results = apply_task_batch(current_user.id, operations)
+    return jsonify({'results': results})
+
 @tasks_bp.route('/tasks/<int:task_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_task(task_id):
     """Edit a task"""
     # Verify task belongs to current user
-    task = Task.query.filter_by(id=task_id, user_id=current_user.id).first_or_404()
+    task = get_task(current_user.id, task_id)
+    if task is None:
+        abort(404)
     
     if request.method == 'POST':
         new_title = request.form.get('title', '').strip()
         
-        # Validate title is not empty
-        if not new_title:
-            error = "Task title cannot be empty!"
+        # Validate title is not empty and fits the column
+        error = _title_error(new_title)
+        if error:
             return render_template('edit_task.html', task=task, error=error)
         
         task.title = new_title
         task.description = request.form.get('description', '').strip()
-        update_task()
+        update_task(task)
         return redirect(url_for('tasks.index'))
     
     return render_template('edit_task.html', task=task)
\ No newline at end of file
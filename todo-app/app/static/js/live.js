@@ -0,0 +1,88 @@
+// Keep the task list in step with the server-sent event stream at /events,
+// so toggles and deletes (here or in another tab) patch the page in place.
+document.addEventListener('DOMContentLoaded', function() {
+    if (!window.EventSource) {
+        return;
+    }
+
+    const source = new EventSource('/events');
+    const taskList = document.getElementById('task-list');
+    const banner = document.getElementById('live-banner');
+
+    function updateCounters(counts) {
+        if (!counts) {
+            return;
+        }
+        document.querySelector('#total-count strong').textContent = counts.total_count;
+        document.querySelector('#pending-count strong').textContent = counts.pending_count;
+        document.querySelector('#completed-count strong').textContent = counts.completed_count;
+    }
+
+    function findItem(taskId) {
+        return document.querySelector(`li.task-item[data-id='${taskId}']`);
+    }
+
+    // Changes we cannot place on this page (new tasks, bulk changes) - offer a reload
+    function showBanner() {
+        banner.hidden = false;
+    }
+
+    source.addEventListener('updated', function(event) {
+        const data = JSON.parse(event.data);
+        updateCounters(data.counts);
+        const item = findItem(data.task.id);
+        if (!item) {
+            return;
+        }
+        const filter = taskList.dataset.filter;
+        if (filter !== 'all' && data.task.status !== filter) {
+            item.remove();
+            return;
+        }
+        const title = item.querySelector('.task-title');
+        title.textContent = data.task.title;
+        title.style.textDecoration = data.task.status === 'completed' ? 'line-through' : '';
+        const description = item.querySelector('.task-description');
+        if (description) {
+            description.textContent = data.task.description;
+        } else if (data.task.description) {
+            showBanner();
+        }
+        item.querySelector('.btn-toggle').textContent =
+            data.task.status === 'pending' ? 'Mark Complete' : 'Mark Pending';
+    });
+
+    source.addEventListener('deleted', function(event) {
+        const data = JSON.parse(event.data);
+        updateCounters(data.counts);
+        data.ids.forEach(taskId => {
+            const item = findItem(taskId);
+            if (item) {
+                item.remove();
+            }
+        });
+    });
+
+    ['created', 'changed', 'resync'].forEach(type => {
+        source.addEventListener(type, function(event) {
+            updateCounters(JSON.parse(event.data).counts);
+            showBanner();
+        });
+    });
+
+    // While the stream is up, toggle and delete without the redirect and re-render
+    document.querySelectorAll('form.live-form').forEach(form => {
+        form.addEventListener('submit', function(event) {
+            if (event.defaultPrevented || source.readyState !== EventSource.OPEN) {
+                return;
+            }
+            event.preventDefault();
+            fetch(form.action, {
+                method: 'POST',
+                body: new FormData(form),
+                credentials: 'same-origin',
+                redirect: 'manual'
+            });
+        });
+    });
+});
@@ -4,11 +4,11 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // Load tasks from the server
     function loadTasks() {
-        fetch('/tasks')
+        fetch('/api/tasks?fields=id,title,status')
             .then(response => response.json())
             .then(data => {
                 taskList.innerHTML = '';
-                data.forEach(task => {
+                data.tasks.forEach(task => {
                     const li = document.createElement('li');
                     li.textContent = `${task.title} - ${task.status}`;
                     li.dataset.id = task.id;
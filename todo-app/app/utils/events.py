@@ -0,0 +1,166 @@
+import atexit
+import glob
+import json
+import os
+import queue
+import socket
+import threading
+from flask import current_app, has_app_context
+from sqlalchemy import event
+
+# Task change events, published once the transaction that made them commits.
+#
+# storage.py queues events on the session (queue_task_event); the session
+# hooks below hand them to the app's broker after COMMIT and drop them on
+# ROLLBACK, so subscribers never hear about writes that did not happen.
+
+class LocalBroker:
+    """Fan-out of task events to the subscribers of this process"""
+    
+    def __init__(self, queue_size=256):
+        self.queue_size = queue_size
+        self.subscribers = {}
+        self.lock = threading.Lock()
+    
+    def subscribe(self, user_id):
+        """Return a queue that receives every event for `user_id`"""
+        q = queue.Queue(self.queue_size)
+        with self.lock:
+            self.subscribers.setdefault(user_id, set()).add(q)
+        return q
+    
+    def unsubscribe(self, user_id, q):
+        with self.lock:
+            queues = self.subscribers.get(user_id, set())
+            queues.discard(q)
+            if not queues:
+                self.subscribers.pop(user_id, None)
+    
+    def publish(self, events):
+        """Deliver committed events to subscribers"""
+        for task_event in events:
+            self.dispatch(task_event)
+    
+    def dispatch(self, task_event):
+        """Put one event on the queues of its user's subscribers in this process"""
+        with self.lock:
+            queues = list(self.subscribers.get(task_event['user_id'], ()))
+        for q in queues:
+            try:
+                q.put_nowait(task_event)
+            except queue.Full:
+                # Slow client - replace its backlog with one "resync from your cursor" marker
+                with q.mutex:
+                    q.queue.clear()
+                q.put_nowait({'type': 'resync', 'user_id': task_event['user_id']})
+    
+    def subscriber_count(self):
+        with self.lock:
+            return sum(len(queues) for queues in self.subscribers.values())
+
+
+class UnixSocketBroker(LocalBroker):
+    """Fan-out across all worker processes on one host through Unix datagram sockets
+
+    Each process that has subscribers binds `<socket_dir>/<pid>.sock`;
+    publishing delivers locally and sends one datagram to every other
+    socket in the directory. Sockets of dead processes are removed.
+    """
+    
+    def __init__(self, socket_dir, queue_size=256):
+        super().__init__(queue_size)
+        self.socket_dir = socket_dir
+        self.path = None
+        self.sender = None
+        self.bind_lock = threading.Lock()
+        os.makedirs(socket_dir, exist_ok=True)
+    
+    def _bind(self):
+        """Start receiving events from other processes (once per process)"""
+        with self.bind_lock:
+            if self.path == os.path.join(self.socket_dir, f'{os.getpid()}.sock'):
+                return
+            self.path = os.path.join(self.socket_dir, f'{os.getpid()}.sock')
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            receiver.bind(self.path)
+            atexit.register(self._unlink, self.path)
+            threading.Thread(target=self._receive, args=(receiver,), daemon=True).start()
+    
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    
+    def _receive(self, receiver):
+        while True:
+            data = receiver.recv(65536)
+            try:
+                self.dispatch(json.loads(data))
+            except (ValueError, KeyError):
+                continue
+    
+    def subscribe(self, user_id):
+        self._bind()
+        return super().subscribe(user_id)
+    
+    def publish(self, events):
+        super().publish(events)
+        if self.sender is None:
+            self.sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.sender.setblocking(False)
+        own = os.path.join(self.socket_dir, f'{os.getpid()}.sock')
+        peers = [path for path in glob.glob(os.path.join(self.socket_dir, '*.sock')) if path != own]
+        for task_event in events:
+            data = json.dumps(task_event).encode('utf-8')
+            for path in peers:
+                try:
+                    self.sender.sendto(data, path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    self._unlink(path)  # its process is gone
+                except (BlockingIOError, OSError):
+                    continue  # peer is not keeping up - its clients will resync
+
+
+def create_broker(config):
+    """Build the broker selected by EVENTS_BACKEND ('local' or 'unix')"""
+    backend = config.get('EVENTS_BACKEND', 'local')
+    if backend == 'local':
+        return LocalBroker(config['EVENTS_QUEUE_SIZE'])
+    if backend == 'unix':
+        return UnixSocketBroker(config['EVENTS_SOCKET_DIR'], config['EVENTS_QUEUE_SIZE'])
+    raise ValueError(f'Unknown EVENTS_BACKEND: {backend!r}')
+
+def queue_task_event(session, task_event):
+    """Hold an event until the session's transaction commits"""
+    session.info.setdefault('task_events', []).append(task_event)
+
+def publish_task_event(task_event):
+    """Publish an event right away - for task stores whose writes are durable once made"""
+    broker = current_app.extensions.get('events') if has_app_context() else None
+    if broker is not None:
+        broker.publish([task_event])
+
+def _publish_committed(session):
+    if session.get_nested_transaction() is not None:
+        return  # a SAVEPOINT was released - the real COMMIT is still to come
+    task_events = session.info.pop('task_events', None)
+    if not task_events:
+        return
+    broker = current_app.extensions.get('events') if has_app_context() else None
+    if broker is not None:
+        broker.publish(task_events)
+
+def _discard_rolled_back(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop('task_events', None)
+
+def init_events(app, session):
+    """Create the app's broker and hook event publishing into the session"""
+    app.extensions['events'] = create_broker(app.config)
+    if not event.contains(session, 'after_commit', _publish_committed):
+        event.listen(session, 'after_commit', _publish_committed)
+        event.listen(session, 'after_soft_rollback', _discard_rolled_back)
@@ -0,0 +1,322 @@
+import json
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+from sqlalchemy import event, insert, select, update
+from app import db
+from app.models.job import Job
+from app.utils.storage import (archive_completed_tasks, delete_completed_tasks, delete_user_account,
+                               get_task_counts, rebuild_search_index, rebuild_task_counts)
+from app.utils.transfer import export_csv, export_ndjson, import_tasks
+
+# Long-running task operations, run off the request thread.
+#
+# A route calls submit_job(); the job row is committed on a connection of
+# its own (the request's unit of work stays open) and the work is then
+# handed to the app's executor, which runs the handler in its own app
+# context (and so its own session). Handlers report progress through their
+# JobContext, which is also where a requested cancellation is noticed.
+#
+# A claimed job records the process running it. Before a process serves its
+# first request it settles what dead processes left behind: their running
+# jobs fail, and queued jobs are submitted again.
+
+FINISHED = ('succeeded', 'failed', 'cancelled')
+
+# Tells this process apart from an earlier one that had the same pid
+_PROCESS_TOKEN = uuid.uuid4().hex[:8]
+
+# kind -> handler(user_id, params, ctx) returning a JSON-serialisable result
+HANDLERS = {}
+
+class JobCancelled(Exception):
+    """Raised inside a handler once its job has been asked to stop"""
+
+def job_handler(kind):
+    """Register a function as the handler of one job kind"""
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+class JobContext:
+    """Progress reporting and cooperative cancellation for one running job"""
+
+    def __init__(self, job_id, persist=True):
+        self.job_id = job_id
+        self.persist = persist
+        self.done = 0
+        self.total = None
+
+    def progress(self, done, total=None):
+        """Record progress, raising JobCancelled if the job should stop
+
+        Progress goes through its own connection so pollers see it while the
+        job's transaction is still open. SQLite allows a single writer, so
+        while the job itself holds a transaction only the cancel flag is read.
+        """
+        self.done = done
+        if total is not None:
+            self.total = total
+        if not self.persist:
+            return
+        with db.engine.begin() as conn:
+            if conn.dialect.name == 'sqlite' and db.session().in_transaction():
+                cancel = conn.execute(select(Job.cancel_requested).where(Job.id == self.job_id)).scalar()
+            else:
+                cancel = conn.execute(
+                    update(Job).where(Job.id == self.job_id)
+                    .values(progress=self.done, total=self.total)
+                    .returning(Job.cancel_requested)
+                ).scalar()
+        if cancel:
+            raise JobCancelled()
+
+def create_executor(config):
+    """Build the worker pool jobs run on (None when jobs run inline)"""
+    if config['JOBS_EXECUTOR'] == 'inline':
+        return None
+    return ThreadPoolExecutor(max_workers=config['JOBS_MAX_WORKERS'], thread_name_prefix='job')
+
+def _sqlite_write_pending(session):
+    """Whether the session holds SQLite's single write lock - it has written in its open transaction"""
+    if db.engine.dialect.name != 'sqlite' or not session.in_transaction():
+        return False
+    return session.connection().connection.dbapi_connection.in_transaction
+
+def _dispatch(app, job_id):
+    executor = app.extensions.get('jobs')
+    if executor is None:
+        # Inline mode (tests, single-threaded debugging) - run before returning
+        _run_job(app, job_id, persist_progress=False)
+    else:
+        executor.submit(_run_job, app, job_id)
+
+def submit_job(user_id, kind, params=None):
+    """Persist a queued job and start it in the background; returns the Job
+
+    The row is committed on its own connection, so whatever the caller's
+    session has staged is neither committed early nor lost. On SQLite a
+    session that has already written holds the only write lock: the row
+    then joins that transaction and the job starts once it commits.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f'Unknown job kind: {kind}')
+    values = {'user_id': user_id, 'kind': kind, 'params': json.dumps(params or {})}
+    session = db.session()
+    if _sqlite_write_pending(session):
+        job = Job(**values)
+        session.add(job)
+        session.flush()
+        session.info.setdefault('pending_jobs', []).append(job.id)
+        return job
+    with db.engine.begin() as conn:
+        job_id = conn.execute(insert(Job).values(**values)).inserted_primary_key[0]
+    _dispatch(current_app._get_current_object(), job_id)
+    return db.session.get(Job, job_id)
+
+def _dispatch_committed(session):
+    if session.get_nested_transaction() is not None:
+        return  # a SAVEPOINT was released - the real COMMIT is still to come
+    job_ids = session.info.pop('pending_jobs', None)
+    if job_ids and has_app_context():
+        app = current_app._get_current_object()
+        for job_id in job_ids:
+            _dispatch(app, job_id)
+
+def _discard_rolled_back(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop('pending_jobs', None)
+
+def _worker_id():
+    """Recorded on the jobs this process claims"""
+    return f'{socket.gethostname()}:{os.getpid()}:{_PROCESS_TOKEN}'
+
+def _worker_alive(worker):
+    """Whether the process that claimed a job may still be running it"""
+    host, _, rest = (worker or '').partition(':')
+    pid, _, token = rest.partition(':')
+    if not pid.isdigit():
+        return False  # claimed before jobs recorded their worker
+    if host != socket.gethostname():
+        return True  # another machine's job - that machine settles it
+    if int(pid) == os.getpid():
+        return token == _PROCESS_TOKEN
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # alive, owned by someone else
+    return True
+
+def recover_jobs(app):
+    """Fail the running jobs of processes that are gone and submit queued jobs again
+
+    Resubmitting a job another process still has queued is harmless: only
+    one of them wins the claim.
+    """
+    with db.engine.begin() as conn:
+        running = conn.execute(select(Job.id, Job.worker).where(Job.status == 'running')).all()
+        stale = [job_id for job_id, worker in running if not _worker_alive(worker)]
+        if stale:
+            conn.execute(
+                update(Job).where(Job.id.in_(stale), Job.status == 'running')
+                .values(status='failed', finished_at=datetime.utcnow(),
+                        error='Interrupted: the process running it exited.')
+            )
+        queued = conn.execute(select(Job.id).where(Job.status == 'queued').order_by(Job.id)).scalars().all()
+    for job_id in queued:
+        _dispatch(app, job_id)
+    return len(stale), len(queued)
+
+def init_jobs(app, session):
+    """Create the app's executor, start jobs staged in a session once it commits,
+    and recover leftover jobs before the first request is served (not in CLI commands)"""
+    app.extensions['jobs'] = create_executor(app.config)
+    if not event.contains(session, 'after_commit', _dispatch_committed):
+        event.listen(session, 'after_commit', _dispatch_committed)
+        event.listen(session, 'after_soft_rollback', _discard_rolled_back)
+
+    pending, lock = [True], threading.Lock()
+
+    @app.before_request
+    def recover_leftover_jobs():
+        if pending:
+            with lock:
+                if pending:
+                    pending.clear()
+                    recover_jobs(app)
+
+def get_job(user_id, job_id):
+    """Return the user's job with this id, or None"""
+    return Job.query.filter_by(id=job_id, user_id=user_id).first()
+
+def list_jobs(user_id, limit=50):
+    """The user's most recent jobs, newest first"""
+    return Job.query.filter_by(user_id=user_id).order_by(Job.id.desc()).limit(limit).all()
+
+def cancel_job(user_id, job_id):
+    """Ask a job to stop; returns False if there is no such unfinished job (does not commit)
+
+    A queued job is cancelled on the spot. A running one stops at its next
+    progress report; whatever it had committed by then stays.
+    """
+    now = datetime.utcnow()
+    owned = (Job.id == job_id) & (Job.user_id == user_id)
+    requested = db.session.execute(
+        update(Job).where(owned, Job.status.notin_(FINISHED)).values(cancel_requested=True)
+    ).rowcount
+    db.session.execute(
+        update(Job).where(owned, Job.status == 'queued').values(status='cancelled', finished_at=now)
+    )
+    return bool(requested)
+
+def job_result_path(job_id, file_format):
+    """Where an export job writes its file"""
+    return os.path.join(current_app.config['JOBS_DIR'], f'export-{job_id}.{file_format}')
+
+def _finish(job_id, status, ctx, result=None, error=None):
+    db.session.execute(
+        update(Job).where(Job.id == job_id).values(
+            status=status, progress=ctx.done, total=ctx.total, finished_at=datetime.utcnow(),
+            result=json.dumps(result) if result is not None else None, error=error,
+        )
+    )
+    db.session.commit()
+
+def _run_job(app, job_id, persist_progress=True):
+    """Executor entry point: claim a queued job, run its handler, record the outcome"""
+    with app.app_context():
+        try:
+            # Claiming with a conditional UPDATE loses cleanly against a cancel
+            claimed = db.session.execute(
+                update(Job).where(Job.id == job_id, Job.status == 'queued')
+                .values(status='running', started_at=datetime.utcnow(), worker=_worker_id())
+            ).rowcount
+            db.session.commit()
+            if not claimed:
+                return
+            job = db.session.get(Job, job_id)
+            user_id, handler, params = job.user_id, HANDLERS[job.kind], json.loads(job.params)
+
+            ctx = JobContext(job_id, persist=persist_progress)
+            try:
+                result = handler(user_id, params, ctx)
+            except JobCancelled:
+                db.session.rollback()
+                _finish(job_id, 'cancelled', ctx)
+            except Exception as e:
+                db.session.rollback()
+                app.logger.exception('Job %s (%s) failed', job_id, job.kind)
+                _finish(job_id, 'failed', ctx, error=str(e) or e.__class__.__name__)
+            else:
+                _finish(job_id, 'succeeded', ctx, result=result)
+        finally:
+            db.session.remove()
+
+@job_handler('clear_completed')
+def _clear_completed(user_id, params, ctx):
+    """Delete all completed tasks; cancelling rolls the whole delete back"""
+    ctx.progress(0, get_task_counts(user_id).completed_count)
+    deleted = delete_completed_tasks(user_id, current_app.config['CLEAR_COMPLETED_CHUNK_SIZE'],
+                                     on_chunk=ctx.progress)
+    ctx.done = deleted
+    return {'deleted': deleted}
+
+@job_handler('archive')
+def _archive(user_id, params, ctx):
+    """Move old completed tasks to the archive; cancelling keeps the batches already moved"""
+    days = params.get('days', current_app.config['ARCHIVE_AFTER_DAYS'])
+    archived = archive_completed_tasks(user_id, datetime.utcnow() - timedelta(days=days),
+                                       current_app.config['ARCHIVE_BATCH_SIZE'], on_batch=ctx.progress)
+    ctx.done = archived
+    return {'archived': archived}
+
+@job_handler('delete_account')
+def _delete_account(user_id, params, ctx):
+    """Delete the user and all their data - this job's own row goes with them"""
+    ctx.progress(0, get_task_counts(user_id).total_count)
+    deleted = delete_user_account(user_id, current_app.config['ACCOUNT_DELETE_CHUNK_SIZE'], on_chunk=ctx.progress)
+    return {'deleted': deleted}
+
+@job_handler('import')
+def _import(user_id, params, ctx):
+    """Import an uploaded file saved by the /import route, then remove it"""
+    try:
+        with open(params['path'], encoding='utf-8') as f:
+            imported, skipped = import_tasks(user_id, f, params['format'], progress=ctx.progress)
+    finally:
+        os.remove(params['path'])
+    return {'imported': imported, 'skipped': skipped}
+
+@job_handler('export')
+def _export(user_id, params, ctx):
+    """Write the user's tasks to a file served by /jobs/<id>/download"""
+    file_format = params['format']
+    exporter = export_csv if file_format == 'csv' else export_ndjson
+    path = job_result_path(ctx.job_id, file_format)
+    ctx.progress(0, get_task_counts(user_id).total_count)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            for chunk in exporter(user_id, current_app.config['STREAM_CHUNK_ROWS'], progress=ctx.progress):
+                f.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return {'rows': ctx.done, 'format': file_format}
+
+@job_handler('reindex')
+def _reindex(user_id, params, ctx):
+    """Rebuild the user's counters and full-text rows from the tasks table"""
+    rebuild_task_counts(user_id)
+    rebuild_search_index(user_id)
+    db.session.commit()
+    counts = get_task_counts(user_id)
+    ctx.done = ctx.total = counts.total_count
+    return counts._asdict()
@@ -0,0 +1,370 @@
+import atexit
+import json
+import mmap
+import os
+import threading
+import uuid
+from datetime import datetime
+from app.utils.task_store import TaskKey, TaskStore
+
+try:
+    import fcntl
+except ImportError:  # Windows - no advisory locks, keeping to one process is up to the operator
+    fcntl = None
+
+# Append-only file store for tasks (TASK_STORE = 'log').
+#
+# Every change appends one JSON line per upserted task, delete, archived
+# task or purge, then a commit line. On open, anything after the last
+# commit line is a torn write and is cut off. An in-memory per-user index
+# maps each live task to the offset and length of its latest line, and
+# lines are read back through an mmap of the log - a page of the list parses
+# the lines of that page only. The index (with TaskStore's sort keys) is
+# checkpointed next to the log every TASK_LOG_CHECKPOINT_EVERY changes: only
+# the users changed since the last checkpoint are re-encoded under the write
+# lock, and a background thread writes and fsyncs the file. After a crash
+# the index is rebuilt from the checkpoint plus a replay of the log tail.
+# Superseded lines are dropped by compaction, which copies the live lines
+# into a fresh log.
+#
+# One process owns a log file (the edge/single-box case): the store holds an
+# exclusive flock on <log>.lock for as long as it is open, so a second
+# worker, a reloader child or a `flask` maintenance command started next to
+# the server fails with TaskLogLocked instead of replaying - and truncating
+# - a log another process is appending to.
+
+_DATETIMES = ('created_at', 'updated_at', 'completed_at', 'archived_at')
+
+def _encode(record):
+    return (json.dumps(record, separators=(',', ':'), default=datetime.isoformat) + '\n').encode('utf-8')
+
+def _decode_task(task):
+    for field in _DATETIMES:
+        if task.get(field):
+            task[field] = datetime.fromisoformat(task[field])
+    return task
+
+
+class TaskLogLocked(RuntimeError):
+    """The task log is open in another process"""
+
+def _lock(path):
+    """Take the exclusive lock file of a log; returns it open, raises TaskLogLocked if it is taken"""
+    f = open(path, 'a+', encoding='utf-8')
+    if fcntl is not None:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.seek(0)
+            owner = f.read().strip() or 'another process'
+            f.close()
+            raise TaskLogLocked(f'The task log is in use by process {owner} ({path}). Only one process may '
+                                'open it: run a single worker, and stop the server before running '
+                                'maintenance commands against TASK_STORE=log.') from None
+    f.truncate(0)
+    f.write(str(os.getpid()))
+    f.flush()
+    return f
+
+
+class LogTaskStore(TaskStore):
+    """Tasks in an append-only log file with an offset index, checkpoints and compaction"""
+
+    def __init__(self, path, fsync=False, compact_min_bytes=4 << 20, checkpoint_every=1000):
+        super().__init__()
+        self.path = path
+        self.checkpoint_path = path + '.idx'
+        self.fsync = fsync
+        self.compact_min_bytes = compact_min_bytes
+        self.checkpoint_every = checkpoint_every
+        self.file = None
+        self.map = None
+        self.checkpoint_lock = threading.Lock()   # one checkpoint file write at a time
+        self.checkpoint_thread = None
+        self.checkpointed = (None, 0)             # (generation, size) of the checkpoint on disk
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Taken before anything is read: replay truncates what it takes for a torn tail
+        self.lock_file = _lock(path + '.lock')
+        self.pid = os.getpid()
+        self._open()
+        atexit.register(self.close)
+
+    def _reset(self):
+        self._reset_indexes()
+        self.tasks = {}        # user_id -> {task_id: (offset, length)}
+        self.archive = {}      # user_id -> {task_id: (offset, length)}
+        self.live_bytes = 0    # bytes of lines still in use - the rest is garbage for compaction
+        self.size = 0          # end of the last committed change
+        self.changes = 0       # changes since the last checkpoint
+        self.replayed = 0      # changes replayed from the log by the last open
+        self.fragments = {}    # user_id -> the user's checkpoint entry, encoded
+        self.dirty = set()     # users changed since their fragment was encoded
+
+    def _open(self):
+        self._reset()
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            tmp = self.path + '.new'
+            with open(tmp, 'wb') as f:
+                f.write(_encode({'op': 'header', 'generation': uuid.uuid4().hex}))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        with open(self.path, 'rb') as f:
+            header = f.readline()
+        header_record = json.loads(header)
+        self.generation = header_record['generation']
+        # Compaction drops the lines of deleted and archived tasks - their ids must stay used
+        self.next_id = header_record.get('next_id', 1)
+        self.size = len(header)
+        self._load_checkpoint()
+        self._replay()
+        self.dirty = set(self.tasks) | set(self.archive) | set(self.versions)
+        self.file = open(self.path, 'ab')
+
+    # Recovery
+
+    def _load_checkpoint(self):
+        """Restore the index from the checkpoint if it belongs to this log"""
+        try:
+            with open(self.checkpoint_path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if state.get('generation') != self.generation or state['size'] > os.path.getsize(self.path):
+            return  # written for a log that was compacted away, or ahead of what reached the disk
+        for user_id, tasks, archive, tombstones, version in state['users']:
+            if tasks:
+                self.tasks[user_id] = {entry[0]: (entry[1], entry[2]) for entry in tasks}
+                self._restore(user_id, {task_id: TaskKey(status, datetime.fromisoformat(created_at), title, seq)
+                                        for task_id, _, _, status, created_at, title, seq in tasks})
+            if archive:
+                self.archive[user_id] = {task_id: (offset, length) for task_id, offset, length in archive}
+            if tombstones:
+                self.tombstones[user_id] = [tuple(entry) for entry in tombstones]
+            self.versions[user_id] = version
+        self.next_id = state['next_id']
+        self.live_bytes = state['live_bytes']
+        self.size = state['size']
+
+    def _replay(self):
+        """Apply the committed changes after self.size, then cut off a torn tail"""
+        with open(self.path, 'rb') as f:
+            f.seek(self.size)
+            offset, pending = self.size, []
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record['op'] == 'commit':
+                    self._apply(pending)
+                    pending = []
+                    self.size = offset + len(line)
+                    self.replayed += 1
+                else:
+                    pending.append((offset, len(line), record))
+                offset += len(line)
+        if os.path.getsize(self.path) > self.size:
+            # The process died while appending this change - it never happened
+            with open(self.path, 'r+b') as f:
+                f.truncate(self.size)
+
+    def _snapshot(self):
+        """Re-encode the changed users' entries; returns what _write_checkpoint needs (under self.lock)"""
+        for user_id in self.dirty:
+            tasks, archive = self.tasks.get(user_id, {}), self.archive.get(user_id, {})
+            if not (tasks or archive or user_id in self.versions):
+                self.fragments.pop(user_id, None)  # purged
+                continue
+            keys = self.keys[user_id] if tasks else {}
+            self.fragments[user_id] = json.dumps([
+                user_id,
+                [[task_id, *entry, *keys[task_id]] for task_id, entry in tasks.items()],
+                [[task_id, *entry] for task_id, entry in archive.items()],
+                self.tombstones.get(user_id, []),
+                self.versions.get(user_id, 0),
+            ], separators=(',', ':'), default=datetime.isoformat)
+        self.dirty = set()
+        self.changes = 0
+        self.file.flush()
+        head = json.dumps({'generation': self.generation, 'size': self.size, 'next_id': self.next_id,
+                           'live_bytes': self.live_bytes}, separators=(',', ':'))
+        return self.generation, self.size, head, list(self.fragments.values())
+
+    def _write_checkpoint(self, generation, size, head, fragments):
+        """Write a snapshot to the checkpoint file - needs no self.lock, so writes go on meanwhile"""
+        with self.checkpoint_lock:
+            done_generation, done_size = self.checkpointed
+            if generation != self.generation or (generation == done_generation and size <= done_size):
+                return  # overtaken by compaction or by a newer checkpoint
+            with open(self.path, 'rb') as f:
+                os.fsync(f.fileno())  # the log up to `size` must be on disk before a checkpoint claims it
+            tmp = self.checkpoint_path + '.new'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(head[:-1] + ',"users":[')
+                f.write(','.join(fragments))
+                f.write(']}')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.checkpoint_path)
+            self.checkpointed = (generation, size)
+
+    def checkpoint(self):
+        """Write the index to disk now, so the next open only replays what follows"""
+        with self.lock:
+            snapshot = self._snapshot()
+        self._write_checkpoint(*snapshot)
+
+    def _checkpoint_in_background(self):
+        if self.checkpoint_thread is not None and self.checkpoint_thread.is_alive():
+            return  # the previous one is still writing - retried on the next change
+        self.checkpoint_thread = threading.Thread(target=self._write_checkpoint, args=self._snapshot(),
+                                                  name='task-log-checkpoint', daemon=True)
+        self.checkpoint_thread.start()
+
+    # Index maintenance
+
+    def _drop(self, user_id, task_id):
+        entry = self.tasks.get(user_id, {}).pop(task_id, None)
+        if entry is not None:
+            self.live_bytes -= entry[1]
+
+    def _apply(self, lines):
+        """Fold committed lines into the index"""
+        for offset, length, record in lines:
+            op = record['op']
+            user_id = record['task']['user_id'] if op in ('put', 'archive') else record['user_id']
+            self.dirty.add(user_id)
+            if op == 'put':
+                task = record['task']
+                self._drop(user_id, task['id'])
+                self.tasks.setdefault(user_id, {})[task['id']] = (offset, length)
+                self.live_bytes += length
+                self._index(user_id, task)
+            elif op == 'delete':
+                for task_id in record['ids']:
+                    self._drop(user_id, task_id)
+                    self._tombstone(user_id, task_id, record['seq'])
+                self._bump(user_id, record['seq'])
+            elif op == 'archive':
+                task = record['task']
+                self.archive.setdefault(user_id, {})[task['id']] = (offset, length)
+                self.live_bytes += length
+                self.next_id = max(self.next_id, task['id'] + 1)
+            elif op == 'purge':
+                for entries in (self.tasks.pop(user_id, {}), self.archive.pop(user_id, {})):
+                    self.live_bytes -= sum(entry[1] for entry in entries.values())
+                self._forget(user_id)
+            elif op == 'state':
+                # Written by compaction: what the dropped delete lines used to carry
+                self.live_bytes += length
+                self._bump(user_id, record['version'])
+                self.tombstones.setdefault(user_id, []).extend(tuple(t) for t in record['tombstones'])
+
+    def _append(self, records):
+        """Append one change (its lines plus a commit line) and index it"""
+        if os.getpid() != self.pid:
+            # A forked worker shares the lock with its parent, but not the index
+            raise TaskLogLocked(f'The task log was opened by process {self.pid} before a fork; '
+                                'create the app in each worker (no preloading) and run one worker.')
+        lines = [_encode(record) for record in records]
+        try:
+            self.file.write(b''.join(lines))
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+        except BaseException:
+            self.file.truncate(self.size)
+            raise
+        offset, applied = self.size, []
+        for record, line in zip(records, lines):
+            if record['op'] != 'commit':
+                applied.append((offset, len(line), record))
+            offset += len(line)
+        self.size = offset
+        self._apply(applied)
+
+        self.changes += 1
+        if self.changes >= self.checkpoint_every:
+            self._checkpoint_in_background()
+        garbage = self.size - self.live_bytes
+        if garbage > self.compact_min_bytes and garbage > self.live_bytes:
+            self.compact()
+
+    def _line(self, offset, length):
+        if self.map is None or offset + length > len(self.map):
+            # The log grew since it was mapped
+            if self.map is not None:
+                self.map.close()
+            with open(self.path, 'rb') as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map[offset:offset + length]
+
+    def compact(self):
+        """Copy the live lines into a new log and switch to it"""
+        with self.lock:
+            tmp = self.path + '.compact'
+            with open(tmp, 'wb') as out:
+                out.write(_encode({'op': 'header', 'generation': uuid.uuid4().hex, 'next_id': self.next_id}))
+                for user_id in set(self.tasks) | set(self.archive) | set(self.versions):
+                    for offset, length in self.tasks.get(user_id, {}).values():
+                        out.write(self._line(offset, length))
+                    for offset, length in self.archive.get(user_id, {}).values():
+                        out.write(self._line(offset, length))
+                    out.write(_encode({'op': 'state', 'user_id': user_id, 'version': self.versions.get(user_id, 0),
+                                       'tombstones': self.tombstones.get(user_id, [])}))
+                    out.write(_encode({'op': 'commit'}))
+                out.flush()
+                os.fsync(out.fileno())
+            self._close_files()
+            os.replace(tmp, self.path)
+            self._open()
+            self.checkpoint()
+
+    def _close_files(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _unlock(self):
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def close(self):
+        """Checkpoint, release the files and the lock (also run at interpreter exit)"""
+        with self.lock:
+            if self.file is None:
+                return
+            if self.changes:
+                self.checkpoint()
+            elif self.checkpoint_thread is not None:
+                self.checkpoint_thread.join()
+            self._close_files()
+            self._unlock()
+
+    # TaskStore primitives
+
+    def _load(self, user_id, task_ids):
+        entries = self.tasks.get(user_id, {})
+        return [_decode_task(json.loads(self._line(*entries[task_id]))['task'])
+                for task_id in task_ids if task_id in entries]
+
+    def _write(self, user_id, seq, puts, deletes, archives, now):
+        records = [{'op': 'put', 'task': task} for task in puts]
+        if deletes:
+            records.append({'op': 'delete', 'user_id': user_id, 'seq': seq, 'ids': deletes, 'at': now})
+        records += [{'op': 'archive', 'task': task} for task in archives]
+        self._append(records + [{'op': 'commit', 'user_id': user_id, 'seq': seq}])
+
+    def _archived(self, user_id):
+        return [_decode_task(json.loads(self._line(offset, length))['task'])
+                for offset, length in self.archive.get(user_id, {}).values()]
+
+    def _purge(self, user_id):
+        self._append([{'op': 'purge', 'user_id': user_id}, {'op': 'commit', 'user_id': user_id, 'seq': 0}])
@@ -0,0 +1,96 @@
+import itertools
+from datetime import datetime
+from app.models.user import User
+from app.utils.storage import DuplicateUserError
+from app.utils.task_store import TaskStore
+from app.utils.user_cache import forget_cached_user
+
+# In-process task and user store (TASK_STORE = 'memory').
+#
+# Task dicts keyed by user and task id; lookups, counters, versions and
+# ordered pages come from the indexes TaskStore keeps up to date on every
+# write, so nothing is ever scanned or sorted per request. Users are kept
+# here too, with dicts standing in for the unique username and email
+# indexes, so registration, login and the user loader never reach the
+# database either. Nothing survives the process: it is meant for tests and
+# for benchmarking routes without the ORM and the database.
+
+
+class MemoryTaskStore(TaskStore):
+    """Tasks and users in dicts of the current process"""
+
+    keeps_users = True
+
+    def __init__(self):
+        super().__init__()
+        self.tasks = {}        # user_id -> {task_id: task dict}
+        self.archive = {}      # user_id -> {task_id: archived task dict}
+        self.users = {}        # user_id -> User (transient - never added to a session)
+        self.usernames = {}    # username -> user_id
+        self.emails = {}       # email -> user_id
+        self.user_ids = itertools.count(1)
+
+    def _load(self, user_id, task_ids):
+        # Copies - callers edit what they load before writing it back
+        tasks = self.tasks.get(user_id, {})
+        return [dict(tasks[task_id]) for task_id in task_ids if task_id in tasks]
+
+    def _write(self, user_id, seq, puts, deletes, archives, now):
+        tasks = self.tasks.setdefault(user_id, {})
+        for task in puts:
+            tasks[task['id']] = dict(task)
+            self._index(user_id, task)
+        for task_id in deletes:
+            tasks.pop(task_id, None)
+            self._tombstone(user_id, task_id, seq)
+        for task in archives:
+            self.archive.setdefault(user_id, {})[task['id']] = dict(task)
+        self._bump(user_id, seq)
+
+    def _archived(self, user_id):
+        return [dict(task) for task in self.archive.get(user_id, {}).values()]
+
+    def _purge(self, user_id):
+        self.tasks.pop(user_id, None)
+        self.archive.pop(user_id, None)
+        self._forget(user_id)
+
+    # Users - storage.py's user functions
+
+    def get_user(self, user_id):
+        return self.users.get(user_id)
+
+    def find_user(self, username):
+        with self.lock:
+            return self.users.get(self.usernames.get(username))
+
+    def create_user(self, user):
+        with self.lock:
+            if user.username in self.usernames:
+                raise DuplicateUserError('username')
+            if user.email in self.emails:
+                raise DuplicateUserError('email')
+            user.id = next(self.user_ids)
+            user.created_at = user.created_at or datetime.utcnow()
+            self.users[user.id] = user
+            self.usernames[user.username] = self.emails[user.email] = user.id
+        return user
+
+    def insert_user_rows(self, rows):
+        created = 0
+        for row in rows:
+            try:
+                self.create_user(User(**row))
+            except DuplicateUserError:
+                continue
+            created += 1
+        return created
+
+    def delete_user(self, user_id):
+        """Drop the user (their tasks go through delete_user_tasks first)"""
+        with self.lock:
+            user = self.users.pop(user_id, None)
+            if user is not None:
+                self.usernames.pop(user.username, None)
+                self.emails.pop(user.email, None)
+        forget_cached_user(user_id)
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+class MemoryPageCache:
+    """LRU cache of rendered pages inside one worker process
+
+    Bounded by entry count and by the total length of the cached pages, so
+    a few users with huge task lists cannot grow the worker without limit.
+    """
+    
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0  # sum of len(page) over entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key):
+        """Return the cached page or None, refreshing its LRU position"""
+        with self.lock:
+            page = self.entries.get(key)
+            if page is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return page
+    
+    def set(self, key, page):
+        """Store a page, evicting the least recently used ones over either limit"""
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            if len(page) > self.max_bytes:
+                return  # would evict everything else and still not fit
+            self.entries[key] = page
+            self.size += len(page)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+    
+    def stats(self):
+        """Hit/miss counters for this process"""
+        with self.lock:
+            return {'backend': 'memory', 'entries': len(self.entries), 'max_entries': self.max_entries,
+                    'bytes': self.size, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+class SQLitePageCache:
+    """LRU cache of rendered pages in a local SQLite file shared by all workers on the host"""
+    
+    def __init__(self, path, max_entries=1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.local = threading.local()
+        self.lock = threading.Lock()  # guards the counters - connections are per thread
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS pages (key TEXT PRIMARY KEY, page TEXT NOT NULL, used REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_pages_used ON pages (used)')
+    
+    def _connection(self):
+        """One connection per thread - sqlite3 connections are not shareable"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            import sqlite3  # only the SQLite backend needs it, so not loaded at startup
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            self.local.conn = conn
+        return conn
+    
+    def get(self, key):
+        conn = self._connection()
+        row = conn.execute('SELECT page FROM pages WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            with self.lock:
+                self.misses += 1
+            return None
+        conn.execute('UPDATE pages SET used = ? WHERE key = ?', (time.time(), key))
+        with self.lock:
+            self.hits += 1
+        return row[0]
+    
+    def set(self, key, page):
+        conn = self._connection()
+        conn.execute('INSERT OR REPLACE INTO pages (key, page, used) VALUES (?, ?, ?)', (key, page, time.time()))
+        conn.execute(
+            'DELETE FROM pages WHERE key IN (SELECT key FROM pages ORDER BY used DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        )
+    
+    def clear(self):
+        self._connection().execute('DELETE FROM pages')
+    
+    def stats(self):
+        """Hit/miss counters for this process, entry count for the shared file"""
+        entries = self._connection().execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+        with self.lock:
+            return {'backend': 'sqlite', 'entries': entries, 'max_entries': self.max_entries,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+def create_page_cache(config):
+    """Build the cache selected by PAGE_CACHE_BACKEND ('memory', 'sqlite' or None)"""
+    backend = config.get('PAGE_CACHE_BACKEND')
+    if backend == 'memory':
+        return MemoryPageCache(config['PAGE_CACHE_MAX_ENTRIES'], config['PAGE_CACHE_MAX_BYTES'])
+    if backend == 'sqlite':
+        return SQLitePageCache(config['PAGE_CACHE_PATH'], config['PAGE_CACHE_MAX_ENTRIES'])
+    if backend:
+        raise ValueError(f'Unknown PAGE_CACHE_BACKEND: {backend!r}')
+    return None
@@ -0,0 +1,99 @@
+import os
+import threading
+from functools import partial
+from flask import current_app, has_app_context
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+# Password hashing under a configurable policy.
+#
+# The method string is Werkzeug's ("pbkdf2:sha256:600000", ...) and is stored
+# as the prefix of every hash, so hashes made under an older policy are
+# recognised on login and replaced while the plain password is at hand.
+# Hashing is CPU-bound and holds the GIL; with PASSWORD_HASH_WORKERS > 0 it
+# runs in a process pool instead of on the request thread.
+
+def _canonical(method):
+    """The method prefix Werkzeug writes for `method` (it fills in the default PBKDF2 cost)"""
+    if method.startswith('pbkdf2:') and method.count(':') == 1:
+        return f'{method}:{DEFAULT_PBKDF2_ITERATIONS}'
+    return method
+
+class PasswordHasher:
+    """Hash and verify passwords, optionally in a bounded process pool"""
+    
+    def __init__(self, method='pbkdf2:sha256', salt_length=16, workers=0):
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self.pool = None
+        self.pool_pid = None
+        self.lock = threading.Lock()
+        # At most two hashes per pool process in flight; further callers wait here
+        self.slots = threading.BoundedSemaphore(2 * workers) if workers else None
+    
+    def _executor(self):
+        # A pool does not survive fork - a worker forked after it was started builds its own
+        with self.lock:
+            if self.pool is None or self.pool_pid != os.getpid():
+                # Imported here - multiprocessing is only loaded when a pool is configured
+                from concurrent.futures import ProcessPoolExecutor
+                self.pool = ProcessPoolExecutor(max_workers=self.workers)
+                self.pool_pid = os.getpid()
+            return self.pool
+    
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        from concurrent.futures.process import BrokenProcessPool
+        with self.slots:
+            try:
+                return self._executor().submit(fn, *args).result()
+            except BrokenProcessPool:
+                # A pool process died - start a fresh pool next time, hash here this time
+                with self.lock:
+                    self.pool = None
+                return fn(*args)
+    
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+    
+    def hash_many(self, passwords, executor=None, chunksize=16):
+        """Hash a batch of passwords, spread over `executor` (e.g. a ProcessPoolExecutor) if given"""
+        hash_one = partial(generate_password_hash, method=self.method, salt_length=self.salt_length)
+        if executor is None:
+            return [hash_one(password) for password in passwords]
+        return list(executor.map(hash_one, passwords, chunksize=chunksize))
+    
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+    
+    def needs_rehash(self, pwhash):
+        """True if `pwhash` was made with a different method, cost or salt length"""
+        method, _, rest = pwhash.partition('$')
+        return method != _canonical(self.method) or len(rest.partition('$')[0]) != self.salt_length
+    
+    def shutdown(self):
+        with self.lock:
+            if self.pool is not None and self.pool_pid == os.getpid():
+                self.pool.shutdown()
+            self.pool = None
+
+def create_password_hasher(config):
+    """Build the hasher described by the PASSWORD_HASH_* settings"""
+    return PasswordHasher(config['PASSWORD_HASH_METHOD'], config['PASSWORD_SALT_LENGTH'],
+                          config['PASSWORD_HASH_WORKERS'])
+
+# Used outside an application context (scripts, the shell)
+_default_hasher = PasswordHasher()
+
+def _hasher():
+    return current_app.extensions['passwords'] if has_app_context() else _default_hasher
+
+def hash_password(password):
+    return _hasher().hash(password)
+
+def verify_password(pwhash, password):
+    return _hasher().verify(pwhash, password)
+
+def password_needs_rehash(pwhash):
+    return _hasher().needs_rehash(pwhash)
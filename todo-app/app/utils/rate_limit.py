@@ -0,0 +1,141 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Sliding-window rate limiting with O(1) state per key.
+#
+# Time is cut into fixed windows; a key keeps only the start of its current
+# window and the hit counts of that window and the previous one. The
+# previous count is weighted by how much of it still overlaps the sliding
+# window, which approximates a true sliding log without storing timestamps.
+
+def _slide(state, now, window):
+    """Advance (start, current, previous) to the window containing `now`"""
+    start, current, previous = state
+    window_start = now - now % window
+    if window_start != start:
+        previous = current if window_start - start == window else 0
+        current, start = 0, window_start
+    return start, current, previous
+
+def _estimate(start, current, previous, now, window):
+    return previous * (1 - (now - start) / window) + current
+
+def _retry_after(start, now, window):
+    return max(1, math.ceil(start + window - now))
+
+
+class MemoryRateLimiter:
+    """Per-process limiter - each worker counts on its own"""
+    
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self.entries = OrderedDict()  # key -> (start, current, previous, window)
+        self.lock = threading.Lock()
+    
+    def hit(self, key, limit, window):
+        """Count one attempt; returns None if allowed, else seconds to wait
+
+        Rejected attempts are not counted, so a blocked client is let back
+        in as soon as its earlier attempts slide out of the window.
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            start, current, previous = _slide(entry[:3] if entry else (0, 0, 0), now, window)
+            if _estimate(start, current, previous, now, window) + 1 > limit:
+                self.entries[key] = (start, current, previous, window)
+                self.entries.move_to_end(key)
+                return _retry_after(start, now, window)
+            self.entries[key] = (start, current + 1, previous, window)
+            self.entries.move_to_end(key)
+            self._evict(now)
+            return None
+    
+    def reset(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+    
+    def _evict(self, now):
+        # Least recently hit first: drop keys idle for two windows, then anything over the limit
+        while self.entries:
+            start, _, _, window = next(iter(self.entries.values()))
+            if start + 2 * window > now and len(self.entries) <= self.max_keys:
+                break
+            self.entries.popitem(last=False)
+
+
+class SQLiteRateLimiter:
+    """Limiter whose counters live in a local SQLite file shared by all workers on the host"""
+    
+    # Idle keys are purged on roughly one hit in this many
+    PURGE_EVERY = 1000
+    
+    def __init__(self, path, max_keys=100000):
+        self.path = path
+        self.max_keys = max_keys
+        self.local = threading.local()
+        self.hits = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS limits (key TEXT PRIMARY KEY, start REAL NOT NULL, '
+            'current INTEGER NOT NULL, previous INTEGER NOT NULL, expires REAL NOT NULL)'
+        )
+    
+    def _connection(self):
+        """One connection per thread - sqlite3 connections are not shareable"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            import sqlite3
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            self.local.conn = conn
+        return conn
+    
+    def hit(self, key, limit, window):
+        """Count one attempt; returns None if allowed, else seconds to wait"""
+        now = time.time()
+        conn = self._connection()
+        # IMMEDIATE takes the write lock up front, so read-modify-write is atomic across processes
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT start, current, previous FROM limits WHERE key = ?', (key,)).fetchone()
+            start, current, previous = _slide(row or (0, 0, 0), now, window)
+            allowed = _estimate(start, current, previous, now, window) + 1 <= limit
+            conn.execute(
+                'INSERT OR REPLACE INTO limits (key, start, current, previous, expires) VALUES (?, ?, ?, ?, ?)',
+                (key, start, current + allowed, previous, start + 2 * window)
+            )
+            self.hits += 1
+            if self.hits % self.PURGE_EVERY == 0:
+                self._purge(conn, now)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return None if allowed else _retry_after(start, now, window)
+    
+    def reset(self, key):
+        self._connection().execute('DELETE FROM limits WHERE key = ?', (key,))
+    
+    def _purge(self, conn, now):
+        conn.execute('DELETE FROM limits WHERE expires < ?', (now,))
+        conn.execute(
+            'DELETE FROM limits WHERE key IN (SELECT key FROM limits ORDER BY expires DESC LIMIT -1 OFFSET ?)',
+            (self.max_keys,)
+        )
+
+
+def create_rate_limiter(config):
+    """Build the limiter selected by RATE_LIMIT_BACKEND ('memory', 'sqlite' or None)"""
+    backend = config.get('RATE_LIMIT_BACKEND')
+    if backend == 'memory':
+        return MemoryRateLimiter(config['RATE_LIMIT_MAX_KEYS'])
+    if backend == 'sqlite':
+        return SQLiteRateLimiter(config['RATE_LIMIT_PATH'], config['RATE_LIMIT_MAX_KEYS'])
+    if backend:
+        raise ValueError(f'Unknown RATE_LIMIT_BACKEND: {backend!r}')
+    return None
@@ -0,0 +1,136 @@
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, session as cookie_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.sql.elements import TextClause
+
+# Engine/pool settings and read/write splitting.
+#
+# Each replica URI gets its own engine; each request (or session outside
+# one) takes the next in round-robin order and keeps it, so replicas
+# lagging by different amounts never show it two states in turn.
+# Storage functions that only read (listing, counters, search) are wrapped
+# in replica_reads(); while one runs, RoutingSession sends its SELECTs to
+# that replica. Everything else - writes (raw text() ones included),
+# flushes, and every read in a session that has written - stays on the
+# primary. After a request writes, the
+# browser session is pinned to the primary for DB_REPLICA_STICKY_SECONDS so
+# users always read their own writes.
+
+def engine_options(config, url):
+    """create_engine() options for one database URI from the DB_POOL_* settings"""
+    options = {'pool_pre_ping': config['DB_POOL_PRE_PING']}
+    if url.startswith('sqlite') and (':memory:' in url or url.rstrip('/') in ('sqlite:', 'sqlite://')):
+        return options  # a single shared connection - there is no pool to size
+    options.update(pool_size=config['DB_POOL_SIZE'], max_overflow=config['DB_MAX_OVERFLOW'],
+                   pool_timeout=config['DB_POOL_TIMEOUT'], pool_recycle=config['DB_POOL_RECYCLE'])
+    return options
+
+def configure_engines(app):
+    """Fill in SQLALCHEMY_ENGINE_OPTIONS and build the replica engines - call before db.init_app"""
+    config = app.config
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(config, config['SQLALCHEMY_DATABASE_URI'])
+    engines = [create_engine(url, **engine_options(config, url)) for url in config['DB_REPLICA_URLS']]
+    app.extensions['replica_engines'] = engines
+    app.extensions['replicas'] = itertools.cycle(engines) if engines else None
+    app.extensions['replica_lock'] = threading.Lock()
+
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores foreign keys - and so ON DELETE CASCADE - unless each connection asks
+    dbapi_connection.execute('PRAGMA foreign_keys=ON')
+
+def enforce_foreign_keys(app, db):
+    """Turn on foreign key enforcement for SQLite connections of the primary and every replica"""
+    with app.app_context():
+        engines = [db.engine] + app.extensions['replica_engines']
+    for engine in engines:
+        if engine.dialect.name == 'sqlite' and not event.contains(engine, 'connect', _enable_sqlite_foreign_keys):
+            event.listen(engine, 'connect', _enable_sqlite_foreign_keys)
+
+
+def _is_read(statement):
+    """Whether a statement only reads - a text() one when it is a plain SELECT"""
+    if isinstance(statement, TextClause):
+        return statement.text.lstrip()[:6].upper() == 'SELECT'
+    return bool(getattr(statement, 'is_select', False))
+
+
+class RoutingSession(Session):
+    """db.session class that sends replica-eligible SELECTs to its read replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and self.info.get('replica_reads') and not self._flushing
+                and not self.info.get('wrote') and not self.info.get('primary_only')
+                and _is_read(clause)):
+            replicas = current_app.extensions.get('replicas')
+            if replicas is not None:
+                replica = self.info.get('replica')
+                if replica is None:
+                    with current_app.extensions['replica_lock']:
+                        replica = self.info['replica'] = next(replicas)
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@contextmanager
+def replica_reads(session):
+    """Let the SELECTs issued inside the block go to a replica"""
+    session.info['replica_reads'] = session.info.get('replica_reads', 0) + 1
+    try:
+        yield
+    finally:
+        session.info['replica_reads'] -= 1
+
+def replica_read(session_factory):
+    """Decorator form of replica_reads() for storage functions that only read"""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with replica_reads(session_factory()):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def _mark_write(orm_execute_state):
+    if not _is_read(orm_execute_state.statement):
+        orm_execute_state.session.info['wrote'] = True
+
+def _mark_flush(session, flush_context):
+    session.info['wrote'] = True
+
+def init_replicas(app, db):
+    """Track writes on the session and keep a writer's next requests on the primary"""
+    if not event.contains(db.session, 'do_orm_execute', _mark_write):
+        event.listen(db.session, 'do_orm_execute', _mark_write)
+        event.listen(db.session, 'after_flush', _mark_flush)
+
+    @app.before_request
+    def route_reads():
+        info = db.session().info
+        info['wrote'] = False
+        info.pop('replica', None)
+        info['primary_only'] = cookie_session.get('primary_until', 0) > time.time()
+
+    @app.after_request
+    def pin_writer_to_primary(response):
+        if db.session().info.pop('wrote', False) and app.extensions['replicas'] is not None:
+            cookie_session['primary_until'] = time.time() + app.config['DB_REPLICA_STICKY_SECONDS']
+        return response
+
+def pool_stats(app, db):
+    """Checked-in/out connection counts of the primary's and every replica's pool"""
+    engines = [('primary', db.engine)]
+    engines += [(f'replica{number}', engine) for number, engine in enumerate(app.extensions['replica_engines'])]
+    stats = {}
+    for name, engine in engines:
+        pool = engine.pool
+        entry = {'pool': type(pool).__name__, 'status': pool.status()}
+        for counter in ('size', 'checkedin', 'checkedout', 'overflow'):
+            if hasattr(pool, counter):
+                entry[counter] = getattr(pool, counter)()
+        stats[name] = entry
+    return stats
@@ -0,0 +1,25 @@
+import time
+
+class StartupTimer:
+    """Wall-clock time of each create_app() phase, in milliseconds"""
+    
+    def __init__(self):
+        self.started = self.last = time.perf_counter()
+        self.timings = {}
+    
+    def mark(self, phase):
+        """Close the phase that ran since the previous mark"""
+        now = time.perf_counter()
+        self.timings[phase] = round((now - self.last) * 1000, 2)
+        self.last = now
+    
+    def total(self):
+        return round((self.last - self.started) * 1000, 2)
+    
+    def report(self):
+        """One line per phase, slowest first, then the total"""
+        width = max(map(len, self.timings), default=5)
+        lines = [f'{phase:<{width}}  {ms:>9.2f} ms'
+                 for phase, ms in sorted(self.timings.items(), key=lambda item: -item[1])]
+        lines.append(f"{'total':<{width}}  {self.total():>9.2f} ms")
+        return '\n'.join(lines)
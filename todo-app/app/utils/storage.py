@@ -1,20 +1,939 @@
+import base64
+import json
+import re
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from flask import current_app, has_app_context
+from sqlalchemy import and_, delete, event, func, insert, literal, or_, select, text, tuple_, update
+from sqlalchemy.exc import IntegrityError
 from app import db
+from app.models.archived_task import ArchivedTask
+from app.models.job import Job
 from app.models.task import Task
+from app.models.task_stats import TaskStats
+from app.models.task_tombstone import TaskTombstone
+from app.models.user import User
+from app.utils.events import queue_task_event
+from app.utils.replicas import replica_read, replica_reads
 
+# Read-only task row for list views - plain column values, never in the session
+TaskView = namedtuple('TaskView', ['id', 'title', 'description', 'status', 'created_at', 'updated_at', 'change_seq'])
+
+# One page of tasks plus the cursors pointing at its neighbours
+TaskPage = namedtuple('TaskPage', ['tasks', 'next_cursor', 'prev_cursor'])
+
+# One page of ranked search results
+SearchPage = namedtuple('SearchPage', ['tasks', 'page', 'has_more'])
+
+# Inserts/updates and deletes since a sync cursor, plus the cursor to use next
+ChangeSet = namedtuple('ChangeSet', ['tasks', 'deleted', 'cursor', 'has_more'])
+
+# One page of a user's archived tasks, newest completion first
+ArchivePage = namedtuple('ArchivePage', ['tasks', 'next_cursor'])
+
+# Header counters for one user
+TaskCounts = namedtuple('TaskCounts', ['total_count', 'completed_count', 'pending_count'])
+
+# Unit of work
+#
+# Storage writes end in _commit(). Outside a unit of work that commits
+# straight away (scripts, jobs); inside one it only flushes, and the unit
+# commits once at its end. Every request runs in a unit (init_unit_of_work),
+# so a request costs at most one COMMIT however many rows it touches.
+
+def _in_unit_of_work():
+    return db.session().info.get('unit_of_work', False)
+
+def _commit():
+    """Finish a storage write - commit now, or flush if a unit of work will commit later"""
+    if _in_unit_of_work():
+        db.session.flush()
+    else:
+        db.session.commit()
+
+@contextmanager
+def unit_of_work():
+    """Stage every storage write in the block and commit them together
+
+    Rolls everything back if the block raises. Nested units join the
+    outermost one. Use it in scripts that make many separate storage calls.
+    """
+    if _in_unit_of_work():
+        yield
+        return
+    session = db.session()
+    session.info['unit_of_work'] = True
+    try:
+        yield
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.info.pop('unit_of_work', None)
+
+# Task stores
+#
+# With TASK_STORE other than 'sql' the app has a task store
+# (app/utils/task_store.py) and every function marked @_delegated hands its
+# call to the store's method of the same name. Functions marked
+# @_delegated_users do the same for stores that keep users as well (the
+# memory store). Jobs and the rest always stay in the SQL database.
+
+def _task_store():
+    return current_app.extensions.get('task_store') if has_app_context() else None
+
+def _user_store():
+    store = _task_store()
+    return store if store is not None and store.keeps_users else None
+
+def _delegated(fn):
+    """Send calls to the app's task store, if it has one"""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        store = _task_store()
+        if store is not None:
+            return getattr(store, fn.__name__)(*args, **kwargs)
+        return fn(*args, **kwargs)
+    return wrapper
+
+def _delegated_users(fn):
+    """Send calls to the app's task store, if it keeps users too"""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        store = _user_store()
+        if store is not None:
+            return getattr(store, fn.__name__)(*args, **kwargs)
+        return fn(*args, **kwargs)
+    return wrapper
+
+def init_unit_of_work(app):
+    """Run every request in a unit of work: commit after a successful response, else roll back"""
+    @app.before_request
+    def begin_unit_of_work():
+        db.session().info['unit_of_work'] = True
+    
+    @app.after_request
+    def commit_unit_of_work(response):
+        session = db.session()
+        if session.info.pop('unit_of_work', False):
+            if response.status_code < 400:
+                session.commit()
+            else:
+                session.rollback()
+        return response
+    
+    @app.teardown_request
+    def discard_unit_of_work(exc):
+        # Still set only if the view (or the commit above) raised
+        session = db.session()
+        if session.info.pop('unit_of_work', False):
+            session.rollback()
+
+def _sort_keys(sort_by):
+    """Columns the list is ordered by - the last one is always the unique id"""
+    if sort_by == 'title':
+        return [func.lower(Task.title), Task.id]
+    if sort_by == 'status':
+        return [Task.status, func.lower(Task.title), Task.id]
+    return [Task.created_at, Task.id]
+
+def encode_cursor(values):
+    """Turn the sort key of a row into an opaque URL-safe token"""
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(token, sort_by):
+    """Turn a cursor token back into sort key values - raises ValueError if invalid"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f'Invalid cursor: {token!r}') from e
+    # Every key is a string except the trailing id
+    if (not isinstance(values, list) or len(values) != len(_sort_keys(sort_by))
+            or not all(isinstance(v, str) for v in values[:-1]) or type(values[-1]) is not int):
+        raise ValueError(f'Invalid cursor: {token!r}')
+    if sort_by not in ('title', 'status'):
+        values[0] = datetime.fromisoformat(values[0])
+    return values
+
+def _view_columns():
+    return [getattr(Task, field) for field in TaskView._fields]
+
+@_delegated
+def get_task(user_id, task_id):
+    """The user's task with this id, or None"""
+    return Task.query.filter_by(id=task_id, user_id=user_id).first()
+
+@_delegated
 def load_tasks():
     """Load all tasks from database - simple function"""
     return Task.query.all()
 
+@_delegated
+@replica_read(db.session)
+def load_task_page(user_id, filter_status='all', sort_by='none', after=None, before=None, page_size=50):
+    """Load one page of a user's tasks - filtering, sorting and paging run in SQL
+
+    Uses keyset pagination: `after` / `before` are cursors from a previous
+    page, so the cost of a page does not depend on how deep into the list it is.
+    Tasks come back as TaskView tuples from a column-only query - load the
+    Task itself (db.session.get) to change one.
+    """
+    keys = _sort_keys(sort_by)
+    width = len(TaskView._fields)
+    query = db.session.query(*_view_columns(), *keys).filter(Task.user_id == user_id)
+    
+    if filter_status in ('pending', 'completed'):
+        query = query.filter(Task.status == filter_status)
+    
+    if before is not None:
+        # Walk backwards from the cursor, then flip the rows back into order
+        query = query.filter(tuple_(*keys) < tuple_(*decode_cursor(before, sort_by)))
+        query = query.order_by(*[key.desc() for key in keys])
+    else:
+        if after is not None:
+            query = query.filter(tuple_(*keys) > tuple_(*decode_cursor(after, sort_by)))
+        query = query.order_by(*keys)
+    
+    rows = query.limit(page_size + 1).all()
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if before is not None:
+        rows.reverse()
+    
+    if not rows:
+        return TaskPage([], None, None)
+    
+    first_cursor = encode_cursor(rows[0][width:])
+    last_cursor = encode_cursor(rows[-1][width:])
+    tasks = [TaskView._make(row[:width]) for row in rows]
+    if before is not None:
+        return TaskPage(tasks, last_cursor, first_cursor if has_more else None)
+    return TaskPage(tasks, last_cursor if has_more else None, first_cursor if after is not None else None)
+
+def _search_terms(query_text):
+    """Split user input into plain word terms - nothing reaches the query syntax raw"""
+    return re.findall(r'\w+', query_text.lower())[:16]
+
+def _ranked_task_ids(user_id, terms, limit, offset):
+    """Ids of the user's matching tasks, best match first, using the database's full-text index"""
+    conn = db.session.connection()
+    if conn.dialect.name == 'postgresql':
+        return db.session.execute(text(
+            "SELECT id FROM tasks, to_tsquery('english', :query) AS query "
+            "WHERE user_id = :user_id AND search_vector @@ query "
+            "ORDER BY ts_rank(search_vector, query) DESC, id DESC LIMIT :limit OFFSET :offset"
+        ), {'query': ' & '.join(f'{term}:*' for term in terms), 'user_id': user_id,
+            'limit': limit, 'offset': offset}).scalars().all()
+    
+    if conn.dialect.name == 'sqlite' and db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = 'tasks_fts'")).scalar():
+        # Title matches weigh ten times description matches; owner is a filter only
+        match = f'owner:u{int(user_id)} AND {{title description}}: (' + ' '.join(f'"{term}"*' for term in terms) + ')'
+        return db.session.execute(text(
+            "SELECT rowid FROM tasks_fts WHERE tasks_fts MATCH :match "
+            "ORDER BY bm25(tasks_fts, 10.0, 1.0, 0.0), rowid DESC LIMIT :limit OFFSET :offset"
+        ), {'match': match, 'limit': limit, 'offset': offset}).scalars().all()
+    
+    # No full-text index on this database - scan the user's tasks instead
+    conditions = [or_(func.lower(Task.title).contains(term, autoescape=True),
+                      func.lower(Task.description).contains(term, autoescape=True)) for term in terms]
+    return db.session.execute(
+        select(Task.id).where(Task.user_id == user_id, and_(*conditions))
+        .order_by(Task.id.desc()).limit(limit).offset(offset)
+    ).scalars().all()
+
+@_delegated
+@replica_read(db.session)
+def search_tasks(user_id, query_text, page=1, page_size=20):
+    """One page of the user's tasks matching `query_text` in title or description, ranked"""
+    terms = _search_terms(query_text)
+    if not terms:
+        return SearchPage([], page, False)
+    ids = _ranked_task_ids(user_id, terms, page_size + 1, (page - 1) * page_size)
+    has_more = len(ids) > page_size
+    ids = ids[:page_size]
+    tasks = {task.id: task for task in Task.query.filter(Task.id.in_(ids))} if ids else {}
+    return SearchPage([tasks[task_id] for task_id in ids if task_id in tasks], page, has_more)
+
+@_delegated
+def get_task_counts(user_id):
+    """Read the user's counters - a single primary-key lookup on task_stats"""
+    with replica_reads(db.session()):
+        row = db.session.query(TaskStats.total_count, TaskStats.completed_count).filter(
+            TaskStats.user_id == user_id).first()
+    if row is None:
+        # First visit since the counters existed - build them once
+        rebuild_task_counts(user_id)
+        _commit()
+        return get_task_counts(user_id)
+    total, completed = row
+    return TaskCounts(total, completed, total - completed)
+
+@_delegated
+def get_task_version(user_id):
+    """The user's data version - changes with every task write"""
+    with replica_reads(db.session()):
+        version = db.session.query(TaskStats.version).filter(TaskStats.user_id == user_id).scalar()
+    if version is None:
+        rebuild_task_counts(user_id)
+        _commit()
+        return get_task_version(user_id)
+    return version
+
+def _count_by_status(user_id=None):
+    """GROUP BY over the tasks table - {user_id: (total, completed)}"""
+    query = db.session.query(Task.user_id, Task.status, func.count(Task.id)).group_by(Task.user_id, Task.status)
+    if user_id is not None:
+        query = query.filter(Task.user_id == user_id)
+    counts = {}
+    for owner, status, count in query:
+        total, completed = counts.get(owner, (0, 0))
+        counts[owner] = (total + count, completed + (count if status == 'completed' else 0))
+    return counts
+
+def _write_task_counts(user_id, total, completed):
+    """Store absolute counter values, creating the row if needed"""
+    overwrite = (
+        update(TaskStats).where(TaskStats.user_id == user_id)
+        .values(total_count=total, completed_count=completed, version=TaskStats.version + 1)
+    )
+    if db.session.execute(overwrite).rowcount:
+        return
+    try:
+        with db.session.begin_nested():
+            # A plain INSERT - this also runs from the before_flush hook, where added objects would wait
+            db.session.execute(insert(TaskStats).values(user_id=user_id, total_count=total,
+                                                        completed_count=completed, version=1))
+    except IntegrityError:
+        # A concurrent request created the row first - overwrite it
+        db.session.execute(overwrite)
+
+@_delegated
+def rebuild_task_counts(user_id):
+    """Recompute one user's counters from the tasks table (does not commit)"""
+    total, completed = _count_by_status(user_id).get(user_id, (0, 0))
+    _write_task_counts(user_id, total, completed)
+
+@_delegated
+def rebuild_search_index(user_id):
+    """Rewrite one user's rows of the SQLite full-text table (does not commit)
+
+    Postgres derives its search column from the row itself, so only the
+    trigger-maintained FTS5 table can drift and need rebuilding.
+    """
+    if db.engine.dialect.name != 'sqlite' or not db.session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = 'tasks_fts'")).scalar():
+        return
+    owner = f'u{int(user_id)}'
+    db.session.execute(text("DELETE FROM tasks_fts WHERE owner = :owner"), {'owner': owner})
+    db.session.execute(text(
+        "INSERT INTO tasks_fts (rowid, title, description, owner) "
+        "SELECT id, title, description, :owner FROM tasks WHERE user_id = :user_id"
+    ), {'owner': owner, 'user_id': user_id})
+
+@_delegated
+def rebuild_all_task_counts():
+    """Recompute the counters of every user that has tasks, then commit"""
+    counts = _count_by_status()
+    for user_id, (total, completed) in counts.items():
+        _write_task_counts(user_id, total, completed)
+    # Users whose last task is gone no longer show up in the GROUP BY
+    db.session.execute(
+        update(TaskStats).where(TaskStats.user_id.notin_(list(counts) or [-1]))
+        .values(total_count=0, completed_count=0, version=TaskStats.version + 1)
+    )
+    _commit()
+    return len(counts)
+
+def _record_task_change(user_id, total=0, completed=0):
+    """Apply a counter delta, advance the user's data version and return
+    (version, total_count, completed_count) after the change
+
+    Call this BEFORE the task change reaches the database: the UPDATE locks
+    the user's stats row, so concurrent writers of one user are serialised
+    and the returned version doubles as a change sequence that grows in
+    commit order. If the row is missing it is rebuilt from the still
+    unchanged tasks table and the delta applied on top.
+    """
+    bump = (
+        update(TaskStats).where(TaskStats.user_id == user_id).values(
+            total_count=TaskStats.total_count + total,
+            completed_count=TaskStats.completed_count + completed,
+            version=TaskStats.version + 1,
+        )
+        .returning(TaskStats.version, TaskStats.total_count, TaskStats.completed_count)
+        .execution_options(synchronize_session=False)
+    )
+    with db.session.no_autoflush:
+        change = db.session.execute(bump).first()
+        if change is None:
+            rebuild_task_counts(user_id)
+            change = db.session.execute(bump).first()
+    return change
+
+def _stamp_added_tasks(session, flush_context, instances):
+    """Count and stamp Task objects added straight to the session
+
+    save_task() stamps its task before the flush; anything else that adds
+    Task rows through the ORM (scripts, fixtures) would otherwise reach the
+    table at change_seq 0, where delta sync never finds it.
+    """
+    added = {}
+    for obj in session.new:
+        if isinstance(obj, Task) and not obj.change_seq:
+            added.setdefault(obj.user_id, []).append(obj)
+    for user_id, tasks in added.items():
+        completed = sum(1 for task in tasks if task.status == 'completed')
+        change = _record_task_change(user_id, total=len(tasks), completed=completed)
+        for task in tasks:
+            task.change_seq = change.version
+
+def init_change_tracking(session):
+    """Stamp tasks added through the ORM as well as those written by this module"""
+    if not event.contains(session, 'before_flush', _stamp_added_tasks):
+        event.listen(session, 'before_flush', _stamp_added_tasks)
+
+def _task_payload(task):
+    """Plain-data copy of a task for change events"""
+    return {
+        'id': task.id, 'title': task.title, 'description': task.description, 'status': task.status,
+        'created_at': task.created_at.isoformat() if task.created_at else None,
+        'updated_at': task.updated_at.isoformat() if task.updated_at else None,
+        'change_seq': task.change_seq,
+    }
+
+def _queue_event(user_id, kind, change_seq, total_count, completed_count, **details):
+    """Publish a task event once the current transaction commits"""
+    queue_task_event(db.session, dict(
+        type=kind, user_id=user_id, change_seq=change_seq,
+        counts={'total_count': total_count, 'completed_count': completed_count,
+                'pending_count': total_count - completed_count},
+        **details
+    ))
+
+def _stamp(task, change_seq):
+    """Mark a task as written at `change_seq`"""
+    task.change_seq = change_seq
+    task.updated_at = datetime.utcnow()
+
+def _tombstone(user_id, change_seq, task_ids):
+    """Leave tombstones for tasks about to be deleted"""
+    db.session.execute(insert(TaskTombstone), [
+        {'task_id': task_id, 'user_id': user_id, 'change_seq': change_seq, 'deleted_at': datetime.utcnow()}
+        for task_id in task_ids
+    ])
+
+@_delegated
+def load_changes(user_id, since=0, limit=500):
+    """Tasks written and deleted after change sequence `since`, oldest first
+
+    Only rows up to the user's current version are returned, and a batch
+    is never cut inside one version, so feeding `cursor` back as `since`
+    never skips or splits a write. Cost grows with the number of changes,
+    not with the size of the list.
+    """
+    version = get_task_version(user_id)
+    task_seqs = db.session.execute(
+        select(Task.change_seq).where(Task.user_id == user_id, Task.change_seq > since,
+                                      Task.change_seq <= version)
+        .order_by(Task.change_seq).limit(limit + 1)
+    ).scalars().all()
+    tombstone_seqs = db.session.execute(
+        select(TaskTombstone.change_seq).where(TaskTombstone.user_id == user_id, TaskTombstone.change_seq > since,
+                                               TaskTombstone.change_seq <= version)
+        .order_by(TaskTombstone.change_seq).limit(limit + 1)
+    ).scalars().all()
+    seqs = sorted(task_seqs + tombstone_seqs)
+    
+    cursor, has_more = version, False
+    if len(seqs) > limit:
+        # Stop after the version that holds the limit-th change, unless that is the last one
+        cursor = seqs[limit - 1]
+        has_more = seqs[-1] > cursor
+        if not has_more:
+            cursor = version
+    
+    tasks = Task.query.filter(Task.user_id == user_id, Task.change_seq > since,
+                              Task.change_seq <= cursor).order_by(Task.change_seq, Task.id).all()
+    deleted = db.session.execute(
+        select(TaskTombstone.task_id, TaskTombstone.change_seq)
+        .where(TaskTombstone.user_id == user_id, TaskTombstone.change_seq > since,
+               TaskTombstone.change_seq <= cursor)
+        .order_by(TaskTombstone.change_seq, TaskTombstone.id)
+    ).all()
+    return ChangeSet(tasks, deleted, cursor, has_more)
+
+@_delegated
+def iter_tasks(user_id, filter_status='all', sort_by='none', chunk_size=500):
+    """Yield all of a user's tasks in list order as TaskView tuples, `chunk_size` rows at a time
+
+    Uses a server-side cursor where the driver supports one, so memory
+    stays bounded by the chunk size whatever the length of the list.
+    """
+    query = select(*_view_columns()).where(Task.user_id == user_id)
+    if filter_status in ('pending', 'completed'):
+        query = query.where(Task.status == filter_status)
+    query = query.order_by(*_sort_keys(sort_by)).execution_options(yield_per=chunk_size)
+    with replica_reads(db.session()):
+        result = db.session.execute(query)
+    try:
+        for row in result:
+            yield TaskView._make(row)
+    finally:
+        result.close()
+
+@_delegated
+def iter_task_rows(user_id, columns, chunk_size=1000):
+    """Yield plain tuples of the given task columns in id order, for exports
+
+    Column-only rows through a server-side cursor - nothing is added to the
+    session, so memory stays flat for any number of tasks.
+    """
+    query = (
+        select(*[getattr(Task, column) for column in columns])
+        .where(Task.user_id == user_id)
+        .order_by(Task.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    result = db.session.execute(query)
+    try:
+        for row in result:
+            yield tuple(row)
+    finally:
+        result.close()
+
+@_delegated
+def insert_task_rows(user_id, rows):
+    """Insert many tasks for one user with a single multi-row INSERT and commit
+
+    `rows` are dicts with title, description, status and optionally
+    created_at and updated_at (both default to now). The counters, change
+    sequence and events are handled once for the whole batch.
+    """
+    if not rows:
+        return 0
+    completed = sum(1 for row in rows if row['status'] == 'completed')
+    change = _record_task_change(user_id, total=len(rows), completed=completed)
+    now = datetime.utcnow()
+    db.session.execute(insert(Task.__table__).values([
+        dict(row, user_id=user_id, change_seq=change.version, created_at=row.get('created_at') or now,
+             updated_at=row.get('updated_at') or now) for row in rows
+    ]))
+    _queue_event(user_id, 'changed', *change)
+    _commit()
+    return len(rows)
+
+@_delegated
 def save_task(task):
-    """Save a single task to database - simple function"""
+    """Save a single task to database and count it"""
+    change = _record_task_change(task.user_id, total=1, completed=1 if task.status == 'completed' else 0)
+    # Added only once stamped, or a flush on the way would count it a second time
+    _stamp(task, change.version)
     db.session.add(task)
-    db.session.commit()
+    db.session.flush()  # assigns the id the event needs
+    _queue_event(task.user_id, 'created', *change, task=_task_payload(task))
+    _commit()
 
+@_delegated
 def delete_task(task):
-    """Delete a task from database - simple function"""
+    """Delete a task from database, uncount it and leave a tombstone"""
+    change = _record_task_change(task.user_id, total=-1, completed=-1 if task.status == 'completed' else 0)
+    _tombstone(task.user_id, change.version, [task.id])
+    _queue_event(task.user_id, 'deleted', *change, ids=[task.id])
     db.session.delete(task)
-    db.session.commit()
+    _commit()
+
+@_delegated
+def toggle_task_status(task):
+    """Flip a task between pending and completed and move it between counters"""
+    if task.status == 'pending':
+        task.mark_completed()
+        delta = 1
+    else:
+        task.mark_pending()
+        delta = -1
+    change = _record_task_change(task.user_id, completed=delta)
+    _stamp(task, change.version)
+    _queue_event(task.user_id, 'updated', *change, task=_task_payload(task))
+    _commit()
+
+@_delegated
+def delete_completed_tasks(user_id, chunk_size=5000, on_chunk=None):
+    """Delete all completed tasks of a user in one transaction, return how many
+
+    Rows are removed by id-bounded DELETE statements of at most `chunk_size`
+    rows, so no task is ever loaded into the session and each statement
+    stays short even for very large accounts. `on_chunk(deleted_so_far)` is
+    called after every chunk; if it raises, the whole delete is rolled back.
+    """
+    # Take the stats row lock first so the set of completed tasks cannot move under us
+    change = _record_task_change(user_id)
+    change_seq = change.version
+    completed = select(Task.id).where(Task.user_id == user_id, Task.status == 'completed')
+    db.session.execute(
+        insert(TaskTombstone).from_select(
+            ['task_id', 'user_id', 'change_seq', 'deleted_at'],
+            select(Task.id, Task.user_id, literal(change_seq), literal(datetime.utcnow()))
+            .where(Task.user_id == user_id, Task.status == 'completed')
+        )
+    )
+    deleted = 0
+    try:
+        while True:
+            result = db.session.execute(
+                delete(Task).where(Task.id.in_(completed.limit(chunk_size).scalar_subquery()))
+                .execution_options(synchronize_session=False)
+            )
+            deleted += result.rowcount
+            if on_chunk:
+                on_chunk(deleted)
+            if result.rowcount < chunk_size:
+                break
+    except Exception:
+        db.session.rollback()
+        raise
+    if deleted:
+        db.session.execute(
+            update(TaskStats).where(TaskStats.user_id == user_id).values(
+                total_count=TaskStats.total_count - deleted,
+                completed_count=TaskStats.completed_count - deleted,
+            )
+        )
+        # Too many ids for one event - clients pull them from /api/changes
+        _queue_event(user_id, 'changed', change_seq, change.total_count - deleted, change.completed_count - deleted)
+    _commit()
+    return deleted
+
+# When a task was completed, as far as the tasks table knows
+_completed_at = func.coalesce(Task.updated_at, Task.created_at)
+
+def _archivable(user_id, cutoff):
+    return and_(Task.user_id == user_id, Task.status == 'completed', _completed_at < cutoff)
+
+def _ensure_archive_partitions(months):
+    """Create the monthly partitions a batch needs when archived_tasks is partitioned (Postgres)"""
+    if db.engine.dialect.name != 'postgresql' or db.session.execute(
+            text("SELECT relkind FROM pg_class WHERE relname = 'archived_tasks'")).scalar() != 'p':
+        return
+    for month in sorted(months):
+        upper = datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+        db.session.execute(text(
+            f"CREATE TABLE IF NOT EXISTS archived_tasks_{month:%Y_%m} PARTITION OF archived_tasks "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{upper:%Y-%m-%d}')"
+        ))
+
+@_delegated
+def archive_completed_tasks(user_id, cutoff, batch_size=1000, on_batch=None):
+    """Move a user's tasks completed before `cutoff` into archived_tasks, return how many
+
+    Every batch is its own transaction (tombstones, counters and the move
+    together), so an interrupted sweep simply resumes with the rows still
+    left in tasks. `on_batch(archived_so_far)` is called after each batch.
+    """
+    archived = 0
+    while db.session.execute(select(Task.id).where(_archivable(user_id, cutoff)).limit(1)).first():
+        # Lock the user's stats row before picking the batch, as every writer does
+        change = _record_task_change(user_id)
+        rows = db.session.execute(
+            select(Task.id, Task.title, Task.description, Task.created_at, _completed_at.label('completed_at'))
+            .where(_archivable(user_id, cutoff)).order_by(Task.id).limit(batch_size)
+        ).all()
+        if not rows:
+            # Someone else moved them between the check and the lock
+            _commit()
+            break
+        ids = [row.id for row in rows]
+        now = datetime.utcnow()
+        _ensure_archive_partitions({datetime(row.completed_at.year, row.completed_at.month, 1) for row in rows})
+        db.session.execute(insert(ArchivedTask), [
+            dict(row._asdict(), user_id=user_id, archived_at=now) for row in rows
+        ])
+        _tombstone(user_id, change.version, ids)
+        db.session.execute(delete(Task).where(Task.id.in_(ids)).execution_options(synchronize_session=False))
+        db.session.execute(
+            update(TaskStats).where(TaskStats.user_id == user_id).values(
+                total_count=TaskStats.total_count - len(ids),
+                completed_count=TaskStats.completed_count - len(ids),
+            )
+        )
+        _queue_event(user_id, 'changed', change.version,
+                     change.total_count - len(ids), change.completed_count - len(ids))
+        _commit()
+        archived += len(ids)
+        if on_batch:
+            on_batch(archived)
+    return archived
+
+@_delegated
+def archive_all_completed_tasks(cutoff, batch_size=1000, on_batch=None):
+    """Run the archive sweep for every user with old completed tasks; returns (users, tasks)"""
+    user_ids = db.session.execute(
+        select(Task.user_id).where(Task.status == 'completed', _completed_at < cutoff).distinct()
+    ).scalars().all()
+    archived = 0
+    for user_id in user_ids:
+        done = archived
+        progress = (lambda count: on_batch(done + count)) if on_batch else None
+        archived += archive_completed_tasks(user_id, cutoff, batch_size, progress)
+    return len(user_ids), archived
+
+@_delegated
+def load_archived_page(user_id, after=None, page_size=50):
+    """One page of a user's archived tasks, most recently completed first"""
+    keys = [ArchivedTask.completed_at, ArchivedTask.id]
+    query = select(ArchivedTask).where(ArchivedTask.user_id == user_id)
+    if after is not None:
+        query = query.where(tuple_(*keys) < tuple_(*decode_cursor(after, 'none')))
+    tasks = db.session.execute(
+        query.order_by(*[key.desc() for key in keys]).limit(page_size + 1)
+    ).scalars().all()
+    if len(tasks) <= page_size:
+        return ArchivePage(tasks, None)
+    tasks = tasks[:page_size]
+    return ArchivePage(tasks, encode_cursor([tasks[-1].completed_at, tasks[-1].id]))
+
+def _check_batch_operation(op, tasks):
+    """Validate one batch operation against the owned tasks, return an error or None"""
+    kind = op.get('op')
+    if kind not in ('create', 'toggle', 'edit', 'delete'):
+        return 'Unknown operation'
+    if kind in ('create', 'edit') and not (isinstance(op.get('title'), str) and op['title'].strip()):
+        return 'Task title cannot be empty!'
+    # type() rather than isinstance - True must not stand in for task 1
+    if kind != 'create' and (type(op.get('id')) is not int or tasks.get(op['id']) is None):
+        return 'Task not found'
+    return None
+
+@_delegated
+def apply_task_batch(user_id, operations):
+    """Apply a list of create/toggle/edit/delete operations in one transaction
+
+    Ownership of every referenced task is checked with a single query, the
+    operations are replayed in order against those rows in memory, and the
+    net result is written with one INSERT, one UPDATE and one DELETE
+    statement. Returns one result dict per operation, in order; invalid
+    operations are reported and skipped without affecting the others.
+    """
+    ids = {op.get('id') for op in operations if type(op.get('id')) is int}
+    tasks = {}
+    if ids:
+        rows = db.session.execute(
+            select(Task.id, Task.status, Task.title, Task.description)
+            .where(Task.user_id == user_id, Task.id.in_(ids))
+        )
+        tasks = {row.id: dict(row._mapping) for row in rows}
+    initial_status = {task_id: task['status'] for task_id, task in tasks.items()}
+    
+    results, creates, changed = [], [], set()
+    for index, op in enumerate(operations):
+        error = _check_batch_operation(op, tasks)
+        if error:
+            results.append({'index': index, 'op': op.get('op'), 'ok': False, 'error': error})
+            continue
+        kind = op['op']
+        if kind == 'create':
+            creates.append((index, {
+                'title': op['title'].strip(), 'description': str(op.get('description') or '').strip(),
+                'status': 'pending', 'user_id': user_id, 'created_at': datetime.utcnow(),
+            }))
+            results.append(None)  # filled in once the INSERT returns ids
+            continue
+        task = tasks[op['id']]
+        if kind == 'toggle':
+            task['status'] = 'completed' if task['status'] == 'pending' else 'pending'
+            changed.add(op['id'])
+        elif kind == 'edit':
+            task['title'] = op['title'].strip()
+            task['description'] = str(op.get('description') or '').strip()
+            changed.add(op['id'])
+        else:
+            tasks[op['id']] = None
+        results.append({'index': index, 'op': kind, 'ok': True, 'id': op['id']})
+    
+    deleted = [task_id for task_id, task in tasks.items() if task is None]
+    updated = [tasks[task_id] for task_id in changed if tasks[task_id] is not None]
+    if not (creates or deleted or updated):
+        return results
+    
+    completed_before = sum(1 for status in initial_status.values() if status == 'completed')
+    completed_after = sum(1 for task in tasks.values() if task is not None and task['status'] == 'completed')
+    change = _record_task_change(user_id, total=len(creates) - len(deleted),
+                                 completed=completed_after - completed_before)
+    change_seq = change.version
+    _queue_event(user_id, 'changed', *change)
+    now = datetime.utcnow()
+    
+    if creates:
+        for _, row in creates:
+            row.update(change_seq=change_seq, updated_at=now)
+        new_ids = db.session.scalars(
+            insert(Task).returning(Task.id, sort_by_parameter_order=True),
+            [row for _, row in creates]
+        ).all()
+        for (index, _), task_id in zip(creates, new_ids):
+            results[index] = {'index': index, 'op': 'create', 'ok': True, 'id': task_id}
+    
+    if updated:
+        for task in updated:
+            task.update(change_seq=change_seq, updated_at=now)
+        db.session.execute(update(Task), updated)
+    if deleted:
+        _tombstone(user_id, change_seq, deleted)
+        db.session.execute(
+            delete(Task).where(Task.id.in_(deleted)).execution_options(synchronize_session=False)
+        )
+    _commit()
+    return results
+
+@_delegated
+def update_task(task):
+    """Commit edits to a task and advance its owner's data version"""
+    change = _record_task_change(task.user_id)
+    _stamp(task, change.version)
+    _queue_event(task.user_id, 'updated', *change, task=_task_payload(task))
+    _commit()
+
+class DuplicateUserError(ValueError):
+    """A new user collided with the unique username or email constraint"""
+    
+    def __init__(self, field):
+        super().__init__(f'{field} already taken')
+        self.field = field
+
+def _duplicate_user_field(error):
+    """Which unique column an IntegrityError on users violated ('username' or 'email')"""
+    diag = getattr(error.orig, 'diag', None)
+    message = getattr(diag, 'constraint_name', None) or str(error.orig)
+    return 'email' if 'email' in message else 'username'
+
+@_delegated_users
+def get_user(user_id):
+    """The user with this id, or None"""
+    return db.session.get(User, user_id)
+
+@_delegated_users
+def find_user(username):
+    """The user with this username, or None"""
+    return User.query.filter_by(username=username).first()
+
+@_delegated_users
+def create_user(user):
+    """Insert a new User in a single statement and commit
+
+    Uniqueness is left to the database constraints, which also settles
+    concurrent registrations; raises DuplicateUserError naming the column.
+    """
+    try:
+        # A savepoint, so a clash does not discard the rest of a unit of work
+        with db.session.begin_nested():
+            db.session.add(user)
+    except IntegrityError as e:
+        raise DuplicateUserError(_duplicate_user_field(e)) from e
+    _commit()
+    return user
+
+@_delegated_users
+def insert_user_rows(rows):
+    """Insert many users with one multi-row INSERT, skipping taken usernames/emails, and commit
+
+    `rows` are dicts with username, email and password_hash. Returns the
+    number of users created.
+    """
+    if not rows:
+        return 0
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        created = _insert_untaken_user_rows(rows)
+        _commit()
+        return created
+    now = datetime.utcnow()
+    created = db.session.execute(
+        dialect_insert(User.__table__).values([dict(row, created_at=now) for row in rows])
+        .on_conflict_do_nothing().returning(User.__table__.c.id)
+    ).all()
+    _commit()
+    return len(created)
+
+def _insert_untaken_user_rows(rows):
+    """insert_user_rows without ON CONFLICT: drop taken usernames/emails first, then one executemany"""
+    taken = db.session.execute(select(User.username, User.email).where(or_(
+        User.username.in_([row['username'] for row in rows]), User.email.in_([row['email'] for row in rows])
+    ))).all()
+    usernames = {user.username for user in taken}
+    emails = {user.email for user in taken}
+    now = datetime.utcnow()
+    fresh = []
+    for row in rows:
+        if row['username'] in usernames or row['email'] in emails:
+            continue
+        usernames.add(row['username'])
+        emails.add(row['email'])
+        fresh.append(dict(row, created_at=now))
+    if not fresh:
+        return 0
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(User.__table__), fresh)
+        return len(fresh)
+    except IntegrityError:
+        pass
+    # Someone registered one of them meanwhile - insert row by row and skip the clashes
+    created = 0
+    for row in fresh:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(User.__table__), [row])
+            created += 1
+        except IntegrityError:
+            pass
+    return created
+
+def delete_user_account(user_id, chunk_size=5000, on_chunk=None):
+    """Delete a user and everything they own, return how many tasks went with them
 
-def update_task():
-    """Commit changes to database - simple function"""
-    db.session.commit()
\ No newline at end of file
+    Tasks, archived tasks and tombstones are removed by id-bounded DELETE
+    statements of at most `chunk_size` rows, each committed on its own, so
+    no statement or transaction grows with the size of the account and no
+    row is loaded into the session. The user row goes last and ON DELETE
+    CASCADE takes the rest (counters, jobs, anything added meanwhile).
+    `on_chunk(tasks_deleted_so_far)` is called after every chunk of tasks.
+    """
+    store = _task_store()
+    deleted = store.delete_user_tasks(user_id) if store is not None else 0
+    if on_chunk and store is not None:
+        on_chunk(deleted)
+    for model in (Task, ArchivedTask, TaskTombstone):
+        owned = select(model.id).where(model.user_id == user_id)
+        while True:
+            count = db.session.execute(
+                delete(model).where(model.user_id == user_id, model.id.in_(owned.limit(chunk_size).scalar_subquery()))
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            _commit()
+            if model is Task:
+                deleted += count
+                if on_chunk:
+                    on_chunk(deleted)
+            if count < chunk_size:
+                break
+    if _user_store() is not None:
+        # No users row for ON DELETE CASCADE to follow - the jobs go by hand
+        db.session.execute(delete(Job).where(Job.user_id == user_id))
+        _commit()
+        _user_store().delete_user(user_id)
+        return deleted
+    user = db.session.get(User, user_id)
+    if user is not None:
+        db.session.delete(user)
+        _commit()
+    return deleted
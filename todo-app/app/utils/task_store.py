@@ -0,0 +1,511 @@
+import bisect
+import heapq
+import re
+import threading
+from collections import namedtuple
+from datetime import datetime
+from app.models.archived_task import ArchivedTask
+from app.models.task import Task
+from app.utils.events import publish_task_event
+from app.utils.storage import (ArchivePage, ChangeSet, SearchPage, TaskCounts, TaskPage, TaskView,
+                               _check_batch_operation, _search_terms, _task_payload, decode_cursor, encode_cursor)
+
+# Task stores other than the SQL database, selected by TASK_STORE.
+#
+# When the app has a store, storage.py hands it every task read and write
+# (same function names, same arguments, same return types); jobs and
+# everything else stay in SQL, and so do users except in the memory store.
+# TaskStore holds the list, search, sync and batch logic on top of a few
+# primitives each concrete store implements. A store write is durable when
+# the call returns, so its event is published straight away rather than
+# after a COMMIT.
+
+_WORD = re.compile(r'\w+')
+
+# What the indexes hold of a live task - enough to filter, order, count and
+# sync without loading it. `title` is lowercased, as the title sort compares it.
+TaskKey = namedtuple('TaskKey', ['status', 'created_at', 'title', 'change_seq'])
+
+# The sorted index lists kept per status: created_at order and title order
+_ORDERS = ('none', 'title')
+
+def _view(task):
+    """TaskView of a stored task dict"""
+    return TaskView(*[task[field] for field in TaskView._fields])
+
+def _task_key(task):
+    created_at = task['created_at']
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)  # a task dict read back from JSON
+    return TaskKey(task['status'], created_at, task['title'].lower(), task['change_seq'])
+
+def _order_values(key, task_id):
+    """The entries of one task in the 'none' and 'title' lists - storage._sort_keys without the status"""
+    return {'none': (key.created_at, task_id), 'title': (key.title, task_id)}
+
+def _window(values, prefix, cut, forward, limit):
+    """Up to `limit` sort keys of one sorted list on the far side of the cursor `cut`
+
+    Keys are `prefix` + entry; the status sort reads each status list with
+    the status as prefix, so a cursor can sit before, inside or after it.
+    """
+    if cut is None:
+        part = values[:limit] if forward else values[-limit:]
+        return [prefix + value for value in part]
+    head, rest = tuple(cut[:len(prefix)]), tuple(cut[len(prefix):])
+    if forward:
+        start = 0 if prefix > head else len(values) if prefix < head else bisect.bisect_right(values, rest)
+        part = values[start:start + limit]
+    else:
+        end = len(values) if prefix < head else 0 if prefix > head else bisect.bisect_left(values, rest)
+        part = values[max(0, end - limit):end]
+    return [prefix + value for value in part]
+
+def _completed_at(task):
+    return task['updated_at'] or task['created_at']
+
+
+class TaskStore:
+    """Task storage behind storage.py's task functions, for stores other than SQL
+
+    The base class keeps the indexes every store needs: per user, a TaskKey
+    per live task (so existence, status and change_seq are dict lookups) and,
+    per status, sorted lists in created_at and title order, so a page is a
+    bisect plus a slice. Counters and versions follow from them. Subclasses
+    keep the task data itself and call _index/_tombstone/_forget as they
+    write. Every task dict carries id, user_id, title, description, status,
+    created_at, updated_at and change_seq.
+    """
+
+    # True for stores that also take storage.py's user functions (@_delegated_users)
+    keeps_users = False
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._reset_indexes()
+
+    def _reset_indexes(self):
+        self.keys = {}         # user_id -> {task_id: TaskKey}
+        self.order = {}        # user_id -> {(status, 'none' | 'title'): sorted [(sort value, task_id)]}
+        self.tombstones = {}   # user_id -> [(task_id, change_seq)]
+        self.versions = {}     # user_id -> data version
+        self.next_id = 1
+
+    # Index maintenance, called by the subclasses
+
+    def _index(self, user_id, task):
+        """Add a live task dict to the indexes, replacing what they held for its id"""
+        self._unindex(user_id, task['id'])
+        key = _task_key(task)
+        self.keys.setdefault(user_id, {})[task['id']] = key
+        order = self.order.setdefault(user_id, {})
+        for sort, value in _order_values(key, task['id']).items():
+            bisect.insort(order.setdefault((key.status, sort), []), value)
+        self.next_id = max(self.next_id, task['id'] + 1)
+        self._bump(user_id, key.change_seq)
+
+    def _unindex(self, user_id, task_id):
+        key = self.keys.get(user_id, {}).pop(task_id, None)
+        if key is not None:
+            for sort, value in _order_values(key, task_id).items():
+                values = self.order[user_id][(key.status, sort)]
+                del values[bisect.bisect_left(values, value)]
+        return key
+
+    def _restore(self, user_id, keys):
+        """Load a user's {task_id: TaskKey} in one go (sorting once beats inserting one by one)"""
+        self.keys[user_id] = keys
+        order = self.order[user_id] = {}
+        for task_id, key in keys.items():
+            for sort, value in _order_values(key, task_id).items():
+                order.setdefault((key.status, sort), []).append(value)
+        for values in order.values():
+            values.sort()
+
+    def _tombstone(self, user_id, task_id, seq):
+        """Take a deleted or archived task out of the indexes, remembering the delete for sync"""
+        self._unindex(user_id, task_id)
+        self.tombstones.setdefault(user_id, []).append((task_id, seq))
+        self.next_id = max(self.next_id, task_id + 1)
+        self._bump(user_id, seq)
+
+    def _bump(self, user_id, seq):
+        self.versions[user_id] = max(self.versions.get(user_id, 0), seq)
+
+    def _forget(self, user_id):
+        for index in (self.keys, self.order, self.tombstones, self.versions):
+            index.pop(user_id, None)
+
+    # Lookups on the indexes
+
+    def _status(self, user_id, task_id):
+        """Status of a live task of the user, None if there is no such task"""
+        key = self.keys.get(user_id, {}).get(task_id)
+        return key.status if key is not None else None
+
+    def _ids(self, user_id, filter_status='all'):
+        """Ids of the user's live tasks, all of them or those with one status"""
+        statuses = (filter_status,) if filter_status in ('pending', 'completed') else ('completed', 'pending')
+        order = self.order.get(user_id, {})
+        return [task_id for status in statuses for _, task_id in order.get((status, 'none'), ())]
+
+    def _counts(self, user_id):
+        """(total, completed) of the user's live tasks"""
+        order = self.order.get(user_id, {})
+        completed = len(order.get(('completed', 'none'), ()))
+        return completed + len(order.get(('pending', 'none'), ())), completed
+
+    def _version(self, user_id):
+        """The user's data version - the change_seq of their latest write, 0 if none"""
+        return self.versions.get(user_id, 0)
+
+    def _new_id(self):
+        task_id = self.next_id
+        self.next_id += 1
+        return task_id
+
+    def _tombstones(self, user_id):
+        """[(task_id, change_seq)] of the user's deleted tasks, oldest first"""
+        return list(self.tombstones.get(user_id, ()))
+
+    def _user_ids(self):
+        """Users that have live tasks"""
+        return [user_id for user_id, keys in self.keys.items() if keys]
+
+    def _sources(self, user_id, filter_status, sort_by):
+        """The sorted lists a view of the tasks reads, each with the prefix of its sort keys"""
+        statuses = (filter_status,) if filter_status in ('pending', 'completed') else ('completed', 'pending')
+        sort = 'title' if sort_by in ('title', 'status') else 'none'
+        order = self.order.get(user_id, {})
+        return [(order.get((status, sort), []), (status,) if sort_by == 'status' else ()) for status in statuses]
+
+    # Primitives each store implements
+
+    def _load(self, user_id, task_ids):
+        """Task dicts of the given live tasks of a user, in the order asked for"""
+        raise NotImplementedError
+
+    def _write(self, user_id, seq, puts, deletes, archives, now):
+        """Store one change of a user: upserted task dicts, deleted ids
+        (tombstoned at `seq`) and archived task dicts - all or nothing"""
+        raise NotImplementedError
+
+    def _archived(self, user_id):
+        """Archived task dicts of a user"""
+        raise NotImplementedError
+
+    def _purge(self, user_id):
+        """Forget everything stored for a user"""
+        raise NotImplementedError
+
+    # Writes
+
+    def _change(self, user_id, puts=(), deletes=(), archives=(), touch=True):
+        """Write one change at the user's next version; returns that version
+
+        Upserted tasks get updated_at = now unless `touch` is off.
+        """
+        seq = self._version(user_id) + 1
+        now = datetime.utcnow()
+        for task in puts:
+            task.update(user_id=user_id, change_seq=seq)
+            if touch:
+                task['updated_at'] = now
+        self._write(user_id, seq, list(puts), list(deletes), list(archives), now)
+        return seq
+
+    def _publish(self, user_id, kind, seq, **details):
+        total, completed = self._counts(user_id)
+        publish_task_event(dict(
+            type=kind, user_id=user_id, change_seq=seq,
+            counts={'total_count': total, 'completed_count': completed, 'pending_count': total - completed},
+            **details
+        ))
+
+    def _record(self, task):
+        """Task dict of a Task instance, with defaults the database would fill in"""
+        return {
+            'id': task.id, 'user_id': task.user_id, 'title': task.title, 'description': task.description or '',
+            'status': task.status or 'pending', 'created_at': task.created_at or datetime.utcnow(),
+            'updated_at': task.updated_at, 'change_seq': task.change_seq or 0,
+        }
+
+    def _put(self, task, kind):
+        """Write a created or edited Task instance and copy the stored values back onto it"""
+        record = self._record(task)
+        seq = self._change(task.user_id, puts=[record])
+        for field, value in record.items():
+            setattr(task, field, value)
+        self._publish(task.user_id, kind, seq, task=_task_payload(task))
+
+    def save_task(self, task):
+        with self.lock:
+            task.id = self._new_id()
+            self._put(task, 'created')
+
+    def update_task(self, task):
+        with self.lock:
+            if self._status(task.user_id, task.id) is not None:
+                self._put(task, 'updated')
+
+    def toggle_task_status(self, task):
+        with self.lock:
+            if self._status(task.user_id, task.id) is None:
+                return
+            if task.status == 'pending':
+                task.mark_completed()
+            else:
+                task.mark_pending()
+            self._put(task, 'updated')
+
+    def delete_task(self, task):
+        with self.lock:
+            if self._status(task.user_id, task.id) is not None:
+                seq = self._change(task.user_id, deletes=[task.id])
+                self._publish(task.user_id, 'deleted', seq, ids=[task.id])
+
+    def delete_completed_tasks(self, user_id, chunk_size=5000, on_chunk=None):
+        with self.lock:
+            ids = self._ids(user_id, 'completed')
+            if ids:
+                self._publish(user_id, 'changed', self._change(user_id, deletes=ids))
+        if on_chunk:
+            on_chunk(len(ids))
+        return len(ids)
+
+    def insert_task_rows(self, user_id, rows):
+        if not rows:
+            return 0
+        with self.lock:
+            now = datetime.utcnow()
+            puts = [{'id': self._new_id(), 'title': row['title'], 'description': row.get('description') or '',
+                     'status': row['status'], 'created_at': row.get('created_at') or now,
+                     'updated_at': row.get('updated_at') or now}
+                    for row in rows]
+            self._publish(user_id, 'changed', self._change(user_id, puts=puts, touch=False))
+        return len(rows)
+
+    def apply_task_batch(self, user_id, operations):
+        """storage.apply_task_batch - the whole batch becomes one change"""
+        with self.lock:
+            ids = [op['id'] for op in operations
+                   if type(op.get('id')) is int and self._status(user_id, op['id']) is not None]
+            tasks = {task['id']: task for task in self._load(user_id, ids)}
+            results, creates, changed, deleted = [], [], set(), []
+            for index, op in enumerate(operations):
+                error = _check_batch_operation(op, tasks)
+                if error:
+                    results.append({'index': index, 'op': op.get('op'), 'ok': False, 'error': error})
+                    continue
+                kind = op['op']
+                if kind == 'create':
+                    task = {'id': self._new_id(), 'title': op['title'].strip(),
+                            'description': str(op.get('description') or '').strip(),
+                            'status': 'pending', 'created_at': datetime.utcnow()}
+                    creates.append(task)
+                    results.append({'index': index, 'op': 'create', 'ok': True, 'id': task['id']})
+                    continue
+                task = tasks[op['id']]
+                if kind == 'toggle':
+                    task['status'] = 'completed' if task['status'] == 'pending' else 'pending'
+                    changed.add(op['id'])
+                elif kind == 'edit':
+                    task['title'] = op['title'].strip()
+                    task['description'] = str(op.get('description') or '').strip()
+                    changed.add(op['id'])
+                else:
+                    tasks[op['id']] = None
+                    deleted.append(op['id'])
+                results.append({'index': index, 'op': kind, 'ok': True, 'id': op['id']})
+
+            updated = [tasks[task_id] for task_id in changed if tasks[task_id] is not None]
+            if creates or deleted or updated:
+                self._publish(user_id, 'changed', self._change(user_id, puts=creates + updated, deletes=deleted))
+        return results
+
+    def archive_completed_tasks(self, user_id, cutoff, batch_size=1000, on_batch=None):
+        """storage.archive_completed_tasks - every batch is its own change"""
+        archived = 0
+        while True:
+            with self.lock:
+                completed = self._ids(user_id, 'completed')
+                batch = sorted((task for task in self._load(user_id, completed) if _completed_at(task) < cutoff),
+                               key=lambda task: task['id'])[:batch_size]
+                if not batch:
+                    return archived
+                now = datetime.utcnow()
+                copies = [{'id': task['id'], 'user_id': user_id, 'title': task['title'],
+                           'description': task['description'], 'created_at': task['created_at'],
+                           'completed_at': _completed_at(task), 'archived_at': now} for task in batch]
+                seq = self._change(user_id, deletes=[task['id'] for task in batch], archives=copies)
+                self._publish(user_id, 'changed', seq)
+            archived += len(batch)
+            if on_batch:
+                on_batch(archived)
+
+    def archive_all_completed_tasks(self, cutoff, batch_size=1000, on_batch=None):
+        users = archived = 0
+        for user_id in self._user_ids():
+            done = archived
+            progress = (lambda count: on_batch(done + count)) if on_batch else None
+            count = self.archive_completed_tasks(user_id, cutoff, batch_size, progress)
+            users += 1 if count else 0
+            archived += count
+        return users, archived
+
+    def delete_user_tasks(self, user_id):
+        """Drop all of a user's task data (storage.delete_user_account); returns the tasks deleted"""
+        with self.lock:
+            count = self._counts(user_id)[0]
+            self._purge(user_id)
+        return count
+
+    # Counters, versions and the housekeeping storage.py offers for SQL
+
+    def get_task_counts(self, user_id):
+        with self.lock:
+            total, completed = self._counts(user_id)
+        return TaskCounts(total, completed, total - completed)
+
+    def get_task_version(self, user_id):
+        with self.lock:
+            return self._version(user_id)
+
+    def rebuild_task_counts(self, user_id):
+        """Counters are kept by the store itself - nothing to rebuild"""
+
+    def rebuild_search_index(self, user_id):
+        """Search scans the user's tasks - there is no index to rebuild"""
+
+    def rebuild_all_task_counts(self):
+        with self.lock:
+            return len(self._user_ids())
+
+    # Reads
+
+    def _tasks(self, user_id, filter_status='all'):
+        return self._load(user_id, self._ids(user_id, filter_status))
+
+    def _load_views(self, user_id, task_ids):
+        """TaskViews of the given tasks, in the given order (tasks gone meanwhile are skipped)"""
+        return [_view(task) for task in self._load(user_id, task_ids)]
+
+    def get_task(self, user_id, task_id):
+        with self.lock:
+            if self._status(user_id, task_id) is None:
+                return None
+            return Task(**self._load(user_id, [task_id])[0])
+
+    def load_tasks(self):
+        with self.lock:
+            return [Task(**task) for user_id in self._user_ids() for task in self._tasks(user_id)]
+
+    def load_task_page(self, user_id, filter_status='all', sort_by='none', after=None, before=None, page_size=50):
+        """storage.load_task_page - same ordering and cursors, read off the sorted indexes"""
+        forward = before is None
+        cursor = after if forward else before
+        cut = tuple(decode_cursor(cursor, sort_by)) if cursor is not None else None
+        with self.lock:
+            rows = []
+            for values, prefix in self._sources(user_id, filter_status, sort_by):
+                rows += _window(values, prefix, cut, forward, page_size + 1)
+            rows.sort()
+            has_more = len(rows) > page_size
+            rows = rows[:page_size] if forward else rows[-page_size:]
+            tasks = self._load_views(user_id, [row[-1] for row in rows])
+
+        if not rows:
+            return TaskPage([], None, None)
+        first_cursor, last_cursor = encode_cursor(rows[0]), encode_cursor(rows[-1])
+        if not forward:
+            return TaskPage(tasks, last_cursor, first_cursor if has_more else None)
+        return TaskPage(tasks, last_cursor if has_more else None, first_cursor if after is not None else None)
+
+    def iter_tasks(self, user_id, filter_status='all', sort_by='none', chunk_size=500):
+        with self.lock:
+            ids = [row[-1] for row in heapq.merge(*[
+                [prefix + value for value in values] if prefix else list(values)
+                for values, prefix in self._sources(user_id, filter_status, sort_by)
+            ])]
+        for start in range(0, len(ids), chunk_size):
+            with self.lock:
+                views = self._load_views(user_id, ids[start:start + chunk_size])
+            yield from views
+
+    def iter_task_rows(self, user_id, columns, chunk_size=1000):
+        with self.lock:
+            ids = sorted(self.keys.get(user_id, ()))
+        for start in range(0, len(ids), chunk_size):
+            with self.lock:
+                tasks = self._load(user_id, ids[start:start + chunk_size])
+            for task in tasks:
+                yield tuple(task[column] for column in columns)
+
+    def search_tasks(self, user_id, query_text, page=1, page_size=20):
+        """Every term must prefix a word of the title or description; title hits weigh ten times more"""
+        terms = _search_terms(query_text)
+        if not terms:
+            return SearchPage([], page, False)
+        with self.lock:
+            tasks = self._tasks(user_id)
+        ranked = []
+        for task in tasks:
+            title = _WORD.findall(task['title'].lower())
+            description = _WORD.findall((task['description'] or '').lower())
+            if not all(any(word.startswith(term) for word in title + description) for term in terms):
+                continue
+            score = sum(10 * sum(word.startswith(term) for word in title)
+                        + sum(word.startswith(term) for word in description) for term in terms)
+            ranked.append((-score, -task['id'], task))
+        ranked.sort(key=lambda row: row[:2])
+        start = (page - 1) * page_size
+        hits = ranked[start:start + page_size + 1]
+        return SearchPage([_view(task) for _, _, task in hits[:page_size]], page, len(hits) > page_size)
+
+    def load_changes(self, user_id, since=0, limit=500):
+        """storage.load_changes - a batch never ends inside one version"""
+        with self.lock:
+            version = self._version(user_id)
+            written = [(key.change_seq, task_id) for task_id, key in self.keys.get(user_id, {}).items()
+                       if since < key.change_seq <= version]
+            tombstones = [(task_id, seq) for task_id, seq in self._tombstones(user_id) if since < seq <= version]
+        seqs = sorted([seq for seq, _ in written] + [seq for _, seq in tombstones])
+
+        cursor, has_more = version, False
+        if len(seqs) > limit:
+            cursor = seqs[limit - 1]
+            has_more = seqs[-1] > cursor
+            if not has_more:
+                cursor = version
+
+        with self.lock:
+            tasks = self._load_views(user_id, [task_id for seq, task_id in sorted(written) if seq <= cursor])
+        deleted = sorted(((task_id, seq) for task_id, seq in tombstones if seq <= cursor), key=lambda row: row[1])
+        return ChangeSet(tasks, deleted, cursor, has_more)
+
+    def load_archived_page(self, user_id, after=None, page_size=50):
+        with self.lock:
+            tasks = sorted(self._archived(user_id), key=lambda task: (task['completed_at'], task['id']), reverse=True)
+        if after is not None:
+            cut = tuple(decode_cursor(after, 'none'))
+            tasks = [task for task in tasks if (task['completed_at'], task['id']) < cut]
+        page = [ArchivedTask(**task) for task in tasks[:page_size]]
+        if len(tasks) <= page_size:
+            return ArchivePage(page, None)
+        return ArchivePage(page, encode_cursor([page[-1].completed_at, page[-1].id]))
+
+
+def create_task_store(config):
+    """Build the task store selected by TASK_STORE (None keeps tasks in the SQL database)"""
+    backend = config.get('TASK_STORE', 'sql')
+    if backend == 'sql':
+        return None
+    if backend == 'memory':
+        from app.utils.memory_store import MemoryTaskStore
+        return MemoryTaskStore()
+    if backend == 'log':
+        from app.utils.log_store import LogTaskStore
+        return LogTaskStore(config['TASK_LOG_PATH'], fsync=config['TASK_LOG_FSYNC'],
+                            compact_min_bytes=config['TASK_LOG_COMPACT_MIN_BYTES'],
+                            checkpoint_every=config['TASK_LOG_CHECKPOINT_EVERY'])
+    raise ValueError(f'Unknown TASK_STORE: {backend!r}')
@@ -0,0 +1,181 @@
+import csv
+import io
+import json
+import re
+from datetime import datetime
+from app.utils.storage import insert_task_rows, iter_task_rows
+
+# Streaming import/export of a user's tasks as NDJSON or CSV, plus the
+# legacy JSON array format of data/tasks.json. Exports read through a
+# server-side cursor and imports insert in batches, so memory use does not
+# depend on how many tasks there are.
+
+EXPORT_COLUMNS = ('id', 'title', 'description', 'status', 'created_at', 'updated_at')
+
+FORMATS = ('ndjson', 'csv', 'legacy')
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+def _export_record(row):
+    """Row tuple -> JSON-ready dict"""
+    return {column: value.isoformat() if isinstance(value, datetime) else value
+            for column, value in zip(EXPORT_COLUMNS, row)}
+
+def export_ndjson(user_id, chunk_size=1000, progress=None):
+    """Yield the user's tasks as newline-delimited JSON, one line per task
+
+    `progress(exported)` is called every `chunk_size` rows and at the end.
+    """
+    count = 0
+    for count, row in enumerate(iter_task_rows(user_id, EXPORT_COLUMNS, chunk_size), 1):
+        yield json.dumps(_export_record(row), ensure_ascii=False) + '\n'
+        if progress and count % chunk_size == 0:
+            progress(count)
+    if progress:
+        progress(count)
+
+def export_csv(user_id, chunk_size=1000, progress=None):
+    """Yield the user's tasks as CSV text, header first, in chunks of `chunk_size` rows
+
+    `progress(exported)` is called after every chunk.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    count = 0
+    for count, row in enumerate(iter_task_rows(user_id, EXPORT_COLUMNS, chunk_size), 1):
+        writer.writerow(_export_record(row).values())
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            if progress:
+                progress(count)
+    yield buffer.getvalue()
+    if progress:
+        progress(count)
+
+def iter_ndjson(stream):
+    """Parse NDJSON text lines one at a time"""
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+def iter_csv(stream):
+    """Parse CSV with a header row one record at a time"""
+    yield from csv.DictReader(stream)
+
+def iter_json_array(stream, read_size=65536):
+    """Parse the objects of a top-level JSON array incrementally
+
+    The legacy data/tasks.json is one big array; decoding it element by
+    element keeps memory bounded by the largest single task. A position
+    moves through the buffer, which is only trimmed when the next chunk is
+    appended, so parsing stays linear in the size of the file.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos = '', 0
+    started = eof = False
+    while True:
+        pos = _WHITESPACE.match(buffer, pos).end()
+        if pos < len(buffer):
+            char = buffer[pos]
+            if not started:
+                if char != '[':
+                    raise ValueError('Expected a JSON array')
+                started = True
+                pos += 1
+                continue
+            if char == ',':
+                pos += 1
+                continue
+            if char == ']':
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                end = None
+            # A record that reaches the end of the buffer may go on in the next chunk (e.g. a number)
+            if end is not None and (end < len(buffer) or eof):
+                yield record
+                pos = end
+                continue
+        if eof:
+            raise ValueError('Truncated JSON array' if started else 'Expected a JSON array')
+        chunk = stream.read(read_size)
+        eof = not chunk
+        buffer, pos = buffer[pos:] + chunk, 0
+
+def _parse_timestamp(value, legacy_id=None):
+    """ISO timestamp -> datetime; legacy ids are microseconds since the epoch"""
+    if value:
+        try:
+            return datetime.fromisoformat(str(value))
+        except ValueError:
+            pass
+    if legacy_id:
+        return datetime.utcfromtimestamp(int(legacy_id) / 1_000_000)
+    return datetime.utcnow()
+
+def normalize_record(record, legacy=False):
+    """Imported record -> insertable task row, or None if it is not an object or has no title
+
+    Ids are never kept: they belong to the source instance, and legacy ids
+    (microsecond timestamps) do not even fit the integer column.
+    """
+    if not isinstance(record, dict):
+        return None  # e.g. a bare 1 or "x" line - skipped and counted, not fatal to the import
+    title = str(record.get('title') or '').strip()[:200]
+    if not title:
+        return None
+    status = record.get('status')
+    return {
+        'title': title,
+        'description': str(record.get('description') or ''),
+        'status': status if status in ('pending', 'completed') else 'pending',
+        'created_at': _parse_timestamp(record.get('created_at'), record.get('id') if legacy else None),
+    }
+
+def parse_records(stream, file_format):
+    """Iterate the raw records of a text stream in one of FORMATS"""
+    if file_format == 'ndjson':
+        return iter_ndjson(stream)
+    if file_format == 'csv':
+        return iter_csv(stream)
+    if file_format == 'legacy':
+        return iter_json_array(stream)
+    raise ValueError(f'Unknown import format: {file_format!r}')
+
+def guess_format(filename):
+    """Pick an import format from a file name"""
+    if filename.endswith('.csv'):
+        return 'csv'
+    if filename.endswith('.json'):
+        return 'legacy'
+    return 'ndjson'
+
+def import_tasks(user_id, stream, file_format, batch_size=1000, progress=None):
+    """Import tasks from a text stream for one user; returns (imported, skipped)
+
+    Records are parsed incrementally and inserted `batch_size` at a time,
+    each batch in its own short transaction. `progress(imported)` is called
+    after every batch.
+    """
+    imported = skipped = 0
+    batch = []
+    for record in parse_records(stream, file_format):
+        row = normalize_record(record, legacy=file_format == 'legacy')
+        if row is None:
+            skipped += 1
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            imported += insert_task_rows(user_id, batch)
+            batch = []
+            if progress:
+                progress(imported)
+    imported += insert_task_rows(user_id, batch)
+    if progress:
+        progress(imported)
+    return imported, skipped
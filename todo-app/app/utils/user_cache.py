@@ -0,0 +1,141 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, has_app_context, request
+from flask_login import UserMixin, current_user, logout_user
+from sqlalchemy import event
+from app.models.user import User
+from app.utils.storage import get_user
+
+# The login manager's user loader runs on every authenticated request. Only
+# a handful of User fields are ever read from current_user, so each worker
+# keeps a detached snapshot of them for a short TTL instead of querying.
+# Updates and deletes through the ORM drop the snapshot in this process;
+# other workers notice within the TTL. Until then a deleted user could still
+# write as their snapshot, so requests that write check the row still exists.
+
+class CachedUser(UserMixin):
+    """Read-only snapshot of the User fields current_user needs"""
+    
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.email = user.email
+        self.created_at = user.created_at
+    
+    def __repr__(self):
+        return f'<CachedUser {self.username}>'
+
+
+class UserCache:
+    """LRU of user snapshots with a time-to-live, for one worker process"""
+    
+    def __init__(self, max_entries=10000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # Bumped on every invalidation so a load racing with an update is not cached
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    def get(self, user_id):
+        """Return the cached snapshot or None"""
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and entry[1] < time.monotonic():
+                del self.entries[user_id]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+    
+    def set(self, user_id, snapshot, generation):
+        """Store a snapshot read while `generation` was current; stale ones are dropped"""
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries[user_id] = (snapshot, time.monotonic() + self.ttl)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+    
+    def invalidate(self, user_id):
+        with self.lock:
+            self.generation += 1
+            self.invalidations += 1
+            self.entries.pop(user_id, None)
+    
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+    
+    def stats(self):
+        """Hit/miss counters for this process"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self.entries), 'max_entries': self.max_entries, 'ttl': self.ttl,
+                    'hits': self.hits, 'misses': self.misses, 'expired': self.expired,
+                    'evictions': self.evictions, 'invalidations': self.invalidations,
+                    'hit_rate': round(self.hits / lookups, 4) if lookups else None}
+
+
+def create_user_cache(config):
+    """Build the user cache, or None when USER_CACHE_TTL is 0"""
+    if not config['USER_CACHE_TTL']:
+        return None
+    return UserCache(config['USER_CACHE_MAX_ENTRIES'], config['USER_CACHE_TTL'])
+
+def load_cached_user(user_id):
+    """current_user for `user_id`: a cached snapshot, or the row when caching is off"""
+    cache = current_app.extensions.get('user_cache')
+    if cache is None:
+        return get_user(user_id)
+    snapshot = cache.get(user_id)
+    if snapshot is None:
+        generation = cache.generation
+        user = get_user(user_id)
+        if user is None:
+            return None
+        snapshot = CachedUser(user)
+        cache.set(user_id, snapshot, generation)
+    return snapshot
+
+def forget_cached_user(user_id):
+    """Drop this process's snapshot of a user that changed or went away"""
+    if has_app_context():
+        cache = current_app.extensions.get('user_cache')
+        if cache is not None:
+            cache.invalidate(user_id)
+
+def _invalidate(mapper, connection, target):
+    forget_cached_user(target.id)
+
+def _log_out_deleted_writer():
+    """Log out a snapshot whose user another process deleted, before it writes tasks for nobody"""
+    if request.method in ('GET', 'HEAD', 'OPTIONS') or not current_user.is_authenticated:
+        return None
+    if get_user(current_user.id) is None:
+        forget_cached_user(current_user.id)
+        logout_user()
+        return current_app.login_manager.unauthorized()
+    return None
+
+def init_user_cache(app):
+    """Create the app's user cache and drop entries whenever a User row changes"""
+    app.extensions['user_cache'] = create_user_cache(app.config)
+    if app.extensions['user_cache'] is not None:
+        app.before_request(_log_out_deleted_writer)
+    for name in ('after_update', 'after_delete'):
+        if not event.contains(User, name, _invalidate):
+            event.listen(User, name, _invalidate)
@@ -0,0 +1,103 @@
+"""Compare per-row CPU time and memory of full Task entities against TaskView rows.
+
+Usage:
+    python benchmark_list_views.py [rows] [database_url]
+
+Defaults to 20000 tasks in a throwaway SQLite file. Pass a PostgreSQL URL
+to benchmark a scratch Postgres database instead - its tables are dropped.
+"""
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from sqlalchemy import select
+
+RUNS = 5
+
+def print_header(title: str):
+    """Print a formatted header"""
+    print("\n" + "="*70)
+    print(f"  {title}")
+    print("="*70)
+
+def seed(db, Task, User, rows: int):
+    """Create one user with `rows` tasks of list-view sized text"""
+    start = datetime(2024, 1, 1)
+    user = User(username='bench', email='bench@example.com', password_hash='x')
+    db.session.add(user)
+    db.session.flush()
+    db.session.execute(Task.__table__.insert(), [
+        {'title': f'Task {i}', 'description': f'Short description of task {i}', 'user_id': user.id,
+         'status': 'completed' if i % 3 == 0 else 'pending', 'created_at': start + timedelta(seconds=i)}
+        for i in range(rows)
+    ])
+    db.session.commit()
+    return user.id
+
+def measure(db, load):
+    """Best CPU time and the memory held by the loaded rows, over RUNS fresh sessions"""
+    best = None
+    for _ in range(RUNS):
+        db.session.remove()
+        gc.collect()
+        started = time.process_time()
+        rows = load()
+        elapsed = time.process_time() - started
+        best = elapsed if best is None else min(best, elapsed)
+        del rows
+
+    db.session.remove()
+    gc.collect()
+    tracemalloc.start()
+    rows = load()
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return best, held, len(rows)
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    if len(sys.argv) > 2:
+        os.environ['DATABASE_URL'] = sys.argv[2]
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+
+    from app import create_app, db
+    from app.models.task import Task
+    from app.models.user import User
+    from app.utils.storage import load_task_page
+
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        print(f"Seeding {rows} tasks on {db.engine.dialect.name}...")
+        user_id = seed(db, Task, User, rows)
+
+        # What the list view used to do: identity-mapped, change-tracked entities
+        def entities():
+            return db.session.execute(
+                select(Task).where(Task.user_id == user_id).order_by(Task.created_at, Task.id).limit(rows)
+            ).scalars().all()
+
+        def views():
+            return load_task_page(user_id, page_size=rows).tasks
+
+        print_header(f"Loading {rows} rows of the task list (best of {RUNS} runs)")
+        results = {}
+        for label, load in (('Task entities', entities), ('TaskView rows', views)):
+            cpu, held, count = measure(db, load)
+            results[label] = (cpu, held)
+            print(f"\n{label}: {count} rows")
+            print(f"  CPU    {cpu * 1000:8.1f}ms total  {cpu * 1e6 / count:7.2f}us per row")
+            print(f"  Memory {held / 1024:8.0f}KB total  {held / count:7.0f}B per row")
+
+        (entity_cpu, entity_held), (view_cpu, view_held) = results.values()
+        print(f"\nTaskView rows take {view_cpu / entity_cpu:.0%} of the CPU time "
+              f"and {view_held / entity_held:.0%} of the memory of Task entities.")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""Show query plans and timings of the task list queries before and after the indexes.
+
+Usage:
+    python benchmark_query_plans.py [tasks_per_user] [database_url]
+
+Defaults to 50000 tasks in a throwaway SQLite file. Pass a PostgreSQL URL
+to benchmark a scratch Postgres database instead - its tables are dropped.
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import event, text
+
+USERS = 5
+RUNS = 20
+
+def print_header(title: str):
+    """Print a formatted header"""
+    print("\n" + "="*70)
+    print(f"  {title}")
+    print("="*70)
+
+def seed(db, Task, User, tasks_per_user: int):
+    """Create a few users with many tasks each"""
+    start = datetime(2024, 1, 1)
+    for u in range(USERS):
+        user = User(username=f'bench{u}', email=f'bench{u}@example.com', password_hash='x')
+        db.session.add(user)
+        db.session.flush()
+        rows = [
+            {'title': f'Task {i} for {u}', 'description': '', 'user_id': user.id,
+             'status': 'completed' if i % 3 == 0 else 'pending',
+             'created_at': start + timedelta(seconds=i)}
+            for i in range(tasks_per_user)
+        ]
+        db.session.execute(Task.__table__.insert(), rows)
+    db.session.commit()
+
+def capture_list_queries(db, user_id: int):
+    """Run the index queries once and return the SQL statements they issue"""
+    from app.utils.storage import load_task_page, get_task_counts
+    statements = []
+    
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+    
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        for filter_status in ('all', 'pending'):
+            for sort_by in ('none', 'title'):
+                first = load_task_page(user_id, filter_status, sort_by)
+                load_task_page(user_id, filter_status, sort_by, after=first.next_cursor)
+        get_task_counts(user_id)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return statements
+
+def explain(conn, statement: str, parameters):
+    """Return the database's plan for one statement as text"""
+    if conn.dialect.name == 'postgresql':
+        rows = conn.exec_driver_sql('EXPLAIN ' + statement, parameters)
+        return '\n'.join(row[0] for row in rows)
+    rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)
+    return '\n'.join(row[-1] for row in rows)
+
+def report(db, statements, label: str):
+    """Print plan and mean latency of every captured statement"""
+    print_header(label)
+    with db.engine.connect() as conn:
+        for statement, parameters in statements:
+            started = time.perf_counter()
+            for _ in range(RUNS):
+                conn.exec_driver_sql(statement, parameters).fetchall()
+            elapsed_ms = (time.perf_counter() - started) * 1000 / RUNS
+            # The column list is long and always the same - show the interesting part
+            sql = ' '.join(statement.split())
+            print(f"\n...{sql[sql.find(' FROM '):][:160]}")
+            print(f"  mean {elapsed_ms:.2f}ms over {RUNS} runs")
+            for line in explain(conn, statement, parameters).splitlines():
+                print(f"    {line}")
+
+def main():
+    tasks_per_user = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    if len(sys.argv) > 2:
+        os.environ['DATABASE_URL'] = sys.argv[2]
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    
+    from app import create_app, db
+    from app.migrations import upgrade
+    from app.models.task import Task
+    from app.models.user import User
+    
+    app = create_app()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        # Start from the pre-index schema that production databases still have
+        with db.engine.begin() as conn:
+            for name in ('ix_tasks_user_created', 'ix_tasks_user_status_created', 'ix_tasks_user_title'):
+                conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
+            conn.execute(text('DELETE FROM schema_version'))
+        
+        print(f"Seeding {USERS} users x {tasks_per_user} tasks on {db.engine.dialect.name}...")
+        seed(db, Task, User, tasks_per_user)
+        with db.engine.begin() as conn:
+            conn.execute(text('ANALYZE'))
+        
+        user_id = User.query.filter_by(username='bench0').first().id
+        statements = capture_list_queries(db, user_id)
+        report(db, statements, 'BEFORE - no indexes on tasks')
+        
+        applied = upgrade()
+        with db.engine.begin() as conn:
+            conn.execute(text('ANALYZE'))
+        report(db, statements, f"AFTER - migrations {applied} applied")
+
+if __name__ == '__main__':
+    main()
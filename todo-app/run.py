@@ -3,4 +3,5 @@ from app import create_app
 app = create_app()
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    # The reloader runs the app in a child process - the log store's lock allows one process only
+    app.run(debug=True, use_reloader=app.config['TASK_STORE'] != 'log')
\ No newline at end of file
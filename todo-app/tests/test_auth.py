@@ -0,0 +1,160 @@
+import os
+import unittest
+
+
+class AuthTestCase(unittest.TestCase):
+    """Registration against the unique constraints and bulk user provisioning"""
+    
+    def setUp(self):
+        os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+        from app import create_app, db
+        from app.utils.passwords import PasswordHasher
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        # Cheap hashes - these tests are about the inserts
+        self.app.extensions['passwords'] = PasswordHasher('pbkdf2:sha256:1000')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.db = db
+        self.client = self.app.test_client()
+    
+    def tearDown(self):
+        self.db.session.remove()
+        self.db.drop_all()
+        self.app_context.pop()
+        del os.environ['DATABASE_URL']
+    
+    def register(self, username, email):
+        return self.client.post('/register', data={
+            'username': username, 'email': email, 'password': 'password123', 'confirm_password': 'password123',
+        }, follow_redirects=True)
+    
+    def test_register_maps_constraint_violations(self):
+        """A taken username or email is reported from the failed INSERT"""
+        from app.models.user import User
+        self.assertIn(b'Registration successful', self.register('alice', 'alice@example.com').data)
+        self.assertIn(b'Username already exists', self.register('alice', 'other@example.com').data)
+        self.assertIn(b'Email already registered', self.register('bob', 'alice@example.com').data)
+        self.assertEqual(User.query.count(), 1)
+    
+    def test_provision_users_command(self):
+        """The CLI creates users in batches and skips taken and invalid rows"""
+        from app.models.user import User
+        self.register('user1', 'user1@example.com')
+        rows = ['username,email,password'] + [f'user{i},user{i}@example.com,secret{i:03d}' for i in range(7)]
+        rows.append('nopassword,np@example.com,')
+        path = os.path.join(self.app.instance_path, 'users-test.csv')
+        os.makedirs(self.app.instance_path, exist_ok=True)
+        with open(path, 'w') as f:
+            f.write('\n'.join(rows) + '\n')
+        self.addCleanup(os.remove, path)
+        
+        result = self.app.test_cli_runner().invoke(args=['provision-users', path, '--batch-size', '3', '--workers', '2'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Created 6 users (1 already taken, 1 invalid).', result.output)
+        self.assertEqual(User.query.count(), 7)
+        self.assertTrue(User.query.filter_by(username='user4').one().check_password('secret004'))
+    
+    def test_bulk_user_insert_without_on_conflict(self):
+        """Databases without ON CONFLICT get the same skip-taken behaviour from the generic insert"""
+        from unittest import mock
+        from app import db
+        from app.models.user import User
+        from app.utils.storage import insert_user_rows
+        self.register('alice', 'alice@example.com')
+        rows = [{'username': name, 'email': f'{email}@example.com', 'password_hash': 'x'}
+                for name, email in [('alice', 'new'), ('bob', 'alice'), ('carol', 'carol'), ('carol', 'c2'), ('dave', 'dave')]]
+        with mock.patch.object(db.engine.dialect, 'name', 'mssql'):
+            self.assertEqual(insert_user_rows(rows), 2)
+        self.assertEqual(sorted(user.username for user in User.query), ['alice', 'carol', 'dave'])
+
+    
+    def test_login_throttled_per_username(self):
+        """Attempts over the per-username limit get 429 without reaching the password check"""
+        from unittest import mock
+        self.register('alice', 'alice@example.com')
+        self.app.config['AUTH_LIMIT_PER_USERNAME'] = (3, 60)
+        hasher = self.app.extensions['passwords']
+        with mock.patch.object(hasher, 'verify', wraps=hasher.verify) as verify:
+            for _ in range(3):
+                self.assertEqual(self.client.post('/login', data={'username': 'alice', 'password': 'nope'}).status_code, 200)
+            response = self.client.post('/login', data={'username': 'alice', 'password': 'password123'})
+            self.assertEqual(verify.call_count, 3)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn(b'Too many attempts', response.data)
+        self.assertGreater(int(response.headers['Retry-After']), 0)
+        
+        # Other accounts from the same address are still served
+        self.register('bob', 'bob@example.com')
+        self.assertEqual(self.client.post('/login', data={'username': 'bob', 'password': 'password123'}).status_code, 302)
+    
+    def test_delete_account_removes_all_user_data(self):
+        """Account deletion takes tasks, archive, tombstones, counters and jobs - and nothing of others"""
+        from datetime import datetime
+        from app.models.archived_task import ArchivedTask
+        from app.models.job import Job
+        from app.models.task import Task
+        from app.models.task_stats import TaskStats
+        from app.models.task_tombstone import TaskTombstone
+        from app.models.user import User
+        self.register('alice', 'alice@example.com')
+        self.register('bob', 'bob@example.com')
+        for username in ('bob', 'alice'):
+            self.client.post('/login', data={'username': username, 'password': 'password123'})
+            for i in range(5):
+                self.client.post('/add', data={'title': f'{username} {i}'})
+            self.client.post(f'/tasks/{Task.query.filter_by(title=f"{username} 0").one().id}/delete')
+            if username == 'bob':
+                self.client.get('/logout')
+        alice = User.query.filter_by(username='alice').one().id
+        self.db.session.add(ArchivedTask(id=999, user_id=alice, title='old', created_at=datetime(2020, 1, 1),
+                                         completed_at=datetime(2020, 1, 2), archived_at=datetime(2020, 6, 1)))
+        self.db.session.commit()
+        self.app.config['ACCOUNT_DELETE_CHUNK_SIZE'] = 2
+        self.app.extensions['jobs'] = None
+        
+        response = self.client.post('/account/delete', data={'password': 'wrong'})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(Task.query.filter_by(user_id=alice).count(), 4)
+        
+        response = self.client.post('/account/delete', data={'password': 'password123'}, follow_redirects=True)
+        self.assertIn(b'Your account is being deleted', response.data)
+        self.assertEqual(self.client.get('/').status_code, 302)
+        self.db.session.expire_all()
+        for model in (User, Task, ArchivedTask, TaskTombstone, TaskStats, Job):
+            owner = model.id if model is User else model.user_id
+            self.assertEqual(model.query.filter(owner == alice).count(), 0, model.__name__)
+        self.assertEqual(Task.query.count(), 4)
+        self.assertEqual(TaskTombstone.query.count(), 1)
+    
+    def test_delete_account_checks_password_of_cached_user(self):
+        """Without a pushed app context current_user is the cached snapshot - the check loads the row"""
+        from app.models.user import User
+        self.register('alice', 'alice@example.com')
+        self.app.extensions['jobs'] = None
+        self.app_context.pop()
+        try:
+            self.client.post('/login', data={'username': 'alice', 'password': 'password123'})
+            self.assertEqual(self.client.post('/account/delete', data={'password': 'wrong'}).status_code, 403)
+            self.assertEqual(self.client.post('/account/delete', data={'password': 'password123'}).status_code, 302)
+        finally:
+            self.app_context.push()
+        self.assertIsNone(User.query.filter_by(username='alice').first())
+    
+    def test_sqlite_limiter_is_shared(self):
+        """Two limiters on one file (two workers) draw from the same counters"""
+        import tempfile
+        from app.utils.rate_limit import SQLiteRateLimiter
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'limits.db')
+            first, second = SQLiteRateLimiter(path), SQLiteRateLimiter(path)
+            self.assertIsNone(first.hit('ip:1.2.3.4', 2, 60))
+            self.assertIsNone(second.hit('ip:1.2.3.4', 2, 60))
+            self.assertIsNotNone(first.hit('ip:1.2.3.4', 2, 60))
+            self.assertIsNone(second.hit('ip:5.6.7.8', 2, 60))
+            first.reset('ip:1.2.3.4')
+            self.assertIsNone(second.hit('ip:1.2.3.4', 2, 60))
+
+
+if __name__ == '__main__':
+    unittest.main()
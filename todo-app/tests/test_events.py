@@ -0,0 +1,45 @@
+import multiprocessing
+import os
+import tempfile
+import time
+import unittest
+from app.utils.events import LocalBroker, UnixSocketBroker
+
+
+def publish_from_other_process(socket_dir):
+    UnixSocketBroker(socket_dir).publish([{'type': 'updated', 'user_id': 7, 'change_seq': 3}])
+
+
+class BrokerTestCase(unittest.TestCase):
+    """Event fan-out within a process and across processes"""
+    
+    def test_local_broker_routes_by_user(self):
+        broker = LocalBroker()
+        mine, other = broker.subscribe(1), broker.subscribe(2)
+        broker.publish([{'type': 'created', 'user_id': 1, 'change_seq': 1}])
+        self.assertEqual(mine.get_nowait()['change_seq'], 1)
+        self.assertTrue(other.empty())
+    
+    def test_slow_subscriber_gets_resync(self):
+        broker = LocalBroker(queue_size=2)
+        subscription = broker.subscribe(1)
+        broker.publish([{'type': 'updated', 'user_id': 1, 'change_seq': n} for n in range(5)])
+        self.assertEqual(subscription.get_nowait()['type'], 'resync')
+    
+    def test_unix_broker_reaches_other_processes(self):
+        socket_dir = tempfile.mkdtemp()
+        broker = UnixSocketBroker(socket_dir)
+        subscription = broker.subscribe(7)
+        # A dead peer's socket is cleaned up on the way
+        open(os.path.join(socket_dir, '999999999.sock'), 'w').close()
+        
+        child = multiprocessing.get_context('fork').Process(target=publish_from_other_process, args=(socket_dir,))
+        child.start()
+        child.join()
+        self.assertEqual(subscription.get(timeout=2)['change_seq'], 3)
+        time.sleep(0.05)
+        self.assertFalse(os.path.exists(os.path.join(socket_dir, '999999999.sock')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+
+class JobsTestCase(unittest.TestCase):
+    """Background jobs on a real thread pool, against a file database the workers can share"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(self.tmpdir, 'todo.db')
+        from app import create_app, db
+        from app.models.user import User
+        self.app = create_app()
+        self.app.config['JOBS_DIR'] = os.path.join(self.tmpdir, 'jobs')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.db = db
+        user = User(username='alice', email='alice@example.com')
+        user.set_password('password123')
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+        self.client = self.app.test_client()
+        self.client.post('/login', data={'username': 'alice', 'password': 'password123'})
+
+    def tearDown(self):
+        self.app.extensions['jobs'].shutdown(wait=True)
+        self.db.session.remove()
+        self.db.drop_all()
+        self.db.engine.dispose()
+        self.app_context.pop()
+        shutil.rmtree(self.tmpdir)
+        del os.environ['DATABASE_URL']
+
+    def add_tasks(self, count, status='pending'):
+        from app.models.task import Task
+        for i in range(count):
+            self.db.session.add(Task(title=f'Task {i}', status=status, user_id=self.user_id))
+        self.db.session.commit()
+
+    def wait_for_jobs(self):
+        """Let the pool drain, then read the jobs' final rows"""
+        from app.utils.jobs import create_executor
+        self.app.extensions['jobs'].shutdown(wait=True)
+        self.app.extensions['jobs'] = create_executor(self.app.config)
+        self.db.session.expire_all()
+
+    def test_clear_completed_job(self):
+        """A large clear is handed to a job that reports progress and updates the counters"""
+        from app.utils.storage import get_task_counts
+        self.add_tasks(30, 'completed')
+        self.add_tasks(5)
+        self.app.config['CLEAR_COMPLETED_INLINE_MAX'] = 10
+        self.app.config['CLEAR_COMPLETED_CHUNK_SIZE'] = 8
+
+        self.assertEqual(self.client.post('/clear-completed').status_code, 302)
+        self.wait_for_jobs()
+        job = self.client.get('/jobs').get_json()['jobs'][0]
+        self.assertEqual((job['kind'], job['status']), ('clear_completed', 'succeeded'))
+        self.assertEqual((job['progress'], job['total'], job['result']), (30, 30, {'deleted': 30}))
+        self.assertEqual(get_task_counts(self.user_id), (5, 0, 5))
+
+    def test_cancel_running_and_queued_jobs(self):
+        """A running job stops at its next progress report; a queued one never starts"""
+        from app.utils.jobs import HANDLERS, submit_job
+        started, release = threading.Event(), threading.Event()
+
+        def slow(user_id, params, ctx):
+            started.set()
+            release.wait(5)
+            for i in range(1000):
+                ctx.progress(i, 1000)
+            return {'finished': True}
+        HANDLERS['slow'] = slow
+        self.addCleanup(HANDLERS.pop, 'slow')
+        self.app.config['JOBS_MAX_WORKERS'] = 1
+        self.app.extensions['jobs'].shutdown()
+        from app.utils.jobs import create_executor
+        self.app.extensions['jobs'] = create_executor(self.app.config)
+
+        running = submit_job(self.user_id, 'slow').id
+        queued = submit_job(self.user_id, 'slow').id
+        self.assertTrue(started.wait(5))
+        self.assertEqual(self.client.post(f'/jobs/{queued}/cancel').status_code, 202)
+        self.assertEqual(self.client.post(f'/jobs/{running}/cancel').status_code, 202)
+        release.set()
+        self.wait_for_jobs()
+
+        first = self.client.get(f'/jobs/{running}').get_json()
+        second = self.client.get(f'/jobs/{queued}').get_json()
+        self.assertEqual((first['status'], first['progress'], first['result']), ('cancelled', 0, None))
+        self.assertEqual((second['status'], second['started_at']), ('cancelled', None))
+        self.assertEqual(self.client.post(f'/jobs/{running}/cancel').status_code, 409)
+
+    def test_submit_leaves_the_unit_of_work_alone(self):
+        """Submitting never commits the caller's staged writes; a job staged with them shares their fate"""
+        from app.models.job import Job
+        from app.models.task import Task
+        from app.utils.jobs import submit_job
+        from app.utils.storage import save_task, unit_of_work
+        with self.assertRaises(RuntimeError):
+            with unit_of_work():
+                reindex = submit_job(self.user_id, 'reindex').id
+                raise RuntimeError('abort the request')
+        with self.assertRaises(RuntimeError):
+            with unit_of_work():
+                save_task(Task(title='staged', user_id=self.user_id))
+                submit_job(self.user_id, 'clear_completed')
+                raise RuntimeError('abort the request')
+        with unit_of_work():
+            save_task(Task(title='kept', user_id=self.user_id))
+            archive = submit_job(self.user_id, 'archive').id
+        self.wait_for_jobs()
+
+        self.assertEqual([task.title for task in Task.query], ['kept'])
+        jobs = {job.id: job for job in Job.query}
+        self.assertEqual(set(jobs), {reindex, archive})
+        self.assertEqual((jobs[reindex].status, jobs[archive].status), ('succeeded', 'succeeded'))
+
+    def test_restart_recovers_orphaned_jobs(self):
+        """A new process fails jobs whose process is gone and runs the ones still queued"""
+        import socket
+        from app import create_app
+        from app.models.job import Job
+        here = socket.gethostname()
+        workers = {
+            'orphaned': f'{here}:{os.getpid()}:00000000',   # this pid, but an earlier process
+            'unrecorded': None,                             # claimed before the worker column
+            'elsewhere': 'other-host:1:00000000',
+        }
+        for kind, worker in workers.items():
+            self.db.session.add(Job(user_id=self.user_id, kind=kind, status='running', worker=worker))
+        self.db.session.add(Job(user_id=self.user_id, kind='reindex'))
+        self.db.session.commit()
+
+        restarted = create_app()
+        restarted.extensions['jobs'] = None
+        restarted.test_client().get('/login')
+        self.db.session.expire_all()
+        status = {job.kind: (job.status, job.error) for job in Job.query}
+        self.assertEqual(status['orphaned'], ('failed', 'Interrupted: the process running it exited.'))
+        self.assertEqual(status['unrecorded'][0], 'failed')
+        self.assertEqual(status['elsewhere'], ('running', None))
+        self.assertEqual(status['reindex'], ('succeeded', None))
+
+    def test_background_export_download(self):
+        """?background=1 writes the export in a job and serves it once finished"""
+        self.add_tasks(3)
+        response = self.client.get('/export.csv?background=1')
+        self.assertEqual(response.status_code, 202)
+        self.wait_for_jobs()
+        job = self.client.get(response.headers['Location']).get_json()
+        self.assertEqual((job['status'], job['result']), ('succeeded', {'rows': 3, 'format': 'csv'}))
+        download = self.client.get(f"/jobs/{job['id']}/download")
+        self.assertEqual(len(download.data.decode().splitlines()), 4)
+        download.close()
+
+        # Other users' jobs do not exist as far as this user is concerned
+        self.client.get('/logout')
+        self.assertEqual(self.client.get(f"/jobs/{job['id']}").status_code, 302)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,247 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+from tests import test_routes
+
+
+class LogTaskStoreTestCase(unittest.TestCase):
+    """Tasks kept in the append-only log store (TASK_STORE = 'log')"""
+
+    def setUp(self):
+        """Create an app whose tasks live in a log file, with one logged-in user"""
+        os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+        from app import create_app, db
+        from app.models.user import User
+        from app.utils.log_store import LogTaskStore
+
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.db = db
+
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'tasks.log')
+        self.store = LogTaskStore(self.path)
+        self.app.extensions['task_store'] = self.store
+
+        user = User(username='alice', email='alice@example.com')
+        user.set_password('password123')
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+
+        self.client = self.app.test_client()
+        self.client.post('/login', data={'username': 'alice', 'password': 'password123'})
+
+    def tearDown(self):
+        """Drop everything created by the test"""
+        self.store.close()
+        shutil.rmtree(self.dir)
+        self.db.session.remove()
+        self.db.drop_all()
+        self.app_context.pop()
+        del os.environ['DATABASE_URL']
+
+    def reopen(self):
+        """Open the log again as a restarted process would"""
+        from app.utils.log_store import LogTaskStore
+        self.store._close_files()
+        self.store._unlock()
+        self.store = LogTaskStore(self.path)
+        self.app.extensions['task_store'] = self.store
+        return self.store
+
+    def titles(self):
+        from app.utils.storage import iter_tasks
+        return {task.title: task for task in iter_tasks(self.user_id)}
+
+    def test_routes_read_and_write_the_log(self):
+        """The task pages, API and counters work with no task rows in SQL"""
+        from app.models.task import Task
+        from app.utils.storage import get_task_counts, search_tasks
+        for title in ('Walk the dog', 'Buy milk', 'Call mom'):
+            self.client.post('/add', data={'title': title})
+        tasks = self.titles()
+        self.client.post(f"/tasks/{tasks['Walk the dog'].id}/toggle")
+        self.client.post(f"/tasks/{tasks['Buy milk'].id}/edit", data={'title': 'Buy oat milk'})
+        self.client.post(f"/tasks/{tasks['Call mom'].id}/delete")
+        self.assertEqual(self.client.post('/tasks/99999/toggle').status_code, 404)
+
+        response = self.client.post('/tasks/batch', json={'operations': [
+            {'op': 'create', 'title': 'Walk the cat'},
+            {'op': 'toggle', 'id': tasks['Buy milk'].id},
+            {'op': 'delete', 'id': tasks['Call mom'].id},
+        ]})
+        self.assertEqual([r['ok'] for r in response.get_json()['results']], [True, True, False])
+
+        tasks = self.titles()
+        self.assertEqual(set(tasks), {'Walk the dog', 'Buy oat milk', 'Walk the cat'})
+        self.assertEqual(tasks['Buy oat milk'].status, 'completed')
+        self.assertEqual(get_task_counts(self.user_id), (3, 2, 1))
+        self.assertEqual([t.title for t in search_tasks(self.user_id, 'walk do').tasks], ['Walk the dog'])
+        self.assertIn('Walk the cat', self.client.get('/').get_data(as_text=True))
+        self.assertEqual(Task.query.count(), 0)
+
+        changes = self.client.get('/api/changes?since=0').get_json()
+        self.assertEqual(len(changes['upserted']), 3)
+        self.assertEqual(len(changes['deleted']), 1)
+
+        # The same state comes back from the file alone
+        self.reopen()
+        self.assertEqual(set(self.titles()), {'Walk the dog', 'Buy oat milk', 'Walk the cat'})
+        self.assertEqual(get_task_counts(self.user_id), (3, 2, 1))
+        self.assertEqual(self.client.get(f"/api/changes?since={changes['cursor']}").get_json()['upserted'], [])
+
+    def test_recovery_replays_after_checkpoint_and_drops_torn_tail(self):
+        """A restart replays only what follows the checkpoint and forgets a half-written change"""
+        from app.utils.storage import get_task_counts, insert_task_rows
+        insert_task_rows(self.user_id, [{'title': f'Task {i}', 'status': 'pending'} for i in range(5)])
+        self.store.checkpoint()
+        insert_task_rows(self.user_id, [{'title': 'After checkpoint', 'status': 'completed'}])
+        committed = os.path.getsize(self.path)
+        with open(self.path, 'ab') as f:
+            f.write(b'{"op":"put","task":{"id":99,"user_id":1,"title":"torn"')
+
+        store = self.reopen()
+        self.assertEqual(store.replayed, 1)
+        self.assertEqual(os.path.getsize(self.path), committed)
+        self.assertEqual(get_task_counts(self.user_id), (6, 1, 5))
+        self.assertIn('After checkpoint', self.titles())
+
+        # A checkpoint ahead of the file (its writes never reached the disk) is ignored
+        self.store.checkpoint()
+        with open(self.path, 'r+b') as f:
+            f.truncate(committed - 1)
+        store = self.reopen()
+        self.assertEqual(get_task_counts(self.user_id), (5, 0, 5))
+
+    def test_checkpoints_reencode_changed_users_in_the_background(self):
+        """A due checkpoint re-encodes only users written since the last one and is written off the write lock"""
+        from app.utils.log_store import LogTaskStore
+        from app.utils.storage import get_task_counts, insert_task_rows
+        self.store.close()
+        self.store = LogTaskStore(self.path, checkpoint_every=2)
+        self.app.extensions['task_store'] = self.store
+        insert_task_rows(self.user_id, [{'title': 'mine', 'status': 'pending'}])
+        insert_task_rows(self.user_id + 1, [{'title': 'theirs', 'status': 'pending'}])
+        self.store.checkpoint_thread.join()
+        self.assertTrue(os.path.exists(self.store.checkpoint_path))
+        theirs = self.store.fragments[self.user_id + 1]
+
+        # The writer thread never needs the store lock
+        with self.store.lock:
+            snapshot = self.store._snapshot()
+            writer = threading.Thread(target=self.store._write_checkpoint, args=snapshot)
+            writer.start()
+            writer.join(timeout=5)
+            self.assertFalse(writer.is_alive())
+
+        insert_task_rows(self.user_id, [{'title': 'more', 'status': 'completed'}])
+        insert_task_rows(self.user_id, [{'title': 'again', 'status': 'pending'}])
+        self.store.checkpoint_thread.join()
+        self.assertIs(self.store.fragments[self.user_id + 1], theirs)
+        store = self.reopen()
+        self.assertEqual(store.replayed, 0)
+        self.assertEqual(get_task_counts(self.user_id), (3, 1, 2))
+        self.assertEqual(get_task_counts(self.user_id + 1), (1, 0, 1))
+
+    def test_compaction_keeps_live_state(self):
+        """Compaction shrinks the log but keeps tasks, archive, tombstones and versions"""
+        from app.utils.storage import (archive_completed_tasks, get_task_version, insert_task_rows,
+                                       load_archived_page, load_changes)
+        insert_task_rows(self.user_id, [{'title': f'Task {i}', 'status': 'pending'} for i in range(20)])
+        tasks = self.titles()
+        for i in range(10):
+            self.client.post(f"/tasks/{tasks[f'Task {i}'].id}/edit", data={'title': f'Task {i}', 'description': 'x'})
+        self.client.post(f"/tasks/{tasks['Task 0'].id}/delete")
+        self.client.post(f"/tasks/{tasks['Task 1'].id}/toggle")
+        archive_completed_tasks(self.user_id, datetime.utcnow() + timedelta(seconds=1))
+        version = get_task_version(self.user_id)
+        before = os.path.getsize(self.path)
+
+        self.store.compact()
+        self.assertLess(os.path.getsize(self.path), before)
+        for store in (self.store, self.reopen()):
+            self.assertEqual(set(self.titles()), {f'Task {i}' for i in range(2, 20)})
+            self.assertEqual(get_task_version(self.user_id), version)
+            self.assertEqual([t.title for t in load_archived_page(self.user_id).tasks], ['Task 1'])
+            changes = load_changes(self.user_id, since=0)
+            self.assertEqual(sorted(task_id for task_id, _ in changes.deleted), sorted([tasks['Task 0'].id,
+                                                                                        tasks['Task 1'].id]))
+
+    def test_compaction_never_reuses_ids(self):
+        """Ids of deleted and archived tasks stay taken after compaction and a restart"""
+        from app.utils.storage import archive_completed_tasks, insert_task_rows
+        insert_task_rows(self.user_id, [{'title': 'kept', 'status': 'pending'},
+                                        {'title': 'archived', 'status': 'completed'},
+                                        {'title': 'deleted', 'status': 'pending'}])
+        tasks = self.titles()
+        archive_completed_tasks(self.user_id, datetime.utcnow() + timedelta(seconds=1))
+        self.client.post(f"/tasks/{tasks['deleted'].id}/delete")
+        self.store.compact()
+        for store in (self.store, self.reopen()):
+            self.client.post('/add', data={'title': f'new {id(store)}'})
+        new_ids = [task.id for title, task in self.titles().items() if title.startswith('new')]
+        self.assertEqual(len(new_ids), 2)
+        self.assertGreater(min(new_ids), tasks['deleted'].id)
+        changes = self.client.get('/api/changes?since=0').get_json()
+        self.assertFalse({t['id'] for t in changes['upserted']} & {d['id'] for d in changes['deleted']})
+    
+    def test_one_process_owns_the_log(self):
+        """A second open of a log in use fails before touching it; a closed log opens again"""
+        import subprocess
+        import sys
+        from app.utils.log_store import LogTaskStore, TaskLogLocked
+        from app.utils.storage import get_task_counts, insert_task_rows
+        insert_task_rows(self.user_id, [{'title': 'mine', 'status': 'pending'}])
+        with open(self.path, 'ab') as f:
+            f.write(b'{"op":"put"')  # a change the owner is still appending
+        size = os.path.getsize(self.path)
+        opener = f'from app.utils.log_store import LogTaskStore; LogTaskStore({self.path!r})'
+        result = subprocess.run([sys.executable, '-c', opener], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn(f'TaskLogLocked: The task log is in use by process {os.getpid()}', result.stderr)
+        self.assertEqual(os.path.getsize(self.path), size)
+        with self.assertRaises(TaskLogLocked):
+            LogTaskStore(self.path)
+
+        self.store.close()
+        self.store = LogTaskStore(self.path)
+        self.app.extensions['task_store'] = self.store
+        self.assertEqual(get_task_counts(self.user_id), (1, 0, 1))
+    
+    def test_delete_account_purges_the_log(self):
+        """Deleting the account forgets the user's tasks, in the log as well as in SQL"""
+        from app.models.user import User
+        from app.utils.storage import get_task_counts
+        self.client.post('/add', data={'title': 'mine'})
+        self.app.extensions['jobs'] = None
+        response = self.client.post('/account/delete', data={'password': 'password123'})
+        self.assertEqual(response.status_code, 302)
+        self.db.session.expire_all()
+        self.assertIsNone(self.db.session.get(User, self.user_id))
+        self.reopen()
+        self.assertEqual(get_task_counts(self.user_id), (0, 0, 0))
+
+
+class LogStoreRoutesTestCase(test_routes.TaskRoutesTestCase):
+    """The route suite, run against the log store"""
+
+    def store_config(self):
+        self.dir = tempfile.mkdtemp()
+        return {'TASK_STORE': 'log', 'TASK_LOG_PATH': os.path.join(self.dir, 'tasks.log')}
+
+    def tearDown(self):
+        self.app.extensions['task_store'].close()
+        shutil.rmtree(self.dir)
+        super().tearDown()
+
+
+if __name__ == '__main__':
+    unittest.main()
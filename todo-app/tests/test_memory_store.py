@@ -0,0 +1,162 @@
+import os
+import unittest
+from datetime import datetime, timedelta
+
+from tests import test_routes
+
+
+class MemoryTaskStoreTestCase(unittest.TestCase):
+    """Tasks kept in the in-process store (TASK_STORE = 'memory')"""
+
+    def setUp(self):
+        """Create an app with the memory store and one logged-in user"""
+        os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+        from app import create_app, db
+        from app.models.user import User
+        from app.utils.storage import create_user
+
+        self.app = create_app({'TASK_STORE': 'memory'})
+        self.app.config['TESTING'] = True
+        self.app.extensions['jobs'] = None
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.db = db
+
+        user = User(username='alice', email='alice@example.com')
+        user.set_password('password123')
+        self.user_id = create_user(user).id
+
+        self.client = self.app.test_client()
+        self.client.post('/login', data={'username': 'alice', 'password': 'password123'})
+
+    def tearDown(self):
+        """Drop everything created by the test"""
+        self.db.session.remove()
+        self.db.drop_all()
+        self.app_context.pop()
+        del os.environ['DATABASE_URL']
+
+    def titles(self):
+        from app.utils.storage import iter_tasks
+        return {task.title: task for task in iter_tasks(self.user_id)}
+
+    def test_create_app_selects_the_store(self):
+        """Each app built with TASK_STORE = 'memory' gets a store of its own"""
+        from app import create_app
+        from app.utils.memory_store import MemoryTaskStore
+        self.assertIsInstance(self.app.extensions['task_store'], MemoryTaskStore)
+        self.assertIsNot(create_app({'TASK_STORE': 'memory'}).extensions['task_store'],
+                         self.app.extensions['task_store'])
+        self.assertIsNone(create_app({'TASK_STORE': 'sql'}).extensions['task_store'])
+        with self.assertRaises(ValueError):
+            create_app({'TASK_STORE': 'nosql'})
+
+    def test_routes_read_and_write_the_store(self):
+        """The task pages, API, sync feed and counters work with no task rows in SQL"""
+        from app.models.task import Task
+        from app.utils.storage import get_task_counts, search_tasks
+        for title in ('Walk the dog', 'Buy milk', 'Call mom'):
+            self.client.post('/add', data={'title': title})
+        tasks = self.titles()
+        cursor = self.client.get('/api/changes?since=0').get_json()['cursor']
+        self.client.post(f"/tasks/{tasks['Walk the dog'].id}/toggle")
+        self.client.post(f"/tasks/{tasks['Buy milk'].id}/edit", data={'title': 'Buy oat milk'})
+        self.client.post(f"/tasks/{tasks['Call mom'].id}/delete")
+        self.assertEqual(self.client.post('/tasks/99999/delete').status_code, 404)
+        response = self.client.post('/tasks/batch', json={'operations': [
+            {'op': 'create', 'title': 'Walk the cat'},
+            {'op': 'toggle', 'id': tasks['Call mom'].id},
+        ]})
+        self.assertEqual([r['ok'] for r in response.get_json()['results']], [True, False])
+
+        self.assertEqual(set(self.titles()), {'Walk the dog', 'Buy oat milk', 'Walk the cat'})
+        self.assertEqual(get_task_counts(self.user_id), (3, 1, 2))
+        self.assertEqual([t.title for t in search_tasks(self.user_id, 'walk').tasks], ['Walk the cat', 'Walk the dog'])
+        self.assertIn('Buy oat milk', self.client.get('/?filter=pending').get_data(as_text=True))
+        self.assertEqual(Task.query.count(), 0)
+
+        delta = self.client.get(f'/api/changes?since={cursor}').get_json()
+        self.assertEqual({t['title'] for t in delta['upserted']}, {'Walk the dog', 'Buy oat milk', 'Walk the cat'})
+        self.assertEqual([d['id'] for d in delta['deleted']], [tasks['Call mom'].id])
+
+    def test_users_stay_out_of_sql(self):
+        """Registration, login, the user loader and duplicate checks run on the store alone"""
+        from app.models.user import User
+        from app.utils.storage import find_user, insert_user_rows
+        self.client.get('/logout')
+        form = {'username': 'bob', 'email': 'bob@example.com', 'password': 'secret1', 'confirm_password': 'secret1'}
+        self.assertEqual(self.client.post('/register', data=form).status_code, 302)
+        response = self.client.post('/register', data=dict(form, username='bobby'), follow_redirects=True)
+        self.assertIn(b'Email already registered', response.data)
+        self.assertEqual(self.client.post('/login', data={'username': 'bob', 'password': 'wrong1'}).status_code, 200)
+        self.assertEqual(self.client.post('/login', data={'username': 'bob', 'password': 'secret1'}).status_code, 302)
+        self.client.post('/add', data={'title': 'bob task'})
+        page = self.client.get('/').get_data(as_text=True)
+        self.assertIn('Welcome, <strong>bob</strong>', page)
+        self.assertIn('bob task', page)
+
+        self.assertEqual(insert_user_rows([{'username': 'bob', 'email': 'b2@example.com', 'password_hash': 'x'},
+                                           {'username': 'carol', 'email': 'c@example.com', 'password_hash': 'x'}]), 1)
+        self.assertEqual(find_user('carol').email, 'c@example.com')
+        self.assertEqual(User.query.count(), 0)
+
+    def test_pages_follow_the_sql_order_both_ways(self):
+        """Paging off the sorted indexes visits every task once, in the order SQL would use"""
+        from app.utils.storage import apply_task_batch, insert_task_rows, load_task_page
+        start = datetime(2025, 1, 1)
+        insert_task_rows(self.user_id, [{'title': f'{"bBaA"[i % 4]} {i % 5}', 'status': 'pending',
+                                         'created_at': start + timedelta(minutes=i % 7)} for i in range(23)])
+        ids = sorted(task.id for task in self.titles().values())
+        apply_task_batch(self.user_id, [{'op': 'toggle', 'id': task_id} for task_id in ids[::3]]
+                         + [{'op': 'delete', 'id': ids[4]}])
+        tasks = [task for task in load_task_page(self.user_id, page_size=100).tasks]
+        sort_keys = {
+            'none': lambda t: (t.created_at, t.id),
+            'title': lambda t: (t.title.lower(), t.id),
+            'status': lambda t: (t.status, t.title.lower(), t.id),
+        }
+        for filter_status in ('all', 'pending', 'completed'):
+            for sort_by, key in sort_keys.items():
+                expected = sorted((t.id for t in tasks if filter_status in ('all', t.status)),
+                                  key=lambda task_id: key(next(t for t in tasks if t.id == task_id)))
+                seen, page = [], load_task_page(self.user_id, filter_status, sort_by, page_size=4)
+                seen += [t.id for t in page.tasks]
+                while page.next_cursor:
+                    page = load_task_page(self.user_id, filter_status, sort_by, after=page.next_cursor, page_size=4)
+                    seen += [t.id for t in page.tasks]
+                self.assertEqual(seen, expected, (filter_status, sort_by))
+                back = [t.id for t in page.tasks]
+                while page.prev_cursor:
+                    page = load_task_page(self.user_id, filter_status, sort_by, before=page.prev_cursor, page_size=4)
+                    back = [t.id for t in page.tasks] + back
+                self.assertEqual(back, expected, (filter_status, sort_by))
+    
+    def test_archive_and_account_deletion(self):
+        """Archiving moves completed tasks aside; deleting the account drops the rest"""
+        from app.utils.storage import (archive_completed_tasks, get_task_counts, get_user, insert_task_rows,
+                                       load_archived_page)
+        start = datetime(2025, 1, 1)
+        insert_task_rows(self.user_id, [{'title': f'Task {i}', 'status': 'completed' if i % 2 else 'pending',
+                                         'created_at': start + timedelta(minutes=i)} for i in range(6)])
+        self.assertEqual(archive_completed_tasks(self.user_id, datetime.utcnow() + timedelta(seconds=1),
+                                                 batch_size=2), 3)
+        self.assertEqual(get_task_counts(self.user_id), (3, 0, 3))
+        self.assertEqual(len(load_archived_page(self.user_id).tasks), 3)
+
+        self.client.post('/account/delete', data={'password': 'password123'})
+        self.assertIsNone(get_user(self.user_id))
+        self.assertEqual(self.client.post('/login', data={'username': 'alice', 'password': 'password123'}).status_code,
+                         200)
+        self.assertEqual(get_task_counts(self.user_id), (0, 0, 0))
+        self.assertEqual(load_archived_page(self.user_id).tasks, [])
+
+
+class MemoryStoreRoutesTestCase(test_routes.TaskRoutesTestCase):
+    """The route suite, run against the memory store"""
+
+    def store_config(self):
+        return {'TASK_STORE': 'memory'}
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -79,12 +79,12 @@ class MetricsTestCase(unittest.TestCase):
     def test_login_performance(self):
         """Test login endpoint performance"""
         from app.models.user import User
+        from app.utils.storage import create_user
         
-        # Create a test user first
+        # Create a test user first (through storage, so TASK_STORE=memory keeps it out of SQL)
         user = User(username='testuser', email='test@example.com')
         user.set_password('password123')
-        self.db.session.add(user)
-        self.db.session.commit()
+        create_user(user)
         
         iterations = 100
         start_time = time.time()
@@ -0,0 +1,150 @@
+import os
+import unittest
+from sqlalchemy import text
+
+
+class MigrationsTestCase(unittest.TestCase):
+    """Schema migrations against a database created before the indexes existed"""
+    
+    def setUp(self):
+        os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+        from app import create_app, db
+        self.app = create_app()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.db = db
+    
+    def tearDown(self):
+        self.db.session.remove()
+        self.db.drop_all()
+        self.app_context.pop()
+        del os.environ['DATABASE_URL']
+    
+    def index_names(self):
+        # Read sqlite_master directly - the inspector skips expression indexes
+        with self.db.engine.connect() as conn:
+            rows = conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'tasks'"))
+            return {row[0] for row in rows}
+    
+    def test_fresh_database_is_at_head(self):
+        """create_app leaves a new database fully migrated"""
+        from app.migrations import HEAD_VERSION, current_version
+        with self.db.engine.begin() as conn:
+            self.assertEqual(current_version(conn), HEAD_VERSION)
+        self.assertIn('ix_tasks_user_status_created', self.index_names())
+    
+    def test_upgrade_adds_indexes_to_old_database(self):
+        """An old database without indexes gets them, and re-running is a no-op"""
+        from app.migrations import HEAD_VERSION, upgrade
+        with self.db.engine.begin() as conn:
+            for name in ('ix_tasks_user_created', 'ix_tasks_user_status_created', 'ix_tasks_user_title'):
+                conn.execute(text(f'DROP INDEX {name}'))
+            conn.execute(text('DELETE FROM schema_version'))
+        self.assertNotIn('ix_tasks_user_title', self.index_names())
+        
+        self.assertEqual(upgrade(), list(range(1, HEAD_VERSION + 1)))
+        self.assertIn('ix_tasks_user_title', self.index_names())
+        self.assertEqual(upgrade(), [])
+
+    def test_upgrade_adds_cascade_to_user_foreign_keys(self):
+        """An old tasks table without ON DELETE CASCADE is rebuilt with it, keeping rows and search"""
+        from sqlalchemy import inspect
+        from app.migrations import _create_task_search, upgrade
+        from app.utils.storage import search_tasks
+        with self.db.engine.begin() as conn:
+            conn.execute(text("INSERT INTO users (id, username, email, password_hash) VALUES (1, 'a', 'a@x', 'x')"))
+            conn.execute(text('PRAGMA legacy_alter_table=ON'))
+            conn.execute(text('ALTER TABLE tasks RENAME TO tasks_cascade'))
+            conn.execute(text(
+                'CREATE TABLE tasks (id INTEGER PRIMARY KEY, title VARCHAR(200) NOT NULL, description TEXT, '
+                'status VARCHAR(20), created_at DATETIME, updated_at DATETIME, '
+                'user_id INTEGER NOT NULL REFERENCES users (id), change_seq BIGINT NOT NULL DEFAULT 0)'
+            ))
+            conn.execute(text('DROP TABLE tasks_cascade'))
+            _create_task_search(conn)
+            conn.execute(text("INSERT INTO tasks (id, title, user_id) VALUES (7, 'water plants', 1)"))
+            conn.execute(text('DELETE FROM schema_version WHERE version >= 7'))
+        
+        self.assertEqual(upgrade(), [7, 8, 9, 10])
+        fks = inspect(self.db.engine).get_foreign_keys('tasks')
+        self.assertEqual([fk['options'].get('ondelete') for fk in fks], ['CASCADE'])
+        self.assertIn('ix_tasks_user_status_created', self.index_names())
+        with self.db.engine.begin() as conn:
+            conn.execute(text("INSERT INTO tasks (id, title, user_id, change_seq, created_at) "
+                              "VALUES (8, 'more plants', 1, 0, '2026-01-01 00:00:00')"))
+        self.assertEqual([task.id for task in search_tasks(1, 'plants').tasks], [8, 7])
+        with self.db.engine.begin() as conn:
+            conn.execute(text('DELETE FROM users WHERE id = 1'))
+            self.assertEqual(conn.execute(text('SELECT COUNT(*) FROM tasks')).scalar(), 0)
+    
+    def test_upgrade_stamps_tasks_delta_sync_never_returned(self):
+        """Tasks left at change_seq 0 get a new version of their owner, so a full sync returns them"""
+        from app.migrations import upgrade
+        from app.utils.storage import get_task_version, load_changes
+        with self.db.engine.begin() as conn:
+            conn.execute(text("INSERT INTO users (id, username, email, password_hash) VALUES "
+                              "(1, 'a', 'a@x', 'x'), (2, 'b', 'b@x', 'x')"))
+            conn.execute(text("INSERT INTO task_stats (user_id, total_count, completed_count, version) "
+                              "VALUES (1, 3, 0, 5)"))
+            conn.execute(text("INSERT INTO tasks (id, title, user_id, change_seq, created_at) VALUES "
+                              "(1, 'synced', 1, 5, '2025-01-01'), (2, 'old', 1, 0, '2025-01-02'), "
+                              "(3, 'older', 1, 0, '2025-01-03'), (4, 'other', 2, 0, '2025-01-04')"))
+            conn.execute(text('DELETE FROM schema_version WHERE version >= 8'))
+        
+        self.assertEqual(upgrade(), [8, 9, 10])
+        self.assertEqual(get_task_version(1), 6)
+        self.assertEqual([task.id for task in load_changes(1, since=5).tasks], [2, 3])
+        self.assertEqual([task.id for task in load_changes(2, since=0).tasks], [4])
+        self.assertGreaterEqual(get_task_version(2), load_changes(2, since=0).tasks[0].change_seq)
+    
+    def test_upgrade_backfills_task_created_at(self):
+        """Tasks without a created_at get one, the column turns NOT NULL and paging gets past them"""
+        from sqlalchemy import inspect
+        from app.migrations import _create_task_search, upgrade
+        from app.utils.storage import load_task_page
+        with self.db.engine.begin() as conn:
+            conn.execute(text("INSERT INTO users (id, username, email, password_hash) VALUES (1, 'a', 'a@x', 'x')"))
+            conn.execute(text('PRAGMA legacy_alter_table=ON'))
+            conn.execute(text('ALTER TABLE tasks RENAME TO tasks_nullable'))
+            conn.execute(text(
+                'CREATE TABLE tasks (id INTEGER PRIMARY KEY, title VARCHAR(200) NOT NULL, description TEXT, '
+                'status VARCHAR(20), created_at DATETIME, updated_at DATETIME, '
+                'user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE, change_seq BIGINT NOT NULL DEFAULT 1)'
+            ))
+            conn.execute(text('DROP TABLE tasks_nullable'))
+            _create_task_search(conn)
+            conn.execute(text("INSERT INTO tasks (id, title, user_id, created_at, updated_at) VALUES "
+                              "(1, 'dated', 1, '2025-01-01 00:00:00', NULL), "
+                              "(2, 'updated only', 1, NULL, '2025-02-01 00:00:00'), (3, 'undated', 1, NULL, NULL)"))
+            conn.execute(text('DELETE FROM schema_version WHERE version >= 10'))
+        
+        self.assertEqual(upgrade(), [10])
+        created_at = next(c for c in inspect(self.db.engine).get_columns('tasks') if c['name'] == 'created_at')
+        self.assertFalse(created_at['nullable'])
+        first = load_task_page(1, page_size=2)
+        second = load_task_page(1, after=first.next_cursor, page_size=2)
+        self.assertEqual([task.id for task in first.tasks + second.tasks], [1, 2, 3])
+    
+    def test_startup_skips_schema_setup_at_head(self):
+        """A second app on a database at head runs no create_all, and reports its phases"""
+        import shutil
+        import tempfile
+        from unittest import mock
+        from app import create_app
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmpdir, 'todo.db')
+        with mock.patch.object(self.db, 'create_all', wraps=self.db.create_all) as create_all:
+            first = create_app()
+            second = create_app()
+        self.assertEqual(create_all.call_count, 1)
+        for app in (first, second):
+            with app.app_context():
+                self.db.engine.dispose()
+        self.assertEqual(set(second.extensions['startup_timer'].timings),
+                         {'config', 'database', 'extensions', 'blueprints', 'schema'})
+        self.assertIn('total', second.test_cli_runner().invoke(args=['startup-report']).output)
+
+
+if __name__ == '__main__':
+    unittest.main()
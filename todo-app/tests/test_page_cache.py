@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+from app.utils.page_cache import MemoryPageCache, SQLitePageCache
+
+
+class PageCacheTestCase(unittest.TestCase):
+    """Both page cache backends evict the least recently used page"""
+    
+    def check_lru(self, cache):
+        cache.set('a', 'page a')
+        cache.set('b', 'page b')
+        self.assertEqual(cache.get('a'), 'page a')
+        cache.set('c', 'page c')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 'page c')
+        stats = cache.stats()
+        self.assertEqual((stats['entries'], stats['hits'], stats['misses']), (2, 2, 1))
+    
+    def test_memory_backend(self):
+        self.check_lru(MemoryPageCache(max_entries=2))
+    
+    def test_memory_backend_size_limit(self):
+        """Pages are evicted once their total length passes max_bytes; one too big is not kept"""
+        cache = MemoryPageCache(max_entries=10, max_bytes=10)
+        cache.set('a', 'x' * 4)
+        cache.set('b', 'y' * 4)
+        cache.set('a', 'x' * 5)
+        self.assertEqual(cache.stats()['bytes'], 9)
+        cache.set('c', 'z' * 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.stats()['entries'], cache.stats()['bytes']), (2, 8))
+        cache.set('d', 'w' * 11)
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual(cache.get('c'), 'zzz')
+    
+    def test_sqlite_backend_is_shared(self):
+        path = os.path.join(tempfile.mkdtemp(), 'pages.db')
+        self.check_lru(SQLitePageCache(path, max_entries=2))
+        # A second instance (another worker) sees the same pages
+        self.assertEqual(SQLitePageCache(path, max_entries=2).get('a'), 'page a')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import unittest
+
+
+class PasswordHashingTestCase(unittest.TestCase):
+    """Configurable password hashing and rehash-on-login"""
+    
+    def setUp(self):
+        os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+        from app import create_app, db
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.db = db
+    
+    def tearDown(self):
+        self.db.session.remove()
+        self.db.drop_all()
+        self.app_context.pop()
+        del os.environ['DATABASE_URL']
+    
+    def use_policy(self, method, workers=0):
+        from app.utils.passwords import PasswordHasher
+        self.app.extensions['passwords'] = PasswordHasher(method, 16, workers)
+        return self.app.extensions['passwords']
+    
+    def test_login_rehashes_outdated_hash(self):
+        """A hash made under an older cost is replaced on the next successful login"""
+        from app.models.user import User
+        self.use_policy('pbkdf2:sha256:1000')
+        user = User(username='alice', email='alice@example.com')
+        user.set_password('password123')
+        self.db.session.add(user)
+        self.db.session.commit()
+        self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:1000$'))
+        
+        self.use_policy('pbkdf2:sha256:2000')
+        client = self.app.test_client()
+        client.post('/login', data={'username': 'alice', 'password': 'wrong-password'})
+        self.assertTrue(self.db.session.get(User, user.id).password_hash.startswith('pbkdf2:sha256:1000$'))
+        
+        response = client.post('/login', data={'username': 'alice', 'password': 'password123'})
+        self.assertEqual(response.status_code, 302)
+        self.db.session.expire_all()
+        user = self.db.session.get(User, user.id)
+        self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:2000$'))
+        self.assertFalse(user.password_needs_rehash())
+        self.assertTrue(user.check_password('password123'))
+    
+    def test_default_cost_is_recognised(self):
+        """A method without an explicit cost matches hashes Werkzeug wrote with its default"""
+        hasher = self.use_policy('pbkdf2:sha256')
+        self.assertFalse(hasher.needs_rehash(hasher.hash('secret')))
+    
+    def test_process_pool_hashing(self):
+        """Hashes made in the process pool verify, in the pool and in-thread alike"""
+        from werkzeug.security import check_password_hash
+        hasher = self.use_policy('pbkdf2:sha256:1000', workers=1)
+        self.addCleanup(hasher.shutdown)
+        pwhash = hasher.hash('secret')
+        self.assertTrue(hasher.verify(pwhash, 'secret'))
+        self.assertFalse(hasher.verify(pwhash, 'not-secret'))
+        self.assertTrue(check_password_hash(pwhash, 'secret'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import itertools
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    """Read/write splitting between a primary and a replica SQLite file"""
+    
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.primary = os.path.join(self.tmpdir, 'primary.db')
+        self.replica = os.path.join(self.tmpdir, 'replica.db')
+        os.environ['DATABASE_URL'] = 'sqlite:///' + self.primary
+        os.environ['DATABASE_REPLICA_URLS'] = 'sqlite:///' + self.replica
+        from app import create_app, db
+        from app.models.user import User
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.db = db
+        user = User(username='alice', email='alice@example.com')
+        user.set_password('password123')
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+    
+    def tearDown(self):
+        self.db.session.remove()
+        self.db.drop_all()
+        for engine in [self.db.engine] + self.app.extensions['replica_engines']:
+            engine.dispose()
+        self.app_context.pop()
+        shutil.rmtree(self.tmpdir)
+        del os.environ['DATABASE_URL']
+        del os.environ['DATABASE_REPLICA_URLS']
+    
+    def replicate(self):
+        """Copy the primary over the replica, as streaming replication would"""
+        source, target = sqlite3.connect(self.primary), sqlite3.connect(self.replica)
+        source.backup(target)
+        source.close()
+        target.close()
+    
+    def titles(self, client):
+        return sorted(task['title'] for task in client.get('/api/tasks?fields=title').get_json()['tasks'])
+    
+    def test_reads_use_replica_until_the_user_writes(self):
+        """Listing reads the (lagging) replica; after a write the user reads the primary"""
+        from app.models.task import Task
+        from app.utils.storage import save_task
+        save_task(Task(title='replicated', user_id=self.user_id))
+        self.replicate()
+        save_task(Task(title='not replicated yet', user_id=self.user_id))
+        
+        client = self.app.test_client()
+        client.post('/login', data={'username': 'alice', 'password': 'password123'})
+        self.assertEqual(self.titles(client), ['replicated'])
+        
+        client.post('/add', data={'title': 'mine'})
+        self.assertEqual(self.titles(client), ['mine', 'not replicated yet', 'replicated'])
+        
+        stats = client.get('/pool-stats').get_json()
+        self.assertEqual(set(stats), {'primary', 'replica0'})
+        self.assertEqual(stats['primary']['pool'], 'QueuePool')
+    
+    def test_one_replica_per_request_and_raw_writes_count(self):
+        """A request keeps the replica it started reading from; a text() write moves it to the primary"""
+        from sqlalchemy import create_engine, select, text
+        from app.utils.replicas import replica_reads
+        first, second = self.app.extensions['replica_engines'][0], create_engine('sqlite:///' + self.replica)
+        self.addCleanup(second.dispose)
+        self.app.extensions['replicas'] = itertools.cycle([first, second])
+        session = self.db.session
+        
+        def request_binds(statement=select(1)):
+            with replica_reads(session):
+                return {session.get_bind(clause=statement) for _ in range(3)}
+        
+        with self.app.test_request_context():
+            self.app.preprocess_request()
+            self.assertEqual(request_binds(), {first})
+            self.assertEqual(request_binds(text('SELECT 1')), {first})
+            self.assertEqual(request_binds(text('UPDATE users SET email = email')), {self.db.engine})
+        with self.app.test_request_context():
+            self.app.preprocess_request()
+            self.assertEqual(request_binds(), {second})
+            session.execute(text('UPDATE users SET email = email WHERE id = :id'), {'id': self.user_id})
+            self.assertTrue(session.info['wrote'])
+            self.assertEqual(request_binds(), {self.db.engine})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,468 @@
+import os
+import unittest
+from datetime import datetime, timedelta
+from functools import wraps
+
+
+def sql_only(test):
+    """Skip a test that checks the SQL backend's own tables when another store is under test"""
+    @wraps(test)
+    def wrapper(self):
+        if self.app.extensions['task_store'] is not None:
+            self.skipTest('checks SQL task tables')
+        return test(self)
+    return wrapper
+
+
+class TaskRoutesTestCase(unittest.TestCase):
+    """Route-level tests for the task list
+
+    Data goes in and comes out through app.utils.storage only, so subclasses
+    run the same suite against another task store by overriding store_config.
+    """
+    
+    def store_config(self):
+        """Settings selecting the task store under test"""
+        return {'TASK_STORE': 'sql'}
+    
+    def setUp(self):
+        """Create an app on an in-memory database with one logged-in user"""
+        os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+        from app import create_app, db
+        from app.models.user import User
+        from app.utils.storage import create_user
+        
+        self.app = create_app(self.store_config())
+        self.app.config['TESTING'] = True
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.db = db
+        
+        user = User(username='alice', email='alice@example.com')
+        user.set_password('password123')
+        self.user_id = create_user(user).id
+        
+        self.client = self.app.test_client()
+        self.client.post('/login', data={'username': 'alice', 'password': 'password123'})
+    
+    def tearDown(self):
+        """Drop everything created by the test"""
+        self.db.session.remove()
+        self.db.drop_all()
+        self.app_context.pop()
+        del os.environ['DATABASE_URL']
+    
+    def add_tasks(self, count, status='pending', prefix='Task', old=False):
+        """Insert `count` tasks for the test user in one batch; `old` ones were last touched when created"""
+        from app.utils.storage import insert_task_rows
+        start = datetime(2025, 1, 1)
+        rows = [{'title': f'{prefix} {i:03d}', 'status': status, 'created_at': start + timedelta(minutes=i)}
+                for i in range(count)]
+        if old:
+            rows = [dict(row, updated_at=row['created_at']) for row in rows]
+        insert_task_rows(self.user_id, rows)
+    
+    def find_task(self, title):
+        """The test user's task with this title"""
+        from app.utils.storage import iter_tasks
+        return next(task for task in iter_tasks(self.user_id) if task.title == title)
+    
+    def test_index_lists_tasks(self):
+        """The index shows the user's tasks"""
+        self.add_tasks(3)
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Task 002', response.data)
+    
+    def test_keyset_pagination_walks_every_task_once(self):
+        """Following next cursors visits every task exactly once, in order"""
+        from app.utils.storage import load_task_page
+        self.add_tasks(25)
+        seen = []
+        page = load_task_page(self.user_id, page_size=10)
+        seen.extend(t.title for t in page.tasks)
+        while page.next_cursor:
+            page = load_task_page(self.user_id, after=page.next_cursor, page_size=10)
+            seen.extend(t.title for t in page.tasks)
+        self.assertEqual(seen, [f'Task {i:03d}' for i in range(25)])
+        
+        # And walking back from the last page returns the previous one
+        previous = load_task_page(self.user_id, before=page.prev_cursor, page_size=10)
+        self.assertEqual([t.title for t in previous.tasks], [f'Task {i:03d}' for i in range(10, 20)])
+        self.assertIsNotNone(previous.prev_cursor)
+    
+    def test_list_reads_do_not_load_entities(self):
+        """The list paths return plain TaskView rows and put no Task into the session"""
+        from app.models.task import Task
+        from app.utils.storage import TaskView, iter_tasks, load_task_page
+        self.add_tasks(5, 'completed')
+        loaded = lambda: [obj for obj in self.db.session.identity_map.values() if isinstance(obj, Task)]
+        for task in loaded():
+            self.db.session.expunge(task)
+        page = load_task_page(self.user_id, sort_by='title')
+        streamed = list(iter_tasks(self.user_id, filter_status='completed'))
+        self.assertEqual([type(task) for task in page.tasks + streamed], [TaskView] * 10)
+        self.assertEqual(page.tasks[0].status, 'completed')
+        self.assertIn('Task 004', self.client.get('/').get_data(as_text=True))
+        self.assertEqual(loaded(), [])
+    
+    def test_filter_and_sort_in_sql(self):
+        """Filter and title sort are applied by the query"""
+        from app.utils.storage import load_task_page
+        self.add_tasks(3, status='completed', prefix='b')
+        self.add_tasks(3, status='pending', prefix='A')
+        page = load_task_page(self.user_id, filter_status='completed', sort_by='title')
+        self.assertEqual([t.title for t in page.tasks], ['b 000', 'b 001', 'b 002'])
+        page = load_task_page(self.user_id, sort_by='status', page_size=4)
+        self.assertEqual([t.status for t in page.tasks], ['completed'] * 3 + ['pending'])
+        page = load_task_page(self.user_id, sort_by='status', after=page.next_cursor, page_size=4)
+        self.assertEqual([t.title for t in page.tasks], ['A 001', 'A 002'])
+    
+    def test_index_page_links(self):
+        """The index renders a next link when there are more tasks"""
+        self.add_tasks(5)
+        response = self.client.get('/?per_page=2')
+        self.assertIn(b'Next', response.data)
+        self.assertNotIn(b'Task 002', response.data)
+        response = self.client.get('/?after=not-a-cursor')
+        self.assertEqual(response.status_code, 200)
+        
+        # Well-formed tokens holding the wrong types are rejected like garbage
+        from app.utils.storage import encode_cursor
+        for token in (encode_cursor([5, 1]), encode_cursor(['2025-01-01T00:00:00', True])):
+            self.assertEqual(self.client.get(f'/?after={token}').status_code, 200)
+            self.assertEqual(self.client.get(f'/api/tasks?after={token}').status_code, 400)
+            self.assertEqual(self.client.get(f'/archived?after={token}').status_code, 200)
+
+    
+    def test_counters_follow_every_write(self):
+        """Add, toggle, edit and delete keep the stats row in step"""
+        from app.utils.storage import get_task_counts
+        self.client.post('/add', data={'title': 'one'})
+        self.client.post('/add', data={'title': 'two'})
+        task = self.find_task('one')
+        self.client.post(f'/tasks/{task.id}/toggle')
+        self.assertEqual(get_task_counts(self.user_id), (2, 1, 1))
+        self.client.post(f'/tasks/{task.id}/edit', data={'title': 'uno'})
+        self.client.post(f'/tasks/{task.id}/delete')
+        self.assertEqual(get_task_counts(self.user_id), (1, 0, 1))
+        self.client.post('/clear-completed')
+        self.assertEqual(get_task_counts(self.user_id), (1, 0, 1))
+    
+    @sql_only
+    def test_counters_rebuild_from_tasks(self):
+        """A missing or wrong stats row is rebuilt with a GROUP BY"""
+        from app.models.task_stats import TaskStats
+        from app.utils.storage import get_task_counts, rebuild_all_task_counts
+        self.add_tasks(4)
+        self.add_tasks(2, status='completed', prefix='Done')
+        self.assertEqual(get_task_counts(self.user_id), (6, 2, 4))
+        TaskStats.query.filter_by(user_id=self.user_id).update({'total_count': 99})
+        self.db.session.commit()
+        self.assertEqual(rebuild_all_task_counts(), 1)
+        self.assertEqual(get_task_counts(self.user_id), (6, 2, 4))
+        response = self.client.get('/')
+        self.assertIn(b'Total: <strong>6</strong>', response.data)
+
+    
+    def test_clear_completed_deletes_in_chunks(self):
+        """Clearing completed tasks is set-based and keeps the counters right"""
+        from app.utils.storage import delete_completed_tasks, get_task_counts, iter_tasks
+        self.add_tasks(7, status='completed', prefix='Done')
+        self.add_tasks(2)
+        get_task_counts(self.user_id)
+        self.assertEqual(delete_completed_tasks(self.user_id, chunk_size=3), 7)
+        self.assertEqual([t.title for t in iter_tasks(self.user_id)], ['Task 000', 'Task 001'])
+        self.assertEqual(get_task_counts(self.user_id), (2, 0, 2))
+        self.assertEqual(delete_completed_tasks(self.user_id), 0)
+
+    
+    def test_batch_endpoint(self):
+        """A batch applies every valid operation and reports each result"""
+        from app.utils.storage import get_task, get_task_counts, iter_tasks
+        self.add_tasks(3)
+        first, second, third = sorted(t.id for t in iter_tasks(self.user_id))
+        response = self.client.post('/tasks/batch', json={'operations': [
+            {'op': 'create', 'title': 'new one'},
+            {'op': 'create', 'title': ' '},
+            {'op': 'toggle', 'id': first},
+            {'op': 'edit', 'id': second, 'title': 'renamed', 'description': 'd'},
+            {'op': 'delete', 'id': third},
+            {'op': 'toggle', 'id': third},
+            {'op': 'toggle', 'id': 99999},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        results = response.get_json()['results']
+        self.assertEqual([r['ok'] for r in results], [True, False, True, True, True, False, False])
+        self.assertEqual(get_task(self.user_id, results[0]['id']).title, 'new one')
+        self.db.session.expire_all()
+        self.assertEqual(get_task(self.user_id, first).status, 'completed')
+        self.assertEqual(get_task(self.user_id, second).title, 'renamed')
+        self.assertIsNone(get_task(self.user_id, third))
+        self.assertEqual(get_task_counts(self.user_id), (3, 1, 2))
+        
+        # Values of the wrong type fail their own operation, not the request
+        response = self.client.post('/tasks/batch', json={'operations': [
+            {'op': 'create', 'title': 123},
+            {'op': 'edit', 'id': first, 'title': ['x']},
+            {'op': 'toggle', 'id': [first]},
+            {'op': 'toggle', 'id': True},
+            {'op': 'delete', 'id': str(first)},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['ok'] for r in response.get_json()['results']], [False] * 5)
+        self.assertEqual(get_task_counts(self.user_id), (3, 1, 2))
+        
+        response = self.client.post('/tasks/batch', json={'operations': 'nope'})
+        self.assertEqual(response.status_code, 400)
+        
+        # A title the column cannot hold rejects the batch and names the operation
+        response = self.client.post('/tasks/batch', json={'operations': [
+            {'op': 'toggle', 'id': first},
+            {'op': 'edit', 'id': first, 'title': 'x' * 201},
+        ]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['index'], 1)
+        self.assertIn('Operation 1', response.get_json()['error'])
+        self.assertEqual(get_task_counts(self.user_id), (3, 1, 2))
+        response = self.client.post('/add', data={'title': 'x' * 201})
+        self.assertIn(b'cannot be longer than 200 characters', response.data)
+        self.assertEqual(get_task_counts(self.user_id), (3, 1, 2))
+
+    
+    @sql_only
+    def test_one_commit_per_request(self):
+        """Storage writes in a request share one transaction; a unit of work rolls back as a whole"""
+        from sqlalchemy import event
+        from app.models.task import Task
+        from app.utils.storage import save_task, unit_of_work
+        commits = []
+        # Released SAVEPOINTs fire after_commit too - count only real COMMITs
+        listener = lambda session: session.get_nested_transaction() or commits.append(session)
+        event.listen(self.db.session, 'after_commit', listener)
+        self.addCleanup(event.remove, self.db.session, 'after_commit', listener)
+        
+        self.client.post('/add', data={'title': 'one'})
+        task_id = Task.query.filter_by(title='one').one().id
+        self.client.post(f'/tasks/{task_id}/toggle')
+        self.assertEqual(len(commits), 2)
+        
+        with self.assertRaises(RuntimeError):
+            with unit_of_work():
+                save_task(Task(title='two', user_id=self.user_id))
+                save_task(Task(title='three', user_id=self.user_id))
+                raise RuntimeError('abort the script')
+        self.assertEqual(len(commits), 2)
+        self.assertEqual(Task.query.count(), 1)
+    
+    def test_api_tasks_etag(self):
+        """The JSON API pages, selects fields and answers 304 until a write"""
+        self.add_tasks(3)
+        response = self.client.get('/api/tasks?fields=id,title&per_page=2')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()
+        self.assertEqual(set(data['tasks'][0]), {'id', 'title'})
+        self.assertIsNotNone(data['next_cursor'])
+        etag = response.headers['ETag']
+        
+        response = self.client.get('/api/tasks?fields=id,title&per_page=2', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/api/tasks?fields=id&per_page=2', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        
+        self.client.post(f"/tasks/{data['tasks'][0]['id']}/edit", data={'title': 'changed'})
+        response = self.client.get('/api/tasks?fields=id,title&per_page=2', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['tasks'][0]['title'], 'changed')
+        
+        self.assertEqual(self.client.get('/api/tasks?fields=secret').status_code, 400)
+
+    
+    def test_search_uses_full_text_index(self):
+        """Search ranks title matches first and follows edits and deletes"""
+        self.client.post('/add', data={'title': 'Buy milk', 'description': 'at the store'})
+        self.client.post('/add', data={'title': 'Walk the dog', 'description': 'then buy milk'})
+        self.client.post('/add', data={'title': 'Unrelated'})
+        data = self.client.get('/api/search?q=milk').get_json()
+        self.assertEqual([t['title'] for t in data['tasks']], ['Buy milk', 'Walk the dog'])
+        
+        dog = self.find_task('Walk the dog')
+        self.client.post(f'/tasks/{dog.id}/edit', data={'title': 'Walk the cat', 'description': ''})
+        data = self.client.get('/api/search?q=milk').get_json()
+        self.assertEqual([t['title'] for t in data['tasks']], ['Buy milk'])
+        self.client.post(f'/tasks/{dog.id}/delete')
+        self.assertEqual(self.client.get('/api/search?q=cat').get_json()['tasks'], [])
+        
+        response = self.client.get('/search?q=mil')
+        self.assertIn(b'Buy milk', response.data)
+
+    
+    def test_index_page_cache(self):
+        """Repeated index views are served from cache until a write"""
+        self.client.post('/add', data={'title': 'cached'})
+        self.client.get('/')
+        response = self.client.get('/')
+        self.assertIn(b'cached', response.data)
+        stats = self.client.get('/cache-stats').get_json()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        
+        self.client.post('/add', data={'title': 'fresh write'})
+        self.assertIn(b'fresh write', self.client.get('/').data)
+        self.assertEqual(self.client.get('/cache-stats').get_json()['misses'], 2)
+
+    
+    @sql_only
+    def test_user_loader_cache(self):
+        """The user loader serves a cached snapshot until the user row changes"""
+        from app import load_user
+        from app.models.user import User
+        cache = self.app.extensions['user_cache']
+        cache.clear()
+        self.assertEqual(load_user(str(self.user_id)).username, 'alice')
+        self.assertIs(load_user(str(self.user_id)), load_user(str(self.user_id)))
+        self.assertEqual((cache.misses, cache.hits), (1, 2))
+        
+        self.db.session.get(User, self.user_id).username = 'alice2'
+        self.db.session.commit()
+        self.assertEqual(load_user(str(self.user_id)).username, 'alice2')
+        stats = self.client.get('/cache-stats').get_json()['user_cache']
+        self.assertEqual((stats['invalidations'], stats['misses']), (1, 2))
+    
+    @sql_only
+    def test_user_deleted_by_another_worker(self):
+        """A cached user whose row is gone is logged out on the next write, not answered with a 500"""
+        from sqlalchemy import delete
+        from app import load_user
+        from app.models.user import User
+        load_user(str(self.user_id))
+        # A bulk delete skips the ORM events, like a delete in another process
+        self.db.session.execute(delete(User).where(User.id == self.user_id))
+        self.db.session.commit()
+        self.assertIsNotNone(self.app.extensions['user_cache'].get(self.user_id))
+        
+        response = self.client.post('/add', data={'title': 'orphan'})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/login', response.headers['Location'])
+        self.assertIsNone(self.app.extensions['user_cache'].get(self.user_id))
+        self.assertEqual(self.client.get('/').status_code, 302)
+    
+    def test_streamed_index(self):
+        """Stream mode sends the counters first and every task in chunks"""
+        self.add_tasks(30)
+        self.app.config['STREAM_CHUNK_ROWS'] = 7
+        response = self.client.get('/?stream=1&filter=pending', buffered=False)
+        self.assertTrue(response.is_streamed)
+        chunks = list(response.response)
+        self.assertGreater(len(chunks), 1)
+        self.assertIn(b'Total: <strong>30</strong>', chunks[0])
+        body = b''.join(chunks)
+        self.assertIn(b'Task 000', body)
+        self.assertIn(b'Task 029', body)
+        self.assertNotIn(b'Next &raquo;', body)
+        response.close()
+
+    
+    def test_delta_sync(self):
+        """The changes feed returns only what happened after the cursor"""
+        from app.utils.storage import get_task_counts
+        self.client.post('/add', data={'title': 'first'})
+        self.client.post('/add', data={'title': 'second'})
+        full = self.client.get('/api/changes?since=0').get_json()
+        self.assertEqual([t['title'] for t in full['upserted']], ['first', 'second'])
+        cursor = full['cursor']
+        
+        self.assertEqual(self.client.get(f'/api/changes?since={cursor}').get_json()['upserted'], [])
+        
+        first = self.find_task('first')
+        second_id = self.find_task('second').id
+        self.client.post(f'/tasks/{first.id}/toggle')
+        self.client.post(f'/tasks/{second_id}/delete')
+        self.client.post('/tasks/batch', json={'operations': [{'op': 'create', 'title': 'third'},
+                                                              {'op': 'create', 'title': 'fourth'}]})
+        
+        delta = self.client.get(f'/api/changes?since={cursor}&limit=1').get_json()
+        self.assertEqual([t['title'] for t in delta['upserted']], ['first'])
+        self.assertTrue(delta['has_more'])
+        delta = self.client.get(f"/api/changes?since={delta['cursor']}&limit=1").get_json()
+        self.assertEqual(delta['deleted'], [{'id': second_id, 'change_seq': delta['cursor']}])
+        # Both creates share one version, so they arrive together despite the limit
+        delta = self.client.get(f"/api/changes?since={delta['cursor']}&limit=1").get_json()
+        self.assertEqual([t['title'] for t in delta['upserted']], ['third', 'fourth'])
+        self.assertFalse(delta['has_more'])
+        
+        # Rows added straight through the ORM are stamped and counted too
+        if self.app.extensions['task_store'] is None:
+            from app.models.task import Task
+            self.db.session.add_all([Task(title=f'Direct {i}', user_id=self.user_id) for i in range(2)])
+            self.db.session.commit()
+            delta = self.client.get(f"/api/changes?since={delta['cursor']}").get_json()
+            self.assertEqual([t['title'] for t in delta['upserted']], ['Direct 0', 'Direct 1'])
+            self.assertEqual(get_task_counts(self.user_id).total_count, 5)
+
+    def test_archive_moves_old_completed_tasks(self):
+        """Old completed tasks move to the archive in batches and stay browsable there"""
+        from app.utils.storage import archive_completed_tasks, get_task_counts
+        self.add_tasks(25, 'completed', prefix='Old', old=True)
+        self.add_tasks(3)
+        self.client.post('/add', data={'title': 'recent'})
+        recent_id = self.client.get('/api/changes?since=0').get_json()['upserted'][-1]['id']
+        self.client.post(f'/tasks/{recent_id}/toggle')
+        cursor = self.client.get('/api/changes?since=0').get_json()['cursor']
+        
+        # A sweep interrupted after its first batch keeps that batch...
+        def interrupt(archived):
+            raise KeyboardInterrupt
+        cutoff = datetime.utcnow() - timedelta(days=self.app.config['ARCHIVE_AFTER_DAYS'])
+        with self.assertRaises(KeyboardInterrupt):
+            archive_completed_tasks(self.user_id, cutoff, batch_size=10, on_batch=interrupt)
+        self.assertEqual(get_task_counts(self.user_id), (19, 16, 3))
+        
+        # ...and the next run picks up the rest
+        self.app.config['ARCHIVE_BATCH_SIZE'] = 10
+        self.app.extensions['jobs'] = None
+        response = self.client.post('/jobs/archive')
+        self.assertEqual(response.status_code, 202)
+        job = self.client.get(response.headers['Location']).get_json()
+        self.assertEqual((job['status'], job['result']), ('succeeded', {'archived': 15}))
+        self.assertEqual(get_task_counts(self.user_id), (4, 1, 3))
+        
+        delta = self.client.get(f'/api/changes?since={cursor}').get_json()
+        self.assertEqual(len(delta['deleted']), 25)
+        
+        page = self.client.get('/archived?per_page=20').get_data(as_text=True)
+        self.assertIn('Old 024', page)
+        self.assertNotIn('Old 004', page)
+        self.assertNotIn('recent', page)
+        older = page.split('href="/archived?after=')[1].split('"')[0]
+        self.assertIn('Old 004', self.client.get(f'/archived?after={older}&per_page=20').get_data(as_text=True))
+    
+    def test_event_stream_publishes_committed_changes(self):
+        """Writes reach open /events streams after commit, rolled back ones never do"""
+        self.app.config['EVENTS_KEEPALIVE_SECONDS'] = 0.05
+        response = self.client.get('/events', buffered=False)
+        stream = iter(response.response)
+        self.assertEqual(next(stream), b'retry: 3000\n\n')
+        
+        self.client.post('/add', data={'title': 'live'})
+        chunk = next(stream).decode()
+        self.assertIn('event: created', chunk)
+        self.assertIn('"title": "live"', chunk)
+        
+        task = self.find_task('live')
+        if self.app.extensions['task_store'] is None:
+            from app.models.task import Task
+            self.db.session.get(Task, task.id).title = 'never committed'
+            self.db.session.info.setdefault('task_events', []).append({'type': 'updated', 'user_id': self.user_id})
+            self.db.session.rollback()
+        self.assertEqual(next(stream), b': keepalive\n\n')
+        
+        self.client.post(f'/tasks/{task.id}/delete')
+        chunk = next(stream).decode()
+        self.assertIn('event: deleted', chunk)
+        self.assertIn('"pending_count": 0', chunk)
+        response.close()
+        self.assertEqual(self.app.extensions['events'].subscriber_count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import io
+import json
+import os
+import unittest
+
+LEGACY_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'tasks.json')
+
+
+class TransferTestCase(unittest.TestCase):
+    """Streaming export and batched import of tasks"""
+    
+    def setUp(self):
+        os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+        from app import create_app, db
+        from app.models.user import User
+        self.app = create_app()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.db = db
+        user = User(username='alice', email='alice@example.com')
+        user.set_password('password123')
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+    
+    def tearDown(self):
+        self.db.session.remove()
+        self.db.drop_all()
+        self.app_context.pop()
+        del os.environ['DATABASE_URL']
+    
+    def test_legacy_json_import(self):
+        """data/tasks.json loads with its timestamps and without its ids"""
+        from app.models.task import Task
+        from app.utils.storage import get_task_counts
+        from app.utils.transfer import import_tasks
+        with open(LEGACY_FILE, encoding='utf-8') as f:
+            legacy = json.load(f)
+        with open(LEGACY_FILE, encoding='utf-8') as f:
+            imported, skipped = import_tasks(self.user_id, f, 'legacy', batch_size=2)
+        self.assertEqual((imported, skipped), (len(legacy), 0))
+        task = Task.query.filter_by(title=legacy[0]['title']).first()
+        self.assertEqual(task.created_at.isoformat(), legacy[0]['created_at'])
+        completed = sum(1 for t in legacy if t['status'] == 'completed')
+        self.assertEqual(get_task_counts(self.user_id), (len(legacy), completed, len(legacy) - completed))
+    
+    def test_json_array_parser_is_incremental(self):
+        """Objects split across reads still parse"""
+        from app.utils.transfer import iter_json_array
+        records = [{'title': f'task {i}', 'description': 'x' * i} for i in range(50)]
+        parsed = list(iter_json_array(io.StringIO(json.dumps(records, indent=2)), read_size=7))
+        self.assertEqual(parsed, records)
+        # Numbers and whitespace can straddle a read too
+        self.assertEqual(list(iter_json_array(io.StringIO(' [ 12345 ,\n 678, "x" ] '), read_size=2)), [12345, 678, 'x'])
+        for broken in ('[{"title": "a"}, ', '{"title": "a"}', ''):
+            with self.assertRaises(ValueError):
+                list(iter_json_array(io.StringIO(broken), read_size=3))
+    
+    def test_non_object_records_are_skipped(self):
+        """Bare values in an import are counted as skipped instead of failing it"""
+        from app.utils.transfer import import_tasks
+        self.assertEqual(import_tasks(self.user_id, io.StringIO('{"title": "one"}\n1\n"x"\n'), 'ndjson'), (1, 2))
+        self.assertEqual(import_tasks(self.user_id, io.StringIO('[1, {"title": "two"}, null]'), 'legacy'), (1, 2))
+    
+    def test_export_import_round_trip(self):
+        """NDJSON and CSV exports import back into an identical list"""
+        from app.models.task import Task
+        from app.utils.transfer import export_csv, export_ndjson, import_tasks
+        import_tasks(self.user_id, io.StringIO('{"title": "a, \\"quoted\\"", "status": "completed"}\n'
+                                               '{"title": ""}\n{"title": "b"}\n'), 'ndjson')
+        ndjson = ''.join(export_ndjson(self.user_id, chunk_size=1))
+        csv_text = ''.join(export_csv(self.user_id, chunk_size=1))
+        self.assertEqual(len(ndjson.splitlines()), 2)
+        
+        self.assertEqual(import_tasks(self.user_id, io.StringIO(csv_text), 'csv'), (2, 0))
+        titles = sorted(t.title for t in Task.query.filter_by(user_id=self.user_id))
+        self.assertEqual(titles, ['a, "quoted"', 'a, "quoted"', 'b', 'b'])
+    
+    def test_export_endpoint_streams(self):
+        """The download endpoint streams NDJSON for the logged-in user"""
+        from app.utils.transfer import import_tasks
+        import_tasks(self.user_id, io.StringIO('{"title": "one"}\n{"title": "two"}\n'), 'ndjson')
+        client = self.app.test_client()
+        client.post('/login', data={'username': 'alice', 'password': 'password123'})
+        response = client.get('/export.ndjson')
+        self.assertEqual([json.loads(line)['title'] for line in response.data.splitlines()], ['one', 'two'])
+        
+        self.app.extensions['jobs'] = None
+        response = client.post('/import', data={'file': (io.BytesIO(b'title,status\nthree,completed\n'), 't.csv')})
+        self.assertEqual(response.status_code, 202)
+        job = client.get(response.headers['Location']).get_json()
+        self.assertEqual((job['status'], job['result']), ('succeeded', {'imported': 1, 'skipped': 0}))
+
+
+if __name__ == '__main__':
+    unittest.main()